@@ -1,5 +1,12 @@
-from .server import create_app
+def __getattr__(name):
+    # `python -m app.batch` 等の CLI が Flask アプリ（アップロード先の作成を含む）を読み込まないよう遅延インポートする
+    if name == "create_app":
+        from .server import create_app
+        return create_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
+    from .server import create_app
     app = create_app()
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,162 @@
+"""図面ディレクトリのオフライン一括処理（CLI）
+
+    python -m app.batch DIR [-o results.jsonl] [--workers N] [--save-assignments | --solve-assignments]
+
+DIR 以下の図面を再帰的に走査し、内容ハッシュの計算と解析→工程分解→企業マッチングを
+プロセスプールで実行して1図面1行のJSONLに追記する。出力済み（ok）の内容ハッシュはスキップするため、中断後に同じ
+コマンドを再実行すれば続きから処理される。
+--solve-assignments は今回処理した全図面の工程を企業の容量内で一括割当（最小費用流）して保存する。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Set
+
+from .constants import ALLOWED_EXT
+from .db.company_db import init_db, save_assignment
+from .services.assignment_solver import jobs_from_dicts, save_plan, solve as solve_assignments
+from .services.hashing import file_sha256
+from .services.pipeline import run_pipeline
+
+
+def iter_drawings(root: Path, exts: Set[str]) -> Iterator[Path]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.startswith("."):
+                continue
+            if name.rsplit(".", 1)[-1].lower() in exts:
+                yield Path(dirpath) / name
+
+
+def load_done(out: Path) -> Set[str]:
+    """既存JSONLから処理済み（ok）の内容ハッシュを集める。"""
+    done: Set[str] = set()
+    if not out.exists():
+        return done
+    with open(out, encoding="utf-8") as fp:
+        for line in fp:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # 中断で途中まで書かれた行
+            if rec.get("ok") and rec.get("sha256"):
+                done.add(rec["sha256"])
+    return done
+
+
+def _process(path: str, sha256: str, top_n: int, rules_only: bool) -> Dict[str, Any]:
+    # プロセスプール内で実行
+    t0 = time.perf_counter()
+    rec: Dict[str, Any] = {"path": path, "sha256": sha256}
+    try:
+        rec["result"] = run_pipeline(Path(path), top_n=top_n, rules_only=rules_only)
+        rec["ok"] = True
+    except Exception as e:
+        rec["ok"] = False
+        rec["error"] = f"{type(e).__name__}: {e}"
+    rec["seconds"] = round(time.perf_counter() - t0, 3)
+    return rec
+
+
+def save_best_assignments(rec: Dict[str, Any]) -> int:
+    """各工程を、その工程をカバーする最上位企業に割り当ててDBへ保存する。"""
+    result = rec.get("result") or {}
+    matches: List[Dict[str, Any]] = result.get("matches") or []
+    drawing = Path(rec["path"]).name
+    n = 0
+    for step in result.get("steps") or []:
+        best = next((m for m in matches if step["name"] in m["steps"]), None)
+        if best:
+            save_assignment(step["name"], int(best["company"]["id"]), drawing)
+            n += 1
+    return n
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.batch", description="図面ディレクトリを一括解析してJSONLに出力")
+    ap.add_argument("dir", help="図面ディレクトリ（再帰的に走査）")
+    ap.add_argument("-o", "--out", default="batch_results.jsonl", help="出力JSONL（追記）")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列プロセス数")
+    ap.add_argument("--top-n", type=int, default=10, help="1図面あたり出力する上位マッチ数")
+    ap.add_argument("--ext", action="append", help="対象拡張子（既定: アップロード許可拡張子）")
+    ap.add_argument("--save-assignments", action="store_true", help="各工程の最上位企業への割当をDBに保存")
+    ap.add_argument("--solve-assignments", action="store_true", help="全図面の工程を企業の容量内で一括割当してDBに保存")
+    ap.add_argument("--fast", action="store_true", help="LLMを使わずルールベースのみで処理")
+    ap.add_argument("--progress-every", type=int, default=50, help="進捗表示の間隔（件）")
+    args = ap.parse_args(argv)
+
+    root = Path(args.dir)
+    if not root.is_dir():
+        print(f"ディレクトリが見つかりません: {root}", file=sys.stderr)
+        return 2
+    exts = {e.lower().lstrip(".") for e in args.ext} if args.ext else set(ALLOWED_EXT)
+    out = Path(args.out)
+    done = load_done(out)
+
+    paths = list(iter_drawings(root, exts))
+    print(f"{len(paths)} drawings found ({len(done)} already done in {out})", file=sys.stderr)
+    if not paths:
+        return 0
+
+    init_db(seed=True)  # ワーカー間でのスキーマ作成競合を避ける
+    ok = failed = assigned = skipped = n = 0
+    solved: List[Dict[str, Any]] = []
+    seen = set(done)
+    t0 = time.perf_counter()
+    with open(out, "a", encoding="utf-8") as fp, ProcessPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        # ハッシュ計算もワーカーで行い、済んだものから（処理済み・重複でなければ）解析を投入する
+        hashing = {ex.submit(file_sha256, p): p for p in paths}
+        pending = set(hashing)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                if fut in hashing:
+                    p = hashing.pop(fut)
+                    try:
+                        h = fut.result()
+                    except OSError as e:
+                        rec = {"path": str(p), "ok": False, "error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+                    else:
+                        if h in seen:
+                            skipped += 1
+                            continue
+                        seen.add(h)
+                        pending.add(ex.submit(_process, str(p), h, args.top_n, args.fast))
+                        continue
+                else:
+                    rec = fut.result()
+                n += 1
+                fp.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+                fp.flush()
+                if rec["ok"]:
+                    ok += 1
+                    if args.solve_assignments:
+                        solved.append({"drawing_file": Path(rec["path"]).name, "steps": rec["result"].get("steps") or []})
+                    elif args.save_assignments:
+                        assigned += save_best_assignments(rec)
+                else:
+                    failed += 1
+                total = len(paths) - skipped  # ハッシュ計算中は上限の見込み
+                if n % max(1, args.progress_every) == 0 or n == total:
+                    elapsed = time.perf_counter() - t0
+                    rate = n / elapsed if elapsed > 0 else 0.0
+                    eta = (total - n) / rate if rate > 0 else 0.0
+                    print(f"[{n}/{total}] {rate:.2f} files/s, ok={ok} failed={failed}, eta {eta:.0f}s", file=sys.stderr, flush=True)
+    if solved:
+        plan = solve_assignments(jobs_from_dicts(solved))
+        assigned += save_plan(plan)
+        print(f"solved: {len(plan.assignments)} steps, {len(plan.unassigned)} unassigned, "
+              f"{len(plan.overbooked)} overbooked companies, {plan.seconds:.1f}s", file=sys.stderr)
+    elapsed = time.perf_counter() - t0
+    print(f"done: {ok} ok, {failed} failed, {skipped} skipped (already done / duplicate), {assigned} assignments, "
+          f"{elapsed:.1f}s ({n / elapsed if elapsed > 0 else 0:.2f} files/s)", file=sys.stderr)
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+"""サーバ・CLI で共有する定数（Flask アプリを読み込まずに参照できるよう分けている）"""
+
+# アップロード・一括処理の対象拡張子
+ALLOWED_EXT = {"pdf", "png", "jpg", "jpeg", "dxf", "dwg"}
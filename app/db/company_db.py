@@ -1,7 +1,9 @@
 from dataclasses import dataclass
-from typing import List, Optional, Iterable, Tuple, Dict, Any
+from typing import List, Optional, Iterable, Tuple, Dict, Any, Sequence
 import sqlite3
 from pathlib import Path
+from ..services.metrics import timed
+from ..services.geo import geocode, geocode_rows
 
 DB_PATH = Path(__file__).resolve().parent / "companies.sqlite"
 
@@ -14,6 +16,10 @@ class CompanyRow:
     notes: str
     capacity: Optional[str] = ""
     location: Optional[str] = ""
+    row_version: int = 0  # 行の更新のたびに加算（スコアのメモ化キー）
+    lat: Optional[float] = None  # location のジオコーディング結果（不明なら None）
+    lon: Optional[float] = None
+    envelopes: Optional[str] = None  # 装置ごとの加工可能範囲（JSON。services/envelope.py 参照）
 
 
 def _conn():
@@ -25,6 +31,170 @@ def _has_column(con: sqlite3.Connection, table: str, col: str) -> bool:
     return any(r[1] == col for r in cur.fetchall())
 
 
+def _version_triggers(con: sqlite3.Connection, table: str) -> None:
+    """table の INSERT/UPDATE/DELETE のたびに data_versions の version と changed_at（UNIX秒）を更新するトリガ"""
+    con.execute("INSERT OR IGNORE INTO data_versions(name, version) VALUES(?, 0)", (table,))
+    for ev in ("INSERT", "UPDATE", "DELETE"):
+        con.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_version_{ev.lower()} AFTER {ev} ON {table} "
+            f"BEGIN UPDATE data_versions SET version = version + 1, changed_at = CAST(strftime('%s','now') AS INTEGER) "
+            f"WHERE name = '{table}'; END"
+        )
+
+
+def _ensure_versions(con: sqlite3.Connection) -> None:
+    """テーブルごとの変更カウンタ（トリガで INSERT/UPDATE/DELETE のたびに加算）"""
+    con.execute("CREATE TABLE IF NOT EXISTS data_versions(name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    if not _has_column(con, "data_versions", "changed_at"):
+        # 旧トリガは changed_at を更新しないため作り直す
+        con.execute("ALTER TABLE data_versions ADD COLUMN changed_at INTEGER NOT NULL DEFAULT 0")
+        con.execute("UPDATE data_versions SET changed_at = CAST(strftime('%s','now') AS INTEGER)")
+        for ev in ("insert", "update", "delete"):
+            con.execute(f"DROP TRIGGER IF EXISTS companies_version_{ev}")
+    _version_triggers(con, "companies")
+    if not _has_column(con, "companies", "row_version"):
+        con.execute("ALTER TABLE companies ADD COLUMN row_version INTEGER DEFAULT 0")
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS companies_row_version AFTER UPDATE OF name, machines, skills, notes, capacity, location "
+        "ON companies BEGIN UPDATE companies SET row_version = row_version + 1 WHERE id = NEW.id; END"
+    )
+
+
+def _ensure_geo(con: sqlite3.Connection) -> None:
+    """lat/lon 列を追加し、未ジオコーディングの所在地を埋める。"""
+    for col in ("lat", "lon"):
+        if not _has_column(con, "companies", col):
+            con.execute(f"ALTER TABLE companies ADD COLUMN {col} REAL")
+    rows = con.execute("SELECT id, location FROM companies WHERE lat IS NULL AND location IS NOT NULL AND location <> ''").fetchall()
+    found = [r for r in geocode_rows(rows) if r[0] is not None]
+    if found:
+        con.executemany("UPDATE companies SET lat=?, lon=? WHERE id=?", found)
+
+
+def _ensure_envelopes(con: sqlite3.Connection) -> None:
+    if not _has_column(con, "companies", "envelopes"):
+        con.execute("ALTER TABLE companies ADD COLUMN envelopes TEXT")
+
+
+_ready: set = set()
+
+
+def ensure_db() -> None:
+    """init_db(seed=True) をDBファイルごとに1回だけ実行する。"""
+    key = (str(DB_PATH), DB_PATH.stat().st_ino if DB_PATH.exists() else None)
+    if key in _ready:
+        return
+    init_db(seed=True)
+    _ready.add((str(DB_PATH), DB_PATH.stat().st_ino))
+
+
+@timed("db.data_version")
+def data_version(name: str = "companies") -> int:
+    with _conn() as con:
+        row = con.execute("SELECT version FROM data_versions WHERE name=?", (name,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+@timed("db.data_stamp")
+def data_stamp(*names: str) -> Tuple[Tuple[int, ...], int]:
+    """names の変更カウンタと、そのうち最も新しい変更時刻（UNIX秒）。条件付きGETの ETag/Last-Modified 用"""
+    with _conn() as con:
+        rows = dict(
+            (n, (int(v), int(t or 0)))
+            for n, v, t in con.execute(
+                f"SELECT name, version, changed_at FROM data_versions WHERE name IN ({','.join('?' * len(names))})", names
+            )
+        )
+    stamps = [rows.get(n, (0, 0)) for n in names]
+    return tuple(v for v, _ in stamps), max((t for _, t in stamps), default=0)
+
+
+@timed("db.fetch_row_versions")
+def fetch_row_versions() -> Dict[int, int]:
+    """企業ID → row_version（文字n-gram索引の差分更新用）"""
+    with _conn() as con:
+        return {int(i): int(v or 0) for i, v in con.execute("SELECT id, row_version FROM companies")}
+
+
+def _ensure_ngram_table(con: sqlite3.Connection) -> None:
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS company_ngrams(company_id INTEGER PRIMARY KEY, row_version INTEGER NOT NULL, grams TEXT NOT NULL)"
+    )
+
+
+@timed("db.fetch_ngram_docs")
+def fetch_ngram_docs() -> Dict[int, Tuple[int, str]]:
+    """保存済みの n-gram 頻度: 企業ID → (row_version, JSON)"""
+    with _conn() as con:
+        _ensure_ngram_table(con)
+        rows = con.execute("SELECT company_id, row_version, grams FROM company_ngrams").fetchall()
+    return {int(i): (int(v), g) for i, v, g in rows}
+
+
+@timed("db.save_ngram_docs")
+def save_ngram_docs(rows: Iterable[Tuple[int, int, str]], deleted: Iterable[int] = ()) -> None:
+    """(企業ID, row_version, JSON) を保存し、deleted の企業を削除する。"""
+    with _conn() as con:
+        _ensure_ngram_table(con)
+        con.executemany("INSERT OR REPLACE INTO company_ngrams(company_id, row_version, grams) VALUES(?,?,?)", list(rows))
+        con.executemany("DELETE FROM company_ngrams WHERE company_id=?", [(int(i),) for i in deleted])
+
+
+def _ensure_plans_table(con: sqlite3.Connection) -> None:
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS process_plans(material TEXT NOT NULL, part_type TEXT NOT NULL, has_dims INTEGER NOT NULL, "
+        "steps TEXT NOT NULL, source TEXT NOT NULL, updated_at INTEGER NOT NULL, "
+        "PRIMARY KEY(material, part_type, has_dims)) WITHOUT ROWID"
+    )
+
+
+@timed("db.fetch_process_plan")
+def fetch_process_plan(material: str, part_type: str, has_dims: int) -> Optional[Tuple[str, str]]:
+    """(材質, 部品種別, 寸法表記の有無) の工程計画 → (工程JSON, source)。なければ None"""
+    with _conn() as con:
+        _ensure_plans_table(con)
+        return con.execute(
+            "SELECT steps, source FROM process_plans WHERE material=? AND part_type=? AND has_dims=?",
+            (material, part_type, int(has_dims)),
+        ).fetchone()
+
+
+@timed("db.fetch_process_plans")
+def fetch_process_plans() -> List[Tuple[str, str, int, str, str, int]]:
+    """全工程計画: (material, part_type, has_dims, steps, source, updated_at)"""
+    with _conn() as con:
+        _ensure_plans_table(con)
+        return con.execute(
+            "SELECT material, part_type, has_dims, steps, source, updated_at FROM process_plans ORDER BY material, part_type, has_dims"
+        ).fetchall()
+
+
+@timed("db.save_process_plan")
+def save_process_plan(material: str, part_type: str, has_dims: int, steps: str, source: str, keep_admin: bool = True) -> bool:
+    """工程計画を保存する。keep_admin なら管理者が編集した計画（source='admin'）は上書きしない。保存したら True"""
+    with _conn() as con:
+        _ensure_plans_table(con)
+        cur = con.execute(
+            "INSERT INTO process_plans(material, part_type, has_dims, steps, source, updated_at) "
+            "VALUES(?,?,?,?,?,CAST(strftime('%s','now') AS INTEGER)) "
+            "ON CONFLICT(material, part_type, has_dims) DO UPDATE SET steps=excluded.steps, source=excluded.source, "
+            "updated_at=excluded.updated_at" + (" WHERE process_plans.source <> 'admin'" if keep_admin else ""),
+            (material, part_type, int(has_dims), steps, source),
+        )
+        return cur.rowcount > 0
+
+
+@timed("db.delete_process_plan")
+def delete_process_plan(material: str, part_type: str, has_dims: int) -> bool:
+    with _conn() as con:
+        _ensure_plans_table(con)
+        cur = con.execute(
+            "DELETE FROM process_plans WHERE material=? AND part_type=? AND has_dims=?", (material, part_type, int(has_dims))
+        )
+        return cur.rowcount > 0
+
+
+@timed("db.init_db")
 def init_db(seed: bool = True):
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     with _conn() as con:
@@ -44,6 +214,9 @@ def init_db(seed: bool = True):
             con.execute("ALTER TABLE companies ADD COLUMN capacity TEXT DEFAULT ''")
         if not _has_column(con, "companies", "location"):
             con.execute("ALTER TABLE companies ADD COLUMN location TEXT DEFAULT ''")
+        _ensure_versions(con)
+        _ensure_geo(con)
+        _ensure_envelopes(con)
 
         # Assignments table
         con.execute(
@@ -61,15 +234,19 @@ def init_db(seed: bool = True):
         cols = [r[1] for r in cur]
         if 'drawing_file' not in cols:
             con.execute("ALTER TABLE assignments ADD COLUMN drawing_file TEXT DEFAULT ''")
-        if seed and not list(fetch_all()):
+        _version_triggers(con, "assignments")
+        # 同一接続で件数確認（別接続の fetch_all だと未コミットの ALTER と競合する）
+        if seed and not con.execute("SELECT COUNT(1) FROM companies").fetchone()[0]:
             seed_data = [
                 ("大田VMC精機", "VMC,三次元測定機", "ステンレス,フランジ", "SUS加工が得意。薄肉注意。", "Medium", "Tokyo"),
                 ("町工場フライス", "汎用フライス,ボール盤", "アルミ,プレート", "小ロット歓迎。", "Low", "Kawasaki"),
                 ("精密タップ工業", "タッピングセンタ", "SUS,ねじ穴", "ねじ穴加工の実績豊富。", "High", "Yokohama"),
             ]
             con.executemany("INSERT INTO companies(name,machines,skills,notes,capacity,location) VALUES(?,?,?,?,?,?)", seed_data)
+            _ensure_geo(con)
 
 
+@timed("db.fetch_all")
 def fetch_all() -> List[CompanyRow]:
     with _conn() as con:
         # Ensure columns exist
@@ -77,10 +254,16 @@ def fetch_all() -> List[CompanyRow]:
             con.execute("ALTER TABLE companies ADD COLUMN capacity TEXT DEFAULT ''")
         if not _has_column(con, "companies", "location"):
             con.execute("ALTER TABLE companies ADD COLUMN location TEXT DEFAULT ''")
-        rows = con.execute("SELECT id,name,machines,skills,notes,capacity,location FROM companies").fetchall()
+        if not _has_column(con, "companies", "row_version"):
+            con.execute("ALTER TABLE companies ADD COLUMN row_version INTEGER DEFAULT 0")
+        if not _has_column(con, "companies", "lat"):
+            _ensure_geo(con)
+        _ensure_envelopes(con)
+        rows = con.execute("SELECT id,name,machines,skills,notes,capacity,location,row_version,lat,lon,envelopes FROM companies").fetchall()
     return [CompanyRow(*r) for r in rows]
 
 
+@timed("db.fetch_by_id")
 def fetch_by_id(company_id: int) -> Optional[CompanyRow]:
     with _conn() as con:
         # Ensure optional columns exist
@@ -88,13 +271,73 @@ def fetch_by_id(company_id: int) -> Optional[CompanyRow]:
             con.execute("ALTER TABLE companies ADD COLUMN capacity TEXT DEFAULT ''")
         if not _has_column(con, "companies", "location"):
             con.execute("ALTER TABLE companies ADD COLUMN location TEXT DEFAULT ''")
+        if not _has_column(con, "companies", "row_version"):
+            con.execute("ALTER TABLE companies ADD COLUMN row_version INTEGER DEFAULT 0")
+        if not _has_column(con, "companies", "lat"):
+            _ensure_geo(con)
+        _ensure_envelopes(con)
         row = con.execute(
-            "SELECT id,name,machines,skills,notes,capacity,location FROM companies WHERE id=?",
+            "SELECT id,name,machines,skills,notes,capacity,location,row_version,lat,lon,envelopes FROM companies WHERE id=?",
             (company_id,),
         ).fetchone()
     return CompanyRow(*row) if row else None
 
 
+PAGE_FIELDS = ("id", "name", "machines", "skills", "notes", "capacity", "location", "lat", "lon", "envelopes")
+DEFAULT_PAGE_FIELDS = ("id", "name", "machines", "capacity", "location")
+
+
+def _like(s: str) -> str:
+    return "%" + s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+@timed("db.fetch_page")
+def fetch_page(
+    after: int = 0,
+    limit: int = 50,
+    fields: Sequence[str] = DEFAULT_PAGE_FIELDS,
+    ids: Optional[Sequence[int]] = None,
+    machine: Optional[str] = None,
+    q: Optional[str] = None,
+    any_of: Sequence[str] = (),
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """id 昇順のキーセットページング。after より大きい id から limit 件を fields の列だけ返す。
+
+    machine は装置名の部分一致、q は名称・装置・スキル・備考の部分一致、any_of は
+    装置・スキル・備考のいずれかにどれかの語を含む（工程カテゴリのキーワード）。
+    戻り値は (行のリスト, 次ページの after。最後のページなら None)。
+    """
+    unknown = [f for f in fields if f not in PAGE_FIELDS]
+    if unknown:
+        raise ValueError(f"未知の項目です: {', '.join(unknown)}")
+    cols = ["id"] + [f for f in dict.fromkeys(fields) if f != "id"]
+    cond, params = ["id > ?"], [int(after)]
+    if ids is not None:
+        cond.append(f"id IN ({','.join('?' * len(ids))})" if ids else "0")
+        params += [int(i) for i in ids]
+    if machine:
+        cond.append("machines LIKE ? ESCAPE '\\'")
+        params.append(_like(machine))
+    if q:
+        cond.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in ("name", "machines", "skills", "notes")) + ")")
+        params += [_like(q)] * 4
+    words = [w for w in any_of if w]
+    if words:
+        cond.append("(" + " OR ".join(
+            f"{c} LIKE ? ESCAPE '\\'" for _ in words for c in ("machines", "skills", "notes")) + ")")
+        params += [_like(w) for w in words for _ in range(3)]
+    ensure_db()
+    with _conn() as con:
+        rows = con.execute(
+            f"SELECT {','.join(cols)} FROM companies WHERE {' AND '.join(cond)} ORDER BY id LIMIT ?",
+            params + [int(limit) + 1],
+        ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return [dict(zip(cols, r)) for r in rows], (rows[-1][0] if more and rows else None)
+
+
+@timed("db.create_company")
 def create_company(
     name: str,
     machines: str,
@@ -102,6 +345,7 @@ def create_company(
     notes: str = "",
     capacity: str = "",
     location: str = "",
+    envelopes: Optional[str] = None,
 ) -> int:
     with _conn() as con:
         # Ensure columns exist
@@ -109,13 +353,18 @@ def create_company(
             con.execute("ALTER TABLE companies ADD COLUMN capacity TEXT DEFAULT ''")
         if not _has_column(con, "companies", "location"):
             con.execute("ALTER TABLE companies ADD COLUMN location TEXT DEFAULT ''")
+        if not _has_column(con, "companies", "lat"):
+            _ensure_geo(con)
+        _ensure_envelopes(con)
+        ll = geocode(location) or (None, None)
         cur = con.execute(
-            "INSERT INTO companies(name,machines,skills,notes,capacity,location) VALUES(?,?,?,?,?,?)",
-            (name, machines, skills, notes, capacity, location),
+            "INSERT INTO companies(name,machines,skills,notes,capacity,location,lat,lon,envelopes) VALUES(?,?,?,?,?,?,?,?,?)",
+            (name, machines, skills, notes, capacity, location, ll[0], ll[1], envelopes),
         )
         return cur.lastrowid
 
 
+@timed("db.update_company")
 def update_company(company_id: int, fields: Dict[str, Any]) -> bool:
     allowed = ["name", "machines", "skills", "notes", "capacity", "location"]
     sets = []
@@ -124,20 +373,35 @@ def update_company(company_id: int, fields: Dict[str, Any]) -> bool:
         if k in fields and fields[k] is not None:
             sets.append(f"{k}=?")
             params.append(str(fields[k]))
+    if "envelopes" in fields:
+        # 空文字・None で範囲データを削除
+        sets.append("envelopes=?")
+        params.append(fields["envelopes"] or None)
     if not sets:
         return False
+    if fields.get("location") is not None:
+        # 所在地が変わったら座標も更新（不明なら NULL）
+        ll = geocode(str(fields["location"])) or (None, None)
+        sets += ["lat=?", "lon=?"]
+        params += [ll[0], ll[1]]
     params.append(company_id)
     with _conn() as con:
+        if "lat=?" in sets and not _has_column(con, "companies", "lat"):
+            _ensure_geo(con)
+        if "envelopes=?" in sets:
+            _ensure_envelopes(con)
         con.execute(f"UPDATE companies SET {', '.join(sets)} WHERE id=?", params)
         return True
 
 
+@timed("db.delete_company")
 def delete_company(company_id: int) -> bool:
     with _conn() as con:
         con.execute("DELETE FROM companies WHERE id=?", (company_id,))
         return True
 
 
+@timed("db.save_assignment")
 def save_assignment(task_name: str, company_id: int, drawing_file: str = "") -> int:
     with _conn() as con:
         # ensure column exists
@@ -155,6 +419,18 @@ def save_assignment(task_name: str, company_id: int, drawing_file: str = "") ->
         return cur.lastrowid
 
 
+@timed("db.save_assignments_bulk")
+def save_assignments_bulk(rows: Iterable[Tuple[str, int, str]]) -> int:
+    """(task_name, company_id, drawing_file) をまとめて1トランザクションで保存し、件数を返す。"""
+    rows = [(t, int(cid), f or "") for t, cid, f in rows]
+    if not rows:
+        return 0
+    with _conn() as con:
+        con.executemany("INSERT INTO assignments(task_name, company_id, drawing_file) VALUES(?,?,?)", rows)
+    return len(rows)
+
+
+@timed("db.fetch_assignments")
 def fetch_assignments() -> List[Tuple[int, str, int, str, str]]:
     with _conn() as con:
         curcols = [r[1] for r in con.execute("PRAGMA table_info(assignments)").fetchall()]
@@ -176,6 +452,7 @@ def fetch_assignments() -> List[Tuple[int, str, int, str, str]]:
             norm.append((rid, task_name, company_id, created_at, ""))
     return norm
 
+@timed("db.fetch_assignment_files")
 def fetch_assignment_files() -> List[Tuple[str, int]]:
     """Return list of (drawing_file, count) for assignments having a non-empty file."""
     with _conn() as con:
@@ -187,6 +464,7 @@ def fetch_assignment_files() -> List[Tuple[str, int]]:
         ).fetchall()
     return rows
 
+@timed("db.fetch_assignments_for_file")
 def fetch_assignments_for_file(drawing_file: str) -> List[Tuple[int, str, int, str, str]]:
     with _conn() as con:
         curcols = [r[1] for r in con.execute("PRAGMA table_info(assignments)").fetchall()]
@@ -200,6 +478,7 @@ def fetch_assignments_for_file(drawing_file: str) -> List[Tuple[int, str, int, s
     return rows
 
 
+@timed("db.search_by_text")
 def search_by_text(q: str) -> List[CompanyRow]:
     q = f"%{q}%"
     with _conn() as con:
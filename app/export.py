@@ -0,0 +1,29 @@
+"""割当レポートの一括エクスポート（CLI）
+
+    python -m app.export -o reports.zip [--file NAME ...] [-q SUBSTR] [--workers N]
+"""
+import argparse
+import sys
+
+from .services.batch_export import DEFAULT_WORKERS, print_progress, select_drawings, write_reports_zip
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.export", description="図面ごとの割当レポート(.docx)をZIPに一括出力")
+    ap.add_argument("-o", "--out", default="assignments_reports.zip", help="出力ZIPパス")
+    ap.add_argument("--file", action="append", dest="files", help="対象図面（複数指定可、省略時は全図面）")
+    ap.add_argument("-q", "--query", help="図面名の部分一致フィルタ")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="並列プロセス数")
+    args = ap.parse_args(argv)
+
+    drawings = select_drawings(args.files, args.query)
+    if not drawings:
+        print("対象の図面がありません", file=sys.stderr)
+        return 1
+    print(f"{len(drawings)} drawings -> {args.out} (workers={args.workers})", file=sys.stderr)
+    write_reports_zip(args.out, drawings, workers=args.workers, progress=print_progress)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""工程計画ライブラリの管理（CLI）
+
+    python -m app.plans warm [--force] [--workers N]
+    python -m app.plans list
+
+warm は既知の (材質, 部品種別, 寸法表記の有無) の組み合わせのうち未登録のものをLLMで工程分解して
+ライブラリに保存する（--force で登録済みのLLM計画も作り直す。管理者が編集した計画は上書きしない）。
+"""
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+from .db.company_db import ensure_db
+from .services import llm, process_plans
+from .services.diagram_analysis import Features
+from .services.process_breakdown import LLM_ARGS, llm_prompt, parse_llm_steps, rule_steps
+
+
+def _features(key: process_plans.PlanKey) -> Features:
+    material, part_type, has_dims = key
+    return Features(filename="", ext="", material=material or None, part_type=part_type or None,
+                    dims_text="(warm)" if has_dims else None)
+
+
+def _warm_one(key: process_plans.PlanKey) -> Optional[int]:
+    features = _features(key)
+    steps = parse_llm_steps(llm.chat_json(user=llm_prompt(features), **LLM_ARGS))
+    if not steps:
+        return None
+    process_plans.store(key, steps + rule_steps(features))
+    return len(steps)
+
+
+def warm(force: bool = False, workers: int = 4) -> int:
+    ensure_db()
+    existing = {(p["material"], p["part_type"], int(p["has_dims"])): p["source"] for p in process_plans.list_plans()}
+    keys = [k for k in process_plans.known_keys() if k not in existing or (force and existing[k] != "admin")]
+    print(f"{len(keys)} combinations to warm ({len(existing)} already in library)", file=sys.stderr)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futures = {ex.submit(_warm_one, k): k for k in keys}
+        for fut in as_completed(futures):
+            k = futures[fut]
+            try:
+                n, err = fut.result(), "no steps from LLM"
+            except Exception as e:
+                n, err = None, f"{type(e).__name__}: {e}"
+            if n is None:
+                failed += 1
+                print(f"  failed  {k}: {err}", file=sys.stderr)
+            else:
+                print(f"  ok      {k}: {n} LLM steps", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.plans", description="材質×部品種別の工程計画ライブラリ")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("warm", help="既知の組み合わせをLLMで事前に工程分解して保存")
+    w.add_argument("--force", action="store_true", help="登録済みのLLM計画も作り直す（管理者の計画は除く）")
+    w.add_argument("--workers", type=int, default=4, help="同時に問い合わせる数")
+    sub.add_parser("list", help="登録済みの計画をJSONLで出力")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "list":
+        ensure_db()
+        for p in process_plans.list_plans():
+            print(json.dumps(p, ensure_ascii=False))
+        return 0
+    if not llm.is_configured():
+        print("LLMが設定されていません（OPENAI_API_KEY または AZURE_OPENAI_* を設定してください）", file=sys.stderr)
+        return 1
+    return warm(force=args.force, workers=args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
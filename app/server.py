@@ -1,29 +1,57 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, send_from_directory, session
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, send_from_directory, session
+from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, send_from_directory, session, Response, g
+from flask import before_render_template, template_rendered
 from werkzeug.utils import secure_filename
 from pathlib import Path
+from urllib.parse import quote
 import io
 import os
+import json
+import shutil
+import time
+import zipfile
 import functools
+import contextlib
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 from .services.diagram_analysis import analyze_file
 from .services.process_breakdown import breakdown_process, ProcessStep
-from .services.company_matching import match_companies
+from .services.company_matching import match_companies, score_matrix
 from .services.task_mapping import (
     normalize_category_key,
     keywords_for_category,
     categories_for_steps,
     steps_by_category,
 )
-from .services.report_generation import render_report_html, render_report_pdf, render_report_docx, render_assignments_docx
+from .services.report_generation import render_report_html, render_report_pdf, render_report_pdf_cached, report_fingerprint, render_report_docx, render_assignments_docx
+from .services.assignment_solver import jobs_from_dicts, plan_to_dict, save_plan, solve as solve_assignments
+from .services.batch_export import assignment_items, clamp_workers, select_drawings, stream_reports_zip
+from .constants import ALLOWED_EXT
+from .services.pipeline import DEFAULT_TOP_N, DEFAULT_WORKERS as PIPELINE_WORKERS, aiter_progressive, features_to_dict, iter_async, iter_pipeline, matches_to_dicts, steps_to_dicts
+from .services import envelope, geo, metrics, llm, process_plans, profiling, thumbnails
+from .db import company_db
 from .db.company_db import fetch_all, save_assignment, fetch_assignments, create_company, update_company, delete_company, fetch_by_id, fetch_assignment_files, fetch_assignments_for_file
 
 UPLOAD_DIR = Path(__file__).parent / "uploads"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-ALLOWED_EXT = {"pdf", "png", "jpg", "jpeg", "dxf", "dwg"}
+BATCH_MAX_FILES = int(os.environ.get('CMA_BATCH_MAX_FILES', '500'))
+BATCH_MAX_MEMBER_BYTES = int(os.environ.get('CMA_BATCH_MAX_MEMBER_MB', '200')) * 1024 * 1024
+# /metrics はローカル（ループバック）または管理者ログイン時のみ。CMA_METRICS_PUBLIC=true で制限解除。
+# 同じホストのリバースプロキシ経由だとループバックに見えるため、転送ヘッダ付きのリクエストはローカル扱いしない
+METRICS_PUBLIC = os.environ.get('CMA_METRICS_PUBLIC', 'false').lower() in ('1', 'true', 'yes', 'on')
+# /companies・/assignments・/reports の描画済みHTMLを (URL, ログイン状態, DB変更カウンタ) ごとに保持する上限（MB、0で無効）
+PAGE_CACHE_MB = float(os.environ.get('CMA_PAGE_CACHE_MB', '64'))
+MATCH_PAGE_SIZE = int(os.environ.get('CMA_MATCH_PAGE_SIZE', '50'))
+API_PAGE_MAX = 500
+
+
+class _TooManyFiles(Exception):
+    """/analyze/batch のファイル数が BATCH_MAX_FILES を超えた"""
 
 
 def create_app():
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
     app = Flask(__name__)
     # session secret (dev default)
     app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-key')
@@ -47,6 +75,166 @@ def create_app():
             return fn(*args, **kwargs)
         return wrapper
 
+    # 一覧ページ: DBの変更カウンタ（data_versions）で ETag/Last-Modified を付け、未変更なら 304。
+    # 本文は同じキーの間は描画済みHTMLを再利用する。起動ごとのトークンでテンプレート更新後の古い 304 を防ぐ
+    page_cache: "OrderedDict[tuple, str]" = OrderedDict()
+    page_bytes = [0]
+    page_lock = threading.Lock()
+    boot = os.urandom(4).hex()
+
+    def cached_page(tables, render, extra=(), mimetype='text/html'):
+        company_db.ensure_db()
+        versions, changed = company_db.data_stamp(*tables)
+        key = (request.endpoint, request.query_string, bool(session.get('is_admin')), session.get('user'),
+               versions, extra)
+        etag = hashlib.sha1(repr((boot,) + key).encode('utf-8')).hexdigest()
+
+        def conditional(resp):
+            resp.set_etag(etag)
+            if changed:
+                resp.last_modified = datetime.fromtimestamp(changed, tz=timezone.utc)
+            resp.headers['Cache-Control'] = 'no-cache'
+            resp.vary.add('Cookie')
+            return resp.make_conditional(request)
+
+        probe = conditional(Response())
+        if probe.status_code == 304:
+            return probe
+        with page_lock:
+            html = page_cache.get(key)
+            if html is not None:
+                page_cache.move_to_end(key)
+        if html is None:
+            html = render()
+            limit = PAGE_CACHE_MB * 1024 * 1024
+            if 0 < len(html) <= limit:
+                with page_lock:
+                    if key not in page_cache:
+                        page_cache[key] = html
+                        page_bytes[0] += len(html)
+                    while page_bytes[0] > limit:
+                        _, old = page_cache.popitem(last=False)
+                        page_bytes[0] -= len(old)
+        return conditional(Response(html, mimetype=mimetype))
+
+    # 計測: リクエスト単位のレイテンシ/件数、テンプレート描画時間、任意のトレースログ
+    @app.before_request
+    def _metrics_begin():
+        g._metrics_t0 = time.perf_counter()
+        g._trace_token = metrics.start_trace() if metrics.TRACE_LOG else None
+
+    @app.after_request
+    def _metrics_end(resp):
+        t0 = g.pop('_metrics_t0', None)
+        if t0 is None:
+            return resp
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, path, status = request.method, request.path, resp.status_code
+        token = g.pop('_trace_token', None)
+        spans = metrics.trace_spans() if token is not None else None
+
+        def finish():
+            dt = time.perf_counter() - t0
+            metrics.observe("cma_http_request_seconds", dt, endpoint=endpoint)
+            metrics.inc("cma_http_requests_total", endpoint=endpoint, method=method, status=status)
+            if token is not None:
+                metrics.write_trace({
+                    "ts": time.time(),
+                    "method": method,
+                    "path": path,
+                    "endpoint": endpoint,
+                    "status": status,
+                    "seconds": round(dt, 6),
+                    "spans": metrics.end_trace(token, spans),
+                })
+
+        # NDJSON/SSE/ZIP のストリーミング応答は本文の生成が終わってから計測を閉じる
+        if resp.is_streamed:
+            resp.call_on_close(finish)
+        else:
+            finish()
+        return resp
+
+    def _fast_requested() -> bool:
+        flag = request.args.get('fast') or request.headers.get('X-CMA-Fast') or ''
+        return flag.lower() in ('1', 'true', 'yes', 'on')
+
+    def _location_filter() -> geo.LocationFilter:
+        """?max_km=&origin=&region=（POSTはJSON本文でも可）→ 候補の所在地条件。解釈できなければ ValueError"""
+        data = request.get_json(silent=True) if request.method == 'POST' else None
+        src = data if isinstance(data, dict) else {}
+        raw_km = request.args.get('max_km') or src.get('max_km')
+        origin = (request.args.get('origin') or src.get('origin') or '').strip() or None
+        region = (request.args.get('region') or src.get('region') or '').strip() or None
+        max_km = geo.check_max_km(raw_km) if raw_km not in (None, '') else None
+        where = geo.LocationFilter(max_km, origin, region)
+        if max_km is not None and geo.origin_of(origin) is None:
+            raise ValueError(f"origin の位置が分かりません: {origin}")
+        if region and not geo.region_prefectures(region):
+            raise ValueError(f"region が分かりません: {region}")
+        return where
+
+    # リクエスト全体のLLM予算（CMA_REQUEST_BUDGET_SEC）と fast=1 / X-CMA-Fast: 1 によるルールのみモード
+    @app.before_request
+    def _llm_budget_begin():
+        stack = contextlib.ExitStack()
+        stack.enter_context(llm.deadline())
+        if _fast_requested():
+            stack.enter_context(llm.rules_only())
+        g._llm_budget = stack
+
+    @app.teardown_request
+    def _llm_budget_end(exc):
+        stack = g.pop('_llm_budget', None)
+        if stack is not None:
+            stack.close()
+
+    # 管理者が有効化した場合のみ、対象リクエストをプロファイル（/admin/profiles 自体は除外）
+    @app.before_request
+    def _profile_begin():
+        if request.path.startswith('/admin/profiles') or request.path == '/metrics':
+            return
+        g._profile = profiling.RequestProfile.begin()
+
+    @app.after_request
+    def _profile_end(resp):
+        prof = g.pop('_profile', None)
+        if prof is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            meta = {"method": request.method, "path": request.path, "endpoint": endpoint, "status": resp.status_code}
+            # ストリーミング応答は本文の生成まで含めて計測する
+            if resp.is_streamed:
+                resp.call_on_close(lambda: prof.finish(meta))
+            else:
+                prof.finish(meta)
+        return resp
+
+    @app.teardown_request
+    def _profile_teardown(exc):
+        # 例外で after_request を通らなかった場合も計測を閉じる
+        prof = g.pop('_profile', None)
+        if prof is not None:
+            prof.finish({"method": request.method, "path": request.path, "status": 500, "error": repr(exc)})
+
+    def _template_begin(sender, template, context, **extra):
+        g.setdefault('_template_t0', []).append(time.perf_counter())
+
+    def _template_end(sender, template, context, **extra):
+        stack = g.get('_template_t0')
+        if stack:
+            metrics.record(f"template:{template.name}", time.perf_counter() - stack.pop())
+
+    before_render_template.connect(_template_begin, app)
+    template_rendered.connect(_template_end, app)
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        local = (request.remote_addr in ('127.0.0.1', '::1')
+                 and not any(h in request.headers for h in ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')))
+        if not (METRICS_PUBLIC or local or session.get('is_admin')):
+            return Response("forbidden\n", status=403, mimetype='text/plain')
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
     @app.get("/")
     def index():
         return render_template("index.html")
@@ -55,6 +243,16 @@ def create_app():
     def uploaded_file(filename: str):
         return send_from_directory(UPLOAD_DIR, filename)
 
+    @app.get("/thumbs/<sha>/<name>")
+    def thumbnail(sha: str, name: str):
+        # URLに内容ハッシュを含むため中身は変わらない。初回要求時に派生画像を作る
+        p = thumbnails.derive(sha, name)
+        if p is None:
+            return Response("not found\n", status=404, mimetype='text/plain')
+        resp = send_file(p, mimetype=thumbnails.mimetype(name), etag=f"{sha}-{name}", conditional=True)
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return resp
+
     @app.post("/analyze")
     def analyze():
         f = request.files.get("file")
@@ -68,7 +266,10 @@ def create_app():
         f.save(p)
         features = analyze_file(p)
         app.config['last_upload_filename'] = filename
-        preview_url = url_for('uploaded_file', filename=filename) if ext in {"png", "jpg", "jpeg"} else None
+        # プレビューは元画像ではなく内容ハッシュ付きの縮小画像（PDFは1ページ目、pdftoppm がある場合）
+        sha = thumbnails.register(p)
+        preview_url = url_for('thumbnail', sha=sha, name=thumbnails.name_for(thumbnails.PREVIEW_SIZE)) if sha else None
+        thumb_url = url_for('thumbnail', sha=sha, name=thumbnails.name_for(thumbnails.THUMB_SIZE)) if sha else None
         return jsonify({
             "filename": features.filename,
             "ext": features.ext,
@@ -81,8 +282,98 @@ def create_app():
             "recommended_process": features.recommended_process,
             "recommended_machine": features.recommended_machine,
             "preview_url": preview_url,
+            "thumb_url": thumb_url,
+            "original_url": url_for('uploaded_file', filename=filename),
         })
 
+    @app.post("/analyze/batch")
+    def analyze_batch():
+        # 複数ファイル（files/file）またはZIPを受け取り、図面ごとの結果をNDJSONで逐次返す
+        uploads = request.files.getlist("files") + request.files.getlist("file")
+        if not uploads:
+            return jsonify({"error": "ファイルがありません"}), 400
+        items = []  # (元ファイル名, 保存先Path or None, エラー)
+        used = set()
+
+        def reserve(name: str, ext: str) -> Path:
+            stem = secure_filename(name.rsplit(".", 1)[0]) or f"drawing_{len(items) + 1}"
+            cand, n = f"{stem}.{ext}", 1
+            while cand in used:
+                n += 1
+                cand = f"{stem}_{n}.{ext}"
+            used.add(cand)
+            return UPLOAD_DIR / cand
+
+        def take() -> None:
+            # 上限はファイルを書き出す前に確認する（ZIPは1メンバーずつ）
+            if len(items) >= BATCH_MAX_FILES:
+                raise _TooManyFiles()
+
+        try:
+            for f in uploads:
+                ext = f.filename.rsplit(".", 1)[-1].lower() if "." in f.filename else ""
+                if ext == "zip":
+                    try:
+                        zf = zipfile.ZipFile(f.stream)
+                    except zipfile.BadZipFile:
+                        take()
+                        items.append((f.filename, None, "ZIPを展開できません"))
+                        continue
+                    with zf:
+                        for info in zf.infolist():
+                            name = info.filename.rsplit("/", 1)[-1]
+                            if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                                continue
+                            take()
+                            mext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+                            if mext not in ALLOWED_EXT:
+                                items.append((name, None, f"未対応の拡張子: {mext}"))
+                            elif info.file_size > BATCH_MAX_MEMBER_BYTES:
+                                items.append((name, None, "ファイルサイズが上限を超えています"))
+                            else:
+                                p = reserve(name, mext)
+                                items.append((name, p, None))
+                                with zf.open(info) as src, open(p, "wb") as dst:
+                                    shutil.copyfileobj(src, dst)
+                elif ext in ALLOWED_EXT:
+                    take()
+                    p = reserve(f.filename, ext)
+                    items.append((f.filename, p, None))
+                    f.save(p)
+                else:
+                    take()
+                    items.append((f.filename, None, f"未対応の拡張子: {ext}"))
+        except _TooManyFiles:
+            # 上限超過時は書き出し済みのファイルを残さない
+            for _, p, _ in items:
+                if p is not None:
+                    p.unlink(missing_ok=True)
+            return jsonify({"error": f"ファイル数が上限({BATCH_MAX_FILES})を超えています"}), 413
+        # 並列数はサーバ側の既定値（CMA_BATCH_WORKERS）までに制限する
+        workers = clamp_workers(request.args.get('workers', type=int), PIPELINE_WORKERS)
+        fast = _fast_requested()
+
+        def generate():
+            t0 = time.perf_counter()
+            ok = failed = 0
+            valid = []
+            for idx, (name, p, err) in enumerate(items):
+                if err:
+                    failed += 1
+                    yield json.dumps({"index": idx, "filename": name, "ok": False, "error": err}, ensure_ascii=False) + "\n"
+                else:
+                    valid.append((idx, name, p))
+            for res in iter_pipeline([p for _, _, p in valid], workers=workers, rules_only=fast):
+                idx, name, _ = valid[res["index"]]
+                res.update(index=idx, filename=name, stored_as=valid[res["index"]][2].name)
+                ok += 1 if res["ok"] else 0
+                failed += 0 if res["ok"] else 1
+                yield json.dumps(res, ensure_ascii=False, default=str) + "\n"
+            yield json.dumps({"done": True, "total": len(items), "ok": ok, "failed": failed,
+                              "seconds": round(time.perf_counter() - t0, 3)}) + "\n"
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
     @app.post("/process")
     def process():
         data = request.get_json(silent=True) or {}
@@ -98,7 +389,7 @@ def create_app():
             if val:
                 setattr(features, dst, val)
         process_steps = breakdown_process(features)
-        matches = match_companies(process_steps)
+        matches = match_companies(process_steps, part=envelope.part_size(features))
         html = render_report_html(features, process_steps, matches)
         app.config['last_result'] = {
             'features': features,
@@ -146,6 +437,50 @@ def create_app():
             app.config['last_steps'] = steps
         return render_template("process.html", features=features, steps=steps)
 
+    # ルールベースの結果を即時に、LLMで精緻化した結果を完了次第 Server-Sent Events で送る
+    @app.get("/process/stream")
+    def process_stream():
+        filename = request.args.get("filename") or app.config.get('last_upload_filename')
+        if not filename:
+            return jsonify({"error": "ファイルがありません"}), 400
+        p = UPLOAD_DIR / secure_filename(filename)
+        if not p.exists():
+            return jsonify({"error": "アップロードファイルが見つかりません"}), 404
+        top_n = request.args.get('top_n', type=int) or DEFAULT_TOP_N
+        fast = _fast_requested()
+
+        def sse(event: str, data) -> str:
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+        def generate():
+            t0 = time.perf_counter()
+            first = None
+            state = {}
+            try:
+                for event, stage, value in iter_async(lambda: aiter_progressive(p, rules_only=fast)):
+                    state[event] = value
+                    if event == "features":
+                        data = features_to_dict(value)
+                    elif event == "steps":
+                        data = steps_to_dicts(value)
+                    else:
+                        data = matches_to_dicts(value, top_n)
+                    elapsed = round(time.perf_counter() - t0, 3)
+                    first = elapsed if first is None else first
+                    yield sse(event, {"stage": stage, "seconds": elapsed, "data": data})
+            except Exception as e:
+                yield sse("error", {"error": f"{type(e).__name__}: {e}"})
+                return
+            # 最終結果は ②/③ の画面からも参照できるようにする
+            app.config['last_features'] = state.get('features')
+            app.config['last_steps'] = state.get('steps')
+            app.config['last_upload_filename'] = p.name
+            yield sse("done", {"filename": p.name, "first_result_sec": first,
+                               "seconds": round(time.perf_counter() - t0, 3)})
+
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     @app.post("/match")
     def match():
         data = request.get_json(silent=True) or {}
@@ -175,7 +510,7 @@ def create_app():
         else:
             steps = app.config.get('last_steps') or []
 
-        matches = match_companies(steps)
+        matches = match_companies(steps, part=envelope.part_size(features))
         html = render_report_html(features, steps, matches)
         app.config['last_result'] = {
             'features': features,
@@ -186,6 +521,35 @@ def create_app():
         # ④を最後の画面とするため、レポートUIへ遷移
         return redirect(url_for('reports_list'))
 
+    def _ranked_matches(features, steps, sel_key, where):
+        """③の表示順のマッチ: (全工程の結果, タブの工程の結果をキーワード一致数→スコア順, キーワード, タブの工程)"""
+        cat_map = steps_by_category(steps)
+        steps_in_cat = [s for _, s in cat_map.get(sel_key, [])]
+        steps_scope = steps_in_cat if steps_in_cat else steps
+        keys = [k.lower() for k in keywords_for_category(sel_key)]
+        if not steps:
+            return [], [], keys, steps_in_cat
+        # 全体/タブ別のスコアは (工程, 企業DBバージョン, 所在地条件) ごとのスコア行列から再集計する
+        matrix = score_matrix(steps, where=where, part=envelope.part_size(features))
+        prio = matrix.keyword_hits(keys)
+        matches = sorted(matrix.matches(steps_scope), key=lambda m: (prio.get(m.company.id, 0), m.score), reverse=True)
+        return matrix.matches(steps), matches, keys, steps_in_cat
+
+    def _match_rows(matches):
+        return [
+            {
+                'company': {
+                    'id': m.company.id,
+                    'name': m.company.name,
+                    'machines': m.company.machines,
+                    'capacity': m.company.capacity or '',
+                    'location': m.company.location or '',
+                    'notes': m.company.notes,
+                },
+                'score': m.score,
+            } for m in matches
+        ]
+
     @app.route("/match/ui", methods=["GET", "POST"])
     def match_ui():
         features = app.config.get('last_features')
@@ -221,42 +585,15 @@ def create_app():
             steps = breakdown_process(features)
             app.config['last_steps'] = steps
 
-        raw_key = request.args.get('task')
-        sel_key = normalize_category_key(raw_key) or 'drilling'
-
-        companies = fetch_all()
-        cat_map = steps_by_category(steps)
-        steps_in_cat = [s for _, s in cat_map.get(sel_key, [])]
-        steps_scope = steps_in_cat if steps_in_cat else steps
-
-        matches_full = match_companies(steps) if steps else []
-        matches = match_companies(steps_scope) if steps_scope else []
-
-        keys = [k.lower() for k in keywords_for_category(sel_key)]
-        def prio_count(m):
-            text = f"{m.company.machines} {m.company.skills} {m.company.notes}".lower()
-            return sum(1 for kw in keys if kw and kw in text)
-        matches = sorted(matches, key=lambda m: (prio_count(m), m.score), reverse=True)
-
+        sel_key = normalize_category_key(request.args.get('task')) or 'drilling'
+        try:
+            where = _location_filter()
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        matches_full, matches, keys, steps_in_cat = _ranked_matches(features, steps, sel_key, where)
         tabs = categories_for_steps(steps)
-
-        companies_json = [
-            {
-                'id': c.id,
-                'name': c.name,
-                'machines': c.machines,
-                'skills': c.skills,
-                'notes': c.notes,
-                'capacity': getattr(c, 'capacity', '') or '',
-                'location': getattr(c, 'location', '') or '',
-            } for c in companies
-        ]
-        matches_json = [
-            {
-                'company': {'id': m.company.id, 'name': m.company.name},
-                'score': m.score
-            } for m in matches
-        ]
+        # 初期表示は先頭ページのみ（残りは /api/matches で追加取得）。企業一覧は埋め込まない
+        page = matches[:MATCH_PAGE_SIZE]
 
         if features and steps:
             html = render_report_html(features, steps, matches_full)
@@ -271,16 +608,38 @@ def create_app():
             "match.html",
             features=features,
             steps=steps,
-            companies=companies,
-            matches=matches,
+            matches=page,
+            matches_total=len(matches),
             selected_key=sel_key,
             tabs=tabs,
             keywords=keys,
             steps_in_category=steps_in_cat,
-            companies_json=companies_json,
-            matches_json=matches_json,
+            matches_json=_match_rows(page),
+            where=where,
+            hub=geo.HUB_LOCATION,
+            geo_qs=''.join(f"&{k}={quote(str(v))}" for k, v in (('max_km', where.max_km), ('origin', where.origin), ('region', where.region)) if v),
         )
 
+    @app.get("/api/matches")
+    def api_matches():
+        """③の表の続き（?task=&offset=&limit= と所在地条件）。直近の図面・工程に対するスコア行列から切り出す。"""
+        offset = max(0, request.args.get('offset', type=int) or 0)
+        limit = min(API_PAGE_MAX, max(1, request.args.get('limit', type=int) or MATCH_PAGE_SIZE))
+        sel_key = normalize_category_key(request.args.get('task')) or 'drilling'
+        try:
+            where = _location_filter()
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        steps = app.config.get('last_steps') or []
+        _, matches, _, _ = _ranked_matches(app.config.get('last_features'), steps, sel_key, where)
+        end = offset + limit
+        return jsonify({
+            "ok": True,
+            "items": _match_rows(matches[offset:end]),
+            "total": len(matches),
+            "next": end if end < len(matches) else None,
+        })
+
     @app.post("/assignments/save")
     def assignments_save():
         data = request.get_json(silent=True) or {}
@@ -295,6 +654,29 @@ def create_app():
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
 
+    @app.post("/assignments/solve")
+    def assignments_solve():
+        # 複数図面の工程を容量制約付きで一括割当（save=true でDBへ保存）
+        data = request.get_json(silent=True) or {}
+        drawings = data.get('drawings')
+        if drawings is None:
+            steps = app.config.get('last_steps') or []
+            drawings = [{
+                "drawing_file": app.config.get('last_upload_filename') or '',
+                "steps": steps_to_dicts(steps),
+            }]
+        if not isinstance(drawings, list):
+            return jsonify({"ok": False, "error": "drawings はリストで指定してください"}), 400
+        jobs = [j for j in jobs_from_dicts(drawings) if j.steps]
+        if not jobs:
+            return jsonify({"ok": False, "error": "割当対象の工程がありません"}), 400
+        # LLM補助は llm=true のときのみ（工程数×企業数の呼び出しになるため。既存のメモは常に利用）
+        plan = solve_assignments(jobs, use_llm=bool(data.get('llm')))
+        out = plan_to_dict(plan)
+        out["ok"] = True
+        out["saved"] = save_plan(plan) if data.get('save') else 0
+        return jsonify(out)
+
     @app.post("/upload")
     def upload():
         f = request.files.get("file")
@@ -308,7 +690,7 @@ def create_app():
         f.save(p)
         features = analyze_file(p)
         process = breakdown_process(features)
-        matches = match_companies(process)
+        matches = match_companies(process, part=envelope.part_size(features))
         html = render_report_html(features, process, matches)
         app.config['last_result'] = {
             'features': features,
@@ -320,10 +702,41 @@ def create_app():
 
     @app.get("/companies")
     def companies_list():
-        companies = fetch_all()
-        return render_template("companies.html", companies=companies)
+        return cached_page(("companies",), lambda: render_template("companies.html", companies=fetch_all()))
 
     # Admin APIs for Companies
+    @app.get("/api/companies")
+    def api_companies_list():
+        """企業一覧（id 昇順のキーセットページング）。
+
+        ?after=<前ページの next>&limit=（既定50、最大500）&fields=id,name,...（既定は一覧表示用の列）
+        &category=<工程カテゴリ>&machine=<装置名>&q=<キーワード>&ids=1,2,3（最大500件）
+        """
+        args = request.args
+        try:
+            fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()] or company_db.DEFAULT_PAGE_FIELDS
+            ids = list(dict.fromkeys(int(i) for i in args['ids'].split(',') if i.strip())) if args.get('ids') else None
+            # SQLite のプレースホルダ数の上限を超えないよう、1ページの最大件数までに制限する
+            if ids is not None and len(ids) > API_PAGE_MAX:
+                raise ValueError(f"ids は{API_PAGE_MAX}件までです")
+            after = args.get('after', type=int) or 0
+            limit = min(API_PAGE_MAX, max(1, args.get('limit', type=int) or 50))
+            any_of = []
+            if args.get('category'):
+                key = normalize_category_key(args['category'])
+                if key is None:
+                    raise ValueError(f"category が分かりません: {args['category']}")
+                any_of = keywords_for_category(key)
+
+            def render():
+                items, nxt = company_db.fetch_page(after, limit, fields, ids=ids, machine=args.get('machine'),
+                                                   q=args.get('q'), any_of=any_of)
+                return json.dumps({"ok": True, "items": items, "next": nxt}, ensure_ascii=False)
+
+            return cached_page(("companies",), render, mimetype='application/json')
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+
     @app.post("/api/companies")
     @admin_required
     def api_companies_create():
@@ -336,7 +749,11 @@ def create_app():
         location = (data.get('location') or '').strip()
         if not name or not machines:
             return jsonify({"ok": False, "error": "name と machines は必須です"}), 400
-        cid = create_company(name, machines, skills, notes, capacity, location)
+        try:
+            envelopes = envelope.normalize(data.get('envelopes'))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        cid = create_company(name, machines, skills, notes, capacity, location, envelopes)
         row = fetch_by_id(cid)
         return jsonify({"ok": True, "id": cid, "company": row.__dict__ if row else None})
 
@@ -344,6 +761,11 @@ def create_app():
     @admin_required
     def api_companies_update(company_id: int):
         data = request.get_json(silent=True) or {}
+        if 'envelopes' in data:
+            try:
+                data['envelopes'] = envelope.normalize(data['envelopes'])
+            except ValueError as e:
+                return jsonify({"ok": False, "error": str(e)}), 400
         ok = update_company(company_id, data)
         row = fetch_by_id(company_id)
         return jsonify({"ok": ok, "company": row.__dict__ if row else None})
@@ -354,6 +776,82 @@ def create_app():
         ok = delete_company(company_id)
         return jsonify({"ok": ok})
 
+    @app.get("/api/admin/llm")
+    @admin_required
+    def api_admin_llm():
+        # 呼び出し元別のLLMレイテンシ/トークン/リトライ/フォールバック/キャッシュ状況
+        return jsonify(llm.telemetry())
+
+    @app.get("/admin/plans")
+    @admin_required
+    def admin_plans():
+        plans = process_plans.list_plans()
+        for p in plans:
+            p['steps_json'] = json.dumps(p['steps'], ensure_ascii=False, indent=1)
+        return render_template("plans.html", plans=plans, enabled=process_plans.ENABLED)
+
+    @app.get("/api/admin/plans")
+    @admin_required
+    def api_admin_plans():
+        return jsonify({"ok": True, "plans": process_plans.list_plans()})
+
+    def _plan_key_from_request():
+        data = request.get_json(silent=True) or {}
+        src = data if isinstance(data, dict) else {}
+        src = {**request.args.to_dict(), **src}
+        has_dims = src.get('has_dims')
+        if isinstance(has_dims, str):
+            has_dims = has_dims.lower() in ('1', 'true', 'yes', 'on')
+        return process_plans.make_key(src.get('material'), src.get('part_type'), has_dims), src
+
+    @app.put("/api/admin/plans")
+    @admin_required
+    def api_admin_plans_put():
+        # 管理者の計画（source='admin'）はLLMの書き戻し・warm で上書きされない
+        key, data = _plan_key_from_request()
+        try:
+            steps = process_plans.validate_steps(data.get('steps'))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        process_plans.store(key, steps, source='admin', keep_admin=False)
+        return jsonify({"ok": True, "key": list(key), "steps": steps})
+
+    @app.delete("/api/admin/plans")
+    @admin_required
+    def api_admin_plans_delete():
+        key, _ = _plan_key_from_request()
+        return jsonify({"ok": process_plans.delete(key)})
+
+    @app.get("/admin/profiles")
+    @admin_required
+    def admin_profiles():
+        return render_template("profiles.html", state=profiling.status(), profiles=profiling.list_profiles())
+
+    @app.post("/admin/profiles")
+    @admin_required
+    def admin_profiles_update():
+        action = request.form.get('action') or 'arm'
+        if action == 'disarm':
+            profiling.disarm()
+        elif action == 'clear':
+            profiling.clear()
+        else:
+            profiling.arm(
+                count=request.form.get('count', type=int) or 0,
+                sample_pct=request.form.get('sample_pct', type=float) or 0.0,
+                trace_malloc=bool(request.form.get('tracemalloc')),
+            )
+        return redirect(url_for('admin_profiles'))
+
+    @app.get("/admin/profiles/<pid>/<kind>")
+    @admin_required
+    def admin_profile_download(pid: str, kind: str):
+        p = profiling.profile_file(pid, kind)
+        if not p:
+            return jsonify({"ok": False, "error": "not found"}), 404
+        return send_file(p, mimetype='application/octet-stream' if kind == 'pstats' else 'text/plain; charset=utf-8',
+                         as_attachment=kind == 'pstats', download_name=p.name)
+
     # Auth routes
     @app.get('/login')
     def login():
@@ -379,31 +877,10 @@ def create_app():
 
     @app.get("/assignments")
     def assignments_list():
-        rows = fetch_assignments()
-        companies = {c.id: c for c in fetch_all()}
-        items = []
-        for rid, task_name, company_id, created_at, drawing_file in rows:
-            c = companies.get(company_id)
-            items.append({
-                'id': rid,
-                'task_name': task_name,
-                'company_id': company_id,
-                'company_name': c.name if c else f"ID:{company_id}",
-                'created_at': created_at,
-                'drawing_file': drawing_file,
-            })
-        files = fetch_assignment_files()
-        return render_template("assignments.html", items=items, files=files)
-
-    @app.get("/reports")
-    def reports_list():
-        # 図面の選択UIを出し、選択された図面の割当一覧を表示
-        selected = request.args.get('file') or (app.config.get('last_upload_filename') or '')
-        files = [name for (name, _cnt) in fetch_assignment_files()]
-        items = []
-        companies = {c.id: c for c in fetch_all()}
-        if selected:
-            rows = fetch_assignments_for_file(selected)
+        def render():
+            rows = fetch_assignments()
+            companies = {c.id: c for c in fetch_all()}
+            items = []
             for rid, task_name, company_id, created_at, drawing_file in rows:
                 c = companies.get(company_id)
                 items.append({
@@ -414,6 +891,14 @@ def create_app():
                     'created_at': created_at,
                     'drawing_file': drawing_file,
                 })
+            files = fetch_assignment_files()
+            return render_template("assignments.html", items=items, files=files)
+        return cached_page(("companies", "assignments"), render)
+
+    @app.get("/reports")
+    def reports_list():
+        # 図面の選択UIを出し、選択された図面の割当一覧を表示
+        selected = request.args.get('file') or (app.config.get('last_upload_filename') or '')
         # last_result からメタを補助的に表示（選択ファイル一致時）
         meta = None
         data = app.config.get('last_result')
@@ -430,7 +915,26 @@ def create_app():
                     'steps_count': len(steps),
                     'top_matches': top,
                 }
-        return render_template("reports.html", report=meta, selected_file=selected, files=files, items=items)
+
+        def render():
+            files = [name for (name, _cnt) in fetch_assignment_files()]
+            items = []
+            companies = {c.id: c for c in fetch_all()}
+            if selected:
+                rows = fetch_assignments_for_file(selected)
+                for rid, task_name, company_id, created_at, drawing_file in rows:
+                    c = companies.get(company_id)
+                    items.append({
+                        'id': rid,
+                        'task_name': task_name,
+                        'company_id': company_id,
+                        'company_name': c.name if c else f"ID:{company_id}",
+                        'created_at': created_at,
+                        'drawing_file': drawing_file,
+                    })
+            return render_template("reports.html", report=meta, selected_file=selected, files=files, items=items)
+        # 選択図面と最新解析のメタもページ内容に含まれるためキーに加える
+        return cached_page(("companies", "assignments"), render, extra=(selected, json.dumps(meta, ensure_ascii=False, sort_keys=True)))
 
     @app.get("/download/docx")
     def download_docx():
@@ -438,19 +942,7 @@ def create_app():
         selected = request.args.get('file') or (app.config.get('last_upload_filename') or '')
         if selected:
             # 割当のみのエクスポート
-            companies = {c.id: c for c in fetch_all()}
-            rows = fetch_assignments_for_file(selected)
-            items = []
-            for rid, task_name, company_id, created_at, drawing_file in rows:
-                c = companies.get(company_id)
-                items.append({
-                    'id': rid,
-                    'task_name': task_name,
-                    'company_id': company_id,
-                    'company_name': c.name if c else f"ID:{company_id}",
-                    'created_at': created_at,
-                    'drawing_file': drawing_file,
-                })
+            items = assignment_items(selected)
             if items:
                 docx_bytes = render_assignments_docx(selected, items)
                 return send_file(io.BytesIO(docx_bytes), mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document', as_attachment=True, download_name=f'assignments_{selected}.docx')
@@ -461,4 +953,39 @@ def create_app():
         docx_bytes = render_report_docx(data['features'], data['process'], data['matches'])
         return send_file(io.BytesIO(docx_bytes), mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document', as_attachment=True, download_name=f'cma_report_{getattr(data["features"], "filename", "report")}.docx')
 
+    @app.get("/download/pdf")
+    def download_pdf():
+        # 最新解析の通常レポートをPDFで出力（内容のフィンガープリントでキャッシュ）
+        data = app.config.get('last_result')
+        if not data:
+            return redirect(url_for("index"))
+        fp = report_fingerprint(data['features'], data['process'], data['matches'])
+        if request.if_none_match.contains(fp):
+            return Response(status=304, headers={'ETag': f'"{fp}"'})
+        pdf_bytes = render_report_pdf_cached(data['features'], data['process'], data['matches'], fingerprint=fp)
+        resp = send_file(io.BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=True, download_name=f'cma_report_{getattr(data["features"], "filename", "report")}.pdf')
+        resp.set_etag(fp)
+        return resp
+
+    @app.get("/download/batch")
+    def download_batch():
+        # 全図面（または file=/q= で絞り込んだ図面）の割当レポートをZIPで一括出力
+        drawings = select_drawings(request.args.getlist('file'), request.args.get('q'))
+        if not drawings:
+            return jsonify({"ok": False, "error": "対象の図面がありません"}), 404
+        # 匿名の呼び出しでプロセスを大量に起動させないよう、並列数は既定値（CPU数）までに制限する
+        workers = clamp_workers(request.args.get('workers', type=int))
+
+        def progress(done, total, entry):
+            app.logger.info("batch export %d/%d %s ok=%s", done, total, entry.get('file'), entry.get('ok'))
+
+        return Response(
+            stream_reports_zip(drawings, workers=workers, progress=progress),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': 'attachment; filename="assignments_reports.zip"',
+                'X-Batch-Total': str(len(drawings)),
+            },
+        )
+
     return app
@@ -0,0 +1,199 @@
+"""アライアンス提案（複数社で全工程の装置をカバーする組み合わせ）の探索
+
+各社の装置カバレッジを整数ビット集合に符号化し、重み付き最小集合被覆を
+分枝限定法で解く。時間予算（CMA_ALLIANCE_BUDGET_MS）を超えた場合は
+それまでの最良解（初期解は貪欲法）を返す。上位 N 件の代替案も返す。
+
+コスト = 1社あたり 1.0 + SCORE_WEIGHT × (1 - スコア)
+つまり社数が最優先で、同数ならスコアの高い企業の組み合わせを選ぶ。
+"""
+import heapq
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from ..db.company_db import CompanyRow
+from .geo import LocationFilter
+
+BUDGET_MS = float(os.getenv("CMA_ALLIANCE_BUDGET_MS", "50"))
+TOP_N = int(os.getenv("CMA_ALLIANCE_TOP_N", "3"))
+MAX_PARTNERS = int(os.getenv("CMA_ALLIANCE_MAX_PARTNERS", "6"))
+SCORE_WEIGHT = float(os.getenv("CMA_ALLIANCE_SCORE_WEIGHT", "0.5"))
+
+
+@dataclass
+class Alliance:
+    members: List[CompanyRow]
+    cost: float
+    covered: List[str]                      # カバーされる装置
+    missing: List[str] = field(default_factory=list)  # どの企業も持たない装置
+    exact: bool = True                      # 時間内に最適性を確認できたか
+
+
+@dataclass
+class _Cand:
+    index: int          # 入力 candidates 内の位置
+    mask: int
+    cost: float
+
+
+def _split_csv(s: str) -> List[str]:
+    return [x.strip() for x in (s or "").split(",") if x.strip()]
+
+
+def encode(machines: Sequence[str], companies: Sequence[CompanyRow]) -> Tuple[Dict[str, int], List[int]]:
+    """装置名 → ビット位置、企業ごとのカバレッジのビット集合"""
+    bits = {m: i for i, m in enumerate(dict.fromkeys(machines))}
+    masks = []
+    for c in companies:
+        mask = 0
+        for m in _split_csv(c.machines):
+            b = bits.get(m)
+            if b is not None:
+                mask |= 1 << b
+        masks.append(mask)
+    return bits, masks
+
+
+def _cost(score: float) -> float:
+    return 1.0 + SCORE_WEIGHT * (1.0 - max(0.0, min(1.0, score)))
+
+
+def _prune(cands: List[_Cand], keep: int) -> List[_Cand]:
+    """被覆範囲が他社の部分集合で、かつそれ以上安い候補が keep 社以上あるものを除く（同一マスクも含む）。"""
+    by_mask: Dict[int, List[_Cand]] = {}
+    for c in cands:
+        by_mask.setdefault(c.mask, []).append(c)
+    for group in by_mask.values():
+        group.sort(key=lambda c: c.cost)
+        del group[keep:]
+    out: List[_Cand] = []
+    masks = list(by_mask)
+    for a in masks:
+        # a を包含する他マスクの候補コスト
+        sup = sorted(c.cost for b in masks if b != a and a & b == a for c in by_mask[b])
+        for rank, c in enumerate(by_mask[a]):
+            cheaper = sum(1 for x in sup if x <= c.cost)
+            if cheaper + rank < keep:
+                out.append(c)
+    return out
+
+
+def _greedy(target: int, cands: Sequence[_Cand]) -> Optional[Tuple[float, Tuple[int, ...]]]:
+    left, picked, cost = target, [], 0.0
+    while left:
+        best = max(cands, key=lambda c: (bin(c.mask & left).count("1") / c.cost, -c.cost), default=None)
+        if best is None or not best.mask & left:
+            return None
+        picked.append(best.index)
+        cost += best.cost
+        left &= ~best.mask
+    return cost, tuple(picked)
+
+
+def _irredundant(sol: Tuple[int, ...], mask_of: Dict[int, int], target: int) -> bool:
+    for i in sol:
+        rest = 0
+        for j in sol:
+            if j != i:
+                rest |= mask_of[j]
+        if rest & target == target:
+            return False
+    return True
+
+
+def solve(target: int, cands: Sequence[_Cand], top_n: int, budget_ms: float, max_partners: int) -> Tuple[List[Tuple[float, Tuple[int, ...]]], bool]:
+    """target を被覆するコスト最小の組み合わせを最大 top_n 件返す（(コスト, 候補index列), 最適性確認済みか）。"""
+    deadline = time.perf_counter() + budget_ms / 1000.0
+    mask_of = {c.index: c.mask for c in cands}
+    # ビットごとの被覆候補（安い順）
+    nbits = target.bit_length()
+    covering: List[List[_Cand]] = [[] for _ in range(nbits)]
+    for c in sorted(cands, key=lambda c: c.cost):
+        m = c.mask
+        while m:
+            low = m & -m
+            covering[low.bit_length() - 1].append(c)
+            m ^= low
+    min_cost = min((c.cost for c in cands), default=1.0)
+    max_bits = max((bin(c.mask).count("1") for c in cands), default=1)
+
+    best: List[Tuple[float, Tuple[int, ...]]] = []   # 最大ヒープ（-cost）
+    seen: set = set()
+
+    def offer(cost: float, sol: Tuple[int, ...]) -> None:
+        key: FrozenSet[int] = frozenset(sol)
+        if key in seen or not _irredundant(sol, mask_of, target):
+            return
+        seen.add(key)
+        item = (-cost, tuple(sorted(sol)))
+        if len(best) < top_n:
+            heapq.heappush(best, item)
+        elif cost < -best[0][0]:
+            heapq.heapreplace(best, item)
+
+    g = _greedy(target, cands)
+    if g is not None:
+        offer(*g)
+
+    exact = True
+    nodes = 0
+
+    def bound() -> float:
+        return -best[0][0] if len(best) >= top_n else float("inf")
+
+    def dfs(left: int, cost: float, sol: List[int]) -> bool:
+        nonlocal nodes
+        nodes += 1
+        if nodes & 255 == 0 and time.perf_counter() > deadline:
+            return False
+        if not left:
+            offer(cost, tuple(sol))
+            return True
+        # 下界: 残りビットを最大被覆の候補で埋める最小社数 × 最小コスト
+        need = -(-bin(left).count("1") // max_bits)
+        if len(sol) + need > max_partners or cost + need * min_cost >= bound():
+            return True
+        # 候補の少ないビットから分岐し、残りビットあたりのコストが小さい順に試す
+        pick = min((b for b in range(nbits) if left >> b & 1), key=lambda b: len(covering[b]))
+        order = sorted(covering[pick], key=lambda c: c.cost / bin(c.mask & left).count("1"))
+        for c in order:
+            rest = left & ~c.mask
+            if cost + c.cost + -(-bin(rest).count("1") // max_bits) * min_cost >= bound():
+                continue
+            sol.append(c.index)
+            ok = dfs(rest, cost + c.cost, sol)
+            sol.pop()
+            if not ok:
+                return False
+        return True
+
+    if not dfs(target, 0.0, []):
+        exact = False
+    return sorted(((-c, s) for c, s in best), key=lambda x: x[0]), exact
+
+
+def propose(machines: Sequence[str], companies: Sequence[CompanyRow], scores: Sequence[float],
+            top_n: int = TOP_N, budget_ms: float = BUDGET_MS,
+            max_partners: int = MAX_PARTNERS, where: Optional[LocationFilter] = None) -> List[Alliance]:
+    """装置リストを複数社でカバーするアライアンス案をコスト順に最大 top_n 件返す。
+    where（距離・地域）を渡すと条件外の企業は候補から除く。"""
+    if where is not None and where.active:
+        keep = {id(c) for c in where.apply(companies)}
+        pairs = [(c, s) for c, s in zip(companies, scores) if id(c) in keep]
+        companies, scores = [c for c, _ in pairs], [s for _, s in pairs]
+    bits, masks = encode(machines, companies)
+    universe = (1 << len(bits)) - 1
+    coverable = 0
+    for m in masks:
+        coverable |= m
+    if not coverable:
+        return []
+    cands = [_Cand(i, m, _cost(scores[i])) for i, m in enumerate(masks) if m]
+    cands = _prune(cands, max(1, top_n))
+    sols, exact = solve(coverable, cands, max(1, top_n), budget_ms, max_partners)
+    names = list(bits)
+    covered = [names[b] for b in range(len(names)) if coverable >> b & 1]
+    missing = [names[b] for b in range(len(names)) if not (coverable >> b & 1) and universe >> b & 1]
+    return [Alliance([companies[i] for i in sol], round(cost, 4), covered, missing, exact) for cost, sol in sols]
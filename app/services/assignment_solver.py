@@ -0,0 +1,270 @@
+"""複数図面の工程を企業へ一括割当（容量制約付き最小費用流）
+
+工程は企業ごとの費用が同じもの同士でクラスにまとめ、次のネットワークで分単位の最小費用流を解く。
+
+    source → 工程クラス（供給 = 工程時間の合計）
+           → 企業（装置を持つ企業のみ。費用 = 1 - 工程単位のスコア）
+           → sink（容量 = 企業の capacity を分に換算）
+    工程クラス → sink（未割当。大きな費用）
+
+得られた流量をクラス内の各工程（分割不可）へ時間の長い順に配分する。配分は企業の残り容量
+（全クラスの合計）に収まる企業だけから選ぶため、負荷が容量を超えることはない。流量の端数で
+どの企業にも収まらない工程は未割当になる（overbooked は容量を超えた企業の報告用で、通常は空）。
+"""
+import heapq
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..db.company_db import CompanyRow, save_assignments_bulk
+from .company_matching import ScoreMatrix, score_matrix
+from .metrics import timed
+from .process_breakdown import ProcessStep
+
+# capacity 表記 → 一括割当1回あたりの受注可能時間（分）。数値のみの capacity はそのまま分とみなす
+CAPACITY_MINUTES = os.getenv("CMA_CAPACITY_MINUTES", "Low=480,Medium=960,High=1920")
+DEFAULT_CAPACITY = "Medium"
+SCALE = 1000                  # 費用の整数化（スコア 0.001 刻み）
+UNASSIGNED_COST = SCALE * 10  # 1分あたりの未割当費用（どの企業の費用よりも大きい）
+
+
+def _parse_capacity_table(spec: str) -> Dict[str, int]:
+    table: Dict[str, int] = {}
+    for part in spec.split(","):
+        k, _, v = part.partition("=")
+        if k.strip() and v.strip().isdigit():
+            table[k.strip().lower()] = int(v)
+    return table
+
+
+_CAPACITY_TABLE = _parse_capacity_table(CAPACITY_MINUTES)
+_ALIASES = {"低": "low", "小": "low", "中": "medium", "高": "high", "大": "high"}
+
+
+def capacity_minutes(capacity: Optional[str]) -> int:
+    """CompanyRow.capacity（Low/Medium/High・低/中/高・数値）を分に換算する。"""
+    s = (capacity or "").strip()
+    m = re.match(r"^(\d+)", s)
+    if m:
+        return int(m.group(1))
+    key = _ALIASES.get(s, s.lower()) or DEFAULT_CAPACITY.lower()
+    return _CAPACITY_TABLE.get(key, _CAPACITY_TABLE.get(DEFAULT_CAPACITY.lower(), 960))
+
+
+@dataclass
+class Job:
+    drawing_file: str
+    steps: List[ProcessStep]
+
+
+@dataclass
+class Assignment:
+    drawing_file: str
+    task_name: str
+    machine: str
+    minutes: int
+    company: Optional[CompanyRow]  # None は未割当
+    score: float = 0.0
+
+
+@dataclass
+class Plan:
+    assignments: List[Assignment]
+    load: Dict[int, Tuple[int, int]] = field(default_factory=dict)  # 企業ID → (割当分, 容量分)
+    cost: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def unassigned(self) -> List[Assignment]:
+        return [a for a in self.assignments if a.company is None]
+
+    @property
+    def overbooked(self) -> List[int]:
+        return [cid for cid, (used, cap) in self.load.items() if used > cap]
+
+
+class MinCostFlow:
+    """逐次最短路（ポテンシャル付きDijkstra）による最小費用流。費用は非負整数。"""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.graph: List[List[int]] = [[] for _ in range(n)]
+        # 辺は配列で保持（to, cap, cost）。e ^ 1 が逆辺
+        self.to: List[int] = []
+        self.cap: List[int] = []
+        self.cost: List[int] = []
+
+    def add_edge(self, u: int, v: int, cap: int, cost: int) -> int:
+        e = len(self.to)
+        self.graph[u].append(e)
+        self.to.append(v); self.cap.append(cap); self.cost.append(cost)
+        self.graph[v].append(e + 1)
+        self.to.append(u); self.cap.append(0); self.cost.append(-cost)
+        return e
+
+    def flow(self, e: int) -> int:
+        return self.cap[e ^ 1]
+
+    def solve(self, s: int, t: int, maxflow: int) -> Tuple[int, int]:
+        n, graph, to, cap, cost = self.n, self.graph, self.to, self.cap, self.cost
+        h = [0] * n
+        total_flow = total_cost = 0
+        inf = float("inf")
+        while total_flow < maxflow:
+            dist = [inf] * n
+            prev = [-1] * n
+            dist[s] = 0
+            pq = [(0, s)]
+            while pq:
+                d, u = heapq.heappop(pq)
+                if d > dist[u]:
+                    continue
+                hu = h[u]
+                for e in graph[u]:
+                    if cap[e] > 0:
+                        v = to[e]
+                        nd = d + cost[e] + hu - h[v]
+                        if nd < dist[v]:
+                            dist[v] = nd
+                            prev[v] = e
+                            heapq.heappush(pq, (nd, v))
+            if dist[t] == inf:
+                break
+            for v in range(n):
+                if dist[v] < inf:
+                    h[v] += dist[v]
+            # 経路上の最小残容量だけ流す
+            f = maxflow - total_flow
+            v = t
+            while v != s:
+                e = prev[v]
+                f = min(f, cap[e])
+                v = to[e ^ 1]
+            v = t
+            while v != s:
+                e = prev[v]
+                cap[e] -= f
+                cap[e ^ 1] += f
+                v = to[e ^ 1]
+            total_flow += f
+            total_cost += f * (h[t] - h[s])
+        return total_flow, total_cost
+
+
+@timed("assignment_solver.solve")
+def solve(jobs: Sequence[Job], companies: Optional[Sequence[CompanyRow]] = None, use_llm: bool = False) -> Plan:
+    """全図面の工程を容量制約のもとで企業に割り当てる。"""
+    t0 = time.perf_counter()
+    all_steps = [s for job in jobs for s in job.steps]
+    if companies is None:
+        matrix = score_matrix(all_steps, use_llm=use_llm)
+    else:
+        matrix = ScoreMatrix(companies, all_steps)
+    comps = matrix.companies
+    ncomp = len(comps)
+    # 費用ベクトルが同じ列（装置が同じでLLM補助なし等）は1つの工程クラスにまとめる
+    sig_of: Dict[Tuple[Tuple[int, int], ...], int] = {}
+    costs: List[Tuple[Tuple[int, int], ...]] = []
+    cls_of_col: List[int] = []
+    for j in range(len(matrix.cols)):
+        sig = tuple((i, int(round((1.0 - matrix.step_score(i, j)) * SCALE))) for i in range(ncomp) if matrix.hit[i][j])
+        k = sig_of.get(sig)
+        if k is None:
+            k = sig_of[sig] = len(costs)
+            costs.append(sig)
+        cls_of_col.append(k)
+    ncls = len(costs)
+    members: List[List[Tuple[int, str, ProcessStep, int]]] = [[] for _ in range(ncls)]
+    pos = 0
+    for job in jobs:
+        for s in job.steps:
+            j = matrix.col_of[(s.name, s.machine)]
+            members[cls_of_col[j]].append((pos, job.drawing_file, s, j))
+            pos += 1
+    supply = [sum(max(1, int(s.minutes or 0)) for _, _, s, _ in ms) for ms in members]
+
+    src, sink = 0, 1 + ncls + ncomp
+    g = MinCostFlow(sink + 1)
+    arcs: List[List[Tuple[int, int]]] = [[] for _ in range(ncls)]  # クラス → [(企業index, 辺)]
+    for k in range(ncls):
+        if not supply[k]:
+            continue
+        g.add_edge(src, 1 + k, supply[k], 0)
+        for i, c in costs[k]:
+            arcs[k].append((i, g.add_edge(1 + k, 1 + ncls + i, supply[k], c)))
+        arcs[k].append((-1, g.add_edge(1 + k, sink, supply[k], UNASSIGNED_COST)))
+    caps = [capacity_minutes(c.capacity) for c in comps]
+    for i in range(ncomp):
+        g.add_edge(1 + ncls + i, sink, caps[i], 0)
+    g.solve(src, sink, sum(supply))
+
+    # 流量を工程へ配分（長い工程から、残り容量に収まる企業のうち残り配分の最も多い企業へ。
+    # 配分の残った企業を優先し、どこにも残っていなければ収まる企業、それもなければ未割当）
+    out: List[Optional[Assignment]] = [None] * len(all_steps)
+    used = [0] * ncomp
+    cost = 0.0
+    for k, ms in enumerate(members):
+        left = {i: g.flow(e) for i, e in arcs[k]}
+        for pos, drawing, s, j in sorted(ms, key=lambda x: -max(1, int(x[2].minutes or 0))):
+            minutes = max(1, int(s.minutes or 0))
+            fits = [x for x in left if x < 0 or used[x] + minutes <= caps[x]]
+            i = max(fits, key=lambda x: (left[x] > 0, x >= 0, left[x]))
+            left[i] -= minutes
+            if i < 0:
+                out[pos] = Assignment(drawing, s.name, s.machine, minutes, None)
+                cost += minutes * UNASSIGNED_COST / SCALE
+                continue
+            score = matrix.step_score(i, j)
+            used[i] += minutes
+            cost += minutes * (1.0 - score)
+            out[pos] = Assignment(drawing, s.name, s.machine, minutes, comps[i], round(score, 3))
+    load = {comps[i].id: (used[i], caps[i]) for i in range(ncomp) if used[i]}
+    return Plan([a for a in out if a is not None], load, round(cost, 3), round(time.perf_counter() - t0, 3))
+
+
+def save_plan(plan: Plan) -> int:
+    """割当済みの工程をまとめてDBに保存し、保存件数を返す。"""
+    rows = [(a.task_name, a.company.id, a.drawing_file) for a in plan.assignments if a.company is not None]
+    return save_assignments_bulk(rows)
+
+
+def jobs_from_dicts(items: Sequence[Dict[str, Any]]) -> List[Job]:
+    """[{"drawing_file": ..., "steps": [{name, machine, minutes, ...}]}] → Job のリスト"""
+    jobs = []
+    for item in items:
+        steps = [
+            ProcessStep(
+                name=str(s.get("name") or ""),
+                machine=str(s.get("machine") or ""),
+                minutes=int(s.get("minutes") or 0),
+                tolerance=s.get("tolerance"),
+                precision=s.get("precision"),
+            )
+            for s in item.get("steps") or []
+            if s.get("name") and s.get("machine")
+        ]
+        jobs.append(Job(str(item.get("drawing_file") or ""), steps))
+    return jobs
+
+
+def plan_to_dict(plan: Plan) -> Dict[str, Any]:
+    return {
+        "assignments": [
+            {
+                "drawing_file": a.drawing_file,
+                "task": a.task_name,
+                "machine": a.machine,
+                "minutes": a.minutes,
+                "company": {"id": a.company.id, "name": a.company.name} if a.company else None,
+                "score": a.score,
+            }
+            for a in plan.assignments
+        ],
+        "load": {str(cid): {"minutes": u, "capacity": c} for cid, (u, c) in plan.load.items()},
+        "unassigned": len(plan.unassigned),
+        "overbooked": plan.overbooked,
+        "cost": plan.cost,
+        "seconds": plan.seconds,
+    }
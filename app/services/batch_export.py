@@ -0,0 +1,154 @@
+"""図面ごとの割当レポート(.docx)を並列生成し、ZIPにまとめてストリーム出力する。"""
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from ..db.company_db import fetch_all, fetch_assignment_files, fetch_assignments_for_file
+from .report_generation import render_assignments_docx
+
+DEFAULT_WORKERS = int(os.getenv("CMA_EXPORT_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# 子プロセスごとに1回だけ受け取る企業一覧（id → 行）
+_companies: Optional[Dict[int, Any]] = None
+
+
+def clamp_workers(workers: Optional[int], limit: int = DEFAULT_WORKERS) -> int:
+    """外部入力の並列数を 1〜limit に収める。"""
+    return max(1, min(workers or limit, limit))
+
+
+def assignment_items(drawing_file: str, companies: Optional[Dict[int, Any]] = None) -> List[Dict[str, Any]]:
+    """指定図面の割当をレポート用のdictリストに整形する。"""
+    if companies is None:
+        companies = {c.id: c for c in fetch_all()}
+    items = []
+    for rid, task_name, company_id, created_at, drawing_file_ in fetch_assignments_for_file(drawing_file):
+        c = companies.get(company_id)
+        items.append({
+            'id': rid,
+            'task_name': task_name,
+            'company_id': company_id,
+            'company_name': c.name if c else f"ID:{company_id}",
+            'created_at': created_at,
+            'drawing_file': drawing_file_,
+        })
+    return items
+
+
+def select_drawings(files: Optional[Sequence[str]] = None, q: Optional[str] = None) -> List[str]:
+    """fetch_assignment_files() の図面から、明示リスト/部分一致で対象を絞り込む。"""
+    names = [name for (name, _cnt) in fetch_assignment_files()]
+    if files:
+        wanted = set(files)
+        names = [n for n in names if n in wanted]
+    if q:
+        ql = q.lower()
+        names = [n for n in names if ql in n.lower()]
+    return names
+
+
+def report_name(drawing_file: str) -> str:
+    return f"assignments_{drawing_file}.docx"
+
+
+def _init_worker(companies: Dict[int, Any]) -> None:
+    global _companies
+    _companies = companies
+
+
+def _render_one(drawing_file: str, companies: Optional[Dict[int, Any]] = None) -> Dict[str, Any]:
+    # プロセスプール内で実行（割当の読み出し～docx生成まで子プロセスで完結させる）
+    t0 = time.perf_counter()
+    try:
+        items = assignment_items(drawing_file, companies if companies is not None else _companies)
+        data = render_assignments_docx(drawing_file, items)
+        return {"file": drawing_file, "ok": True, "data": data, "items": len(items),
+                "seconds": round(time.perf_counter() - t0, 4)}
+    except Exception as e:
+        return {"file": drawing_file, "ok": False, "error": str(e),
+                "seconds": round(time.perf_counter() - t0, 4)}
+
+
+def iter_reports(drawings: Sequence[str], workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """図面ごとのレポートを完了順に返す。workers<=1 の場合は逐次処理。"""
+    workers = workers or DEFAULT_WORKERS
+    # 企業一覧は図面ごとに読まず、ここで1回だけ取得して子プロセスに渡す
+    companies = {c.id: c for c in fetch_all()}
+    if workers <= 1 or len(drawings) <= 1:
+        for d in drawings:
+            yield _render_one(d, companies)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(drawings)), initializer=_init_worker,
+                             initargs=(companies,)) as ex:
+        futures = [ex.submit(_render_one, d) for d in drawings]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+class _ZipStream(io.RawIOBase):
+    """書き込まれたバイト列を溜めておき、逐次取り出せる非シーク可能ストリーム。"""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buf += b
+        return len(b)
+
+    def pop(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+ProgressFn = Callable[[int, int, Dict[str, Any]], None]
+
+
+def stream_reports_zip(drawings: Sequence[str], workers: Optional[int] = None, progress: Optional[ProgressFn] = None) -> Iterator[bytes]:
+    """完了したレポートから順にZIPへ追加し、そのチャンクをyieldする。
+    末尾に各図面の成否をまとめた manifest.json を格納する。
+    """
+    sink = _ZipStream()
+    total = len(drawings)
+    manifest: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for done, res in enumerate(iter_reports(drawings, workers), start=1):
+            entry = {k: v for k, v in res.items() if k != "data"}
+            if res.get("ok"):
+                entry["name"] = report_name(res["file"])
+                zf.writestr(entry["name"], res["data"])
+            manifest.append(entry)
+            if progress:
+                progress(done, total, entry)
+            chunk = sink.pop()
+            if chunk:
+                yield chunk
+        summary = {
+            "total": total,
+            "ok": sum(1 for m in manifest if m.get("ok")),
+            "failed": sum(1 for m in manifest if not m.get("ok")),
+            "seconds": round(time.perf_counter() - t0, 3),
+            "reports": manifest,
+        }
+        zf.writestr("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2))
+    yield sink.pop()
+
+
+def write_reports_zip(path: str, drawings: Sequence[str], workers: Optional[int] = None, progress: Optional[ProgressFn] = None) -> None:
+    with open(path, "wb") as fp:
+        for chunk in stream_reports_zip(drawings, workers=workers, progress=progress):
+            fp.write(chunk)
+
+
+def print_progress(done: int, total: int, entry: Dict[str, Any]) -> None:
+    status = "ok" if entry.get("ok") else f"error: {entry.get('error')}"
+    print(f"[{done}/{total}] {entry.get('file')} ({status}, {entry.get('seconds')}s)", file=sys.stderr, flush=True)
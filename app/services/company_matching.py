@@ -1,8 +1,22 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
-from ..db.company_db import fetch_all, init_db, CompanyRow
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from ..db import company_db
+from ..db.company_db import fetch_all, CompanyRow
 from .task_mapping import classify_machine, keywords_for_category
-from . import llm
+from . import envelope, geo, llm, text_index
+from .alliance import Alliance, propose
+from .metrics import timed
+
+# (工程集合, 企業DBバージョン) ごとのスコア行列キャッシュ
+MATRIX_CACHE_SIZE = int(os.getenv("CMA_MATCH_CACHE_SIZE", "8"))
+# (企業ID, 行バージョン, 装置, 工程名) ごとのセル寄与のメモ（工程編集時は変わった工程だけ再計算）
+CELL_MEMO_SIZE = int(os.getenv("CMA_MATCH_MEMO_SIZE", "200000"))
+# LLM補助を問い合わせる企業数（工程テキストとの n-gram 類似度上位。0 でLLM補助なし、負数で全社）
+LLM_BOOST_TOPK = int(os.getenv("CMA_LLM_BOOST_TOPK", "5"))
 
 
 @dataclass
@@ -11,94 +25,367 @@ class Match:
     score: float
     steps: list
     alliance: Optional[List[CompanyRow]] = None  # アライアンス案（任意）
+    alliances: Optional[List[Alliance]] = None  # 代替案を含むアライアンス案（コスト順）
 
 
 def _split_csv(s: str) -> list:
     return [x.strip() for x in s.split(',') if x.strip()]
 
 
-def match_companies(process_steps) -> List[Match]:
-    # DB初期化（初回のみシード）
-    init_db(seed=True)
-    companies = fetch_all()
-    matches: List[Match] = []
-    required_machines = {s.machine for s in process_steps}
-    for c in companies:
-        c_machines = set(_split_csv(c.machines))
-        c_skills = _split_csv(c.skills)
-        score = 0.0
-        cover = []
-        # 機械カバレッジ
-        cover_ratio = len(required_machines & c_machines) / max(1, len(required_machines))
-        score += 0.6 * cover_ratio
-        # 備考/スキルの簡易一致
-        text = (" ".join(c_skills) + " " + c.notes).lower()
-        for s in process_steps:
-            m = s.machine
-            if any(k in text for k in ["sus", "ステンレス"]) and ("VMC" in m or "タッピング" in m):
-                score += 0.1
-            if "タッピング" in m and ("ねじ" in text):
-                score += 0.1
-        # ステップ割当（対応可能な工程）
-        for s in process_steps:
-            if s.machine in c_machines:
-                cover.append(s.name)
-        # カテゴリキーワードによるブースト（設備名の異表記やJP/EN差吸収）
+LLM_ARGS: Dict[str, Any] = dict(
+    system="企業マッチング評価",
+    temperature=0.0,
+    max_tokens=120,
+    timeout=15,
+    reasoning_effort="low",
+    site="matching",
+)
+
+
+def machine_terms(c: CompanyRow, machine: str) -> Tuple[bool, float]:
+    """1工程（装置）に対する企業の (装置保有, ルール加点) を返す。"""
+    c_machines = set(_split_csv(c.machines))
+    # 備考/スキルの簡易一致
+    text = (" ".join(_split_csv(c.skills)) + " " + c.notes).lower()
+    bonus = 0.0
+    if any(k in text for k in ["sus", "ステンレス"]) and ("VMC" in machine or "タッピング" in machine):
+        bonus += 0.1
+    if "タッピング" in machine and ("ねじ" in text):
+        bonus += 0.1
+    # カテゴリキーワードによるブースト（設備名の異表記やJP/EN差吸収）
+    cat = classify_machine(machine)
+    kws = keywords_for_category(cat) if cat else []
+    if kws:
         comp_text = f"{c.machines} {c.skills} {c.notes}".lower()
-        for s in process_steps:
-            cat = classify_machine(getattr(s, 'machine', ''))
-            if not cat:
-                continue
-            kws = keywords_for_category(cat)
-            if not kws:
-                continue
-            hit = sum(1 for kw in kws if kw and kw in comp_text)
-            if hit:
-                # 1工程あたり最大+0.15までブースト
-                score += min(0.15, 0.02 * hit)
-        # LLM補助（説明可能性向上のための微調整、任意）
-        if llm.is_configured():
-            prompt = f"""
+        hit = sum(1 for kw in kws if kw and kw in comp_text)
+        if hit:
+            # 1工程あたり最大+0.15までブースト
+            bonus += min(0.15, 0.02 * hit)
+    return machine in c_machines, bonus
+
+
+def llm_prompt(name: str, machine: str, c: CompanyRow) -> str:
+    return f"""
 あなたは企業マッチングの評価者です。次の工程要求と企業情報から、適合度boostのみをJSONで出力してください。
 スキーマ: {{"boost": "number(0.0-1.0)"}} 以外の出力は禁止。
-工程一覧: {', '.join([s.name+'('+s.machine+')' for s in process_steps])}
+工程: {name}({machine})
 企業: {c.name}\n機械: {c.machines}\nスキル: {c.skills}\n備考: {c.notes}
             """
-            js = llm.chat_json(
-                system="企業マッチング評価",
-                user=prompt,
-                temperature=0.0,
-                max_tokens=120,
-                timeout=15,
-                reasoning_effort="low",
-            )
-            if isinstance(js, dict):
-                try:
-                    boost = float(js.get("boost", 0.0))
-                    score = min(1.0, max(0.0, score * 0.9 + 0.1 * boost))
-                except Exception:
-                    pass
-        matches.append(Match(c, round(min(score, 1.0), 2), cover))
-    matches.sort(key=lambda m: m.score, reverse=True)
 
-    # 単独でカバー不可の場合、簡易アライアンス提案（上位Nから機械カバレッジを貪欲に充足）
+
+def parse_boost(js) -> Optional[float]:
+    if isinstance(js, dict):
+        try:
+            return float(js.get("boost", 0.0))
+        except Exception:
+            pass
+    return None
+
+
+def apply_boost(score: float, boosts: Sequence[Optional[float]]) -> float:
+    """LLM補助（工程ごとのboostの平均）を1割の重みで混ぜる。
+    boost のない工程はルールのスコアそのものを混ぜる（中立）。LLM補助を問い合わせなかった企業の
+    スコアは変わらず、問い合わせた企業とも同じ尺度で比べられる。"""
+    if any(b is not None for b in boosts):
+        vals = [score if b is None else b for b in boosts]
+        score = min(1.0, max(0.0, score * 0.9 + 0.1 * sum(vals) / len(vals)))
+    return score
+
+
+class _Cell:
+    __slots__ = ("hit", "bonus", "boost")
+
+    def __init__(self, hit: bool, bonus: float, boost: Optional[float] = None):
+        self.hit = hit
+        self.bonus = bonus
+        self.boost = boost  # None はLLM補助が未取得（ルールのみ/失敗/スキップ）
+
+
+class _CellMemo:
+    """セル寄与の上限付きLRU（1回のロックでまとめて取得/格納）"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.lock = threading.Lock()
+        self.data: "OrderedDict[Tuple, _Cell]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: Sequence[Tuple]) -> List[Optional[_Cell]]:
+        out: List[Optional[_Cell]] = []
+        with self.lock:
+            for k in keys:
+                cell = self.data.get(k)
+                if cell is not None:
+                    self.data.move_to_end(k)
+                out.append(cell)
+            found = sum(1 for c in out if c is not None)
+            self.hits += found
+            self.misses += len(out) - found
+        return out
+
+    def put_many(self, cells: Dict[Tuple, _Cell]) -> None:
+        if self.size <= 0 or not cells:
+            return
+        with self.lock:
+            self.data.update(cells)
+            for k in cells:
+                self.data.move_to_end(k)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"entries": len(self.data), "hits": self.hits, "misses": self.misses}
+
+
+_memo = _CellMemo(CELL_MEMO_SIZE)
+
+
+class ScoreMatrix:
+    """企業 × 工程（name, machine の重複なし）ごとの寄与を保持し、任意の工程部分集合のスコアを再集計で求める。"""
+
+    def __init__(self, companies: Sequence[CompanyRow], process_steps):
+        self.companies = list(companies)
+        self.cols: List[Tuple[str, str]] = []
+        self.col_of: Dict[Tuple[str, str], int] = {}
+        for s in process_steps:
+            key = (s.name, s.machine)
+            if key not in self.col_of:
+                self.col_of[key] = len(self.cols)
+                self.cols.append(key)
+        self.hit: List[List[bool]] = []
+        self.bonus: List[List[float]] = []
+        self.boost: List[List[Optional[float]]] = []
+        self.complete = False  # LLM補助を全セルで試行し終えたか（未実施・期限切れ等で中断したら False）
+        self._fill_lock = threading.Lock()
+        self._kw_hits: Dict[Tuple[str, ...], Dict[int, int]] = {}
+        keys = [(c.id, c.row_version, machine, name) for c in self.companies for name, machine in self.cols]
+        cached = _memo.get_many(keys)
+        fresh: Dict[Tuple, _Cell] = {}
+        n = len(self.cols)
+        for i, c in enumerate(self.companies):
+            per_machine: Dict[str, Tuple[bool, float]] = {}
+            row = cached[i * n:(i + 1) * n]
+            for j, (name, machine) in enumerate(self.cols):
+                if row[j] is None:
+                    # ルール寄与は装置のみに依存する
+                    if machine not in per_machine:
+                        per_machine[machine] = machine_terms(c, machine)
+                    row[j] = fresh[keys[i * n + j]] = _Cell(*per_machine[machine])
+            self.hit.append([cell.hit for cell in row])
+            self.bonus.append([cell.bonus for cell in row])
+            self.boost.append([cell.boost for cell in row])
+        _memo.put_many(fresh)
+
+    def _remember(self, cells: Sequence[Tuple[int, int]]) -> None:
+        # 取得できたboostのみ記憶し、失敗/スキップしたセルは次回に再試行する
+        _memo.put_many({
+            (self.companies[i].id, self.companies[i].row_version, self.cols[j][1], self.cols[j][0]):
+                _Cell(self.hit[i][j], self.bonus[i][j], self.boost[i][j])
+            for i, j in cells if self.boost[i][j] is not None
+        })
+
+    # ---- LLM補助 ----
+
+    def query_text(self) -> str:
+        """類似度検索の問い合わせ文（工程名・装置・カテゴリキーワード）"""
+        parts: List[str] = []
+        for name, machine in self.cols:
+            cat = classify_machine(machine)
+            parts += [name, machine] + (keywords_for_category(cat) if cat else [])
+        return " ".join(dict.fromkeys(parts))
+
+    def boost_candidates(self) -> List[int]:
+        """LLM補助を問い合わせる企業index。必要な装置を1つ以上持つ企業のうち、n-gram 類似度の上位
+        LLM_BOOST_TOPK 社（同点は装置カバー数の多い順）。"""
+        if LLM_BOOST_TOPK == 0 or not self.cols:
+            return []
+        covering = [i for i in range(len(self.companies)) if any(self.hit[i])]
+        if LLM_BOOST_TOPK < 0 or len(covering) <= LLM_BOOST_TOPK:
+            return covering
+        ids = [c.id for c in self.companies]
+        try:
+            sim = dict(text_index.relevance(self.query_text(), k=LLM_BOOST_TOPK, ids=ids))
+        except Exception:
+            sim = {}  # 索引を作れない場合はルールのカバー数のみで選ぶ
+        order = sorted(covering, key=lambda i: (-sim.get(ids[i], 0.0), -sum(self.hit[i])))
+        return order[:LLM_BOOST_TOPK]
+
+    def boost_requests(self) -> Iterator[Tuple[int, int, str]]:
+        """boost未取得のセルについて (企業index, 工程index, プロンプト) を返す（対象は boost_candidates の企業のみ）。"""
+        for i in self.boost_candidates():
+            c = self.companies[i]
+            for j, (name, machine) in enumerate(self.cols):
+                if self.boost[i][j] is None:
+                    yield i, j, llm_prompt(name, machine, c)
+
+    def fill_boosts(self) -> None:
+        """boost未取得のセルを順に問い合わせる（企業×工程ごとに1回）。期限切れ等で中断したら complete=False のまま
+        返り、キャッシュ済みの行列なら次のリクエストで続きから埋める。別スレッドが埋めている間は何もしない。"""
+        if not self._fill_lock.acquire(blocking=False):
+            return
+        done: List[Tuple[int, int]] = []
+        try:
+            self.complete = False
+            for i, j, prompt in self.boost_requests():
+                if not llm.should_call("matching"):
+                    return
+                self.boost[i][j] = parse_boost(llm.chat_json(user=prompt, **LLM_ARGS))
+                done.append((i, j))
+            self.complete = True
+        finally:
+            self._remember(done)
+            self._fill_lock.release()
+
+    async def afill_boosts(self) -> None:
+        # 候補選定（索引の差分更新・類似度検索）はDBアクセスを含むためスレッドで行う
+        reqs = await asyncio.to_thread(lambda: list(self.boost_requests()))
+        pending = iter(reqs)
+        done: List[Tuple[int, int]] = []
+
+        async def worker() -> None:
+            # fill_boosts と同じく、期限切れ・ブレーカ開放になったら新しいセルは始めない
+            for i, j, prompt in pending:
+                if not llm.should_call("matching"):
+                    return
+                self.boost[i][j] = parse_boost(await llm.achat_json(user=prompt, **LLM_ARGS))
+                done.append((i, j))
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(len(reqs), max(1, llm.CONCURRENCY)))))
+        finally:
+            self._remember(done)
+
+    # ---- 集計 ----
+
+    def matches(self, process_steps) -> List[Match]:
+        """process_steps（行列の工程の部分集合）に対するマッチ結果をスコア順で返す。"""
+        cols = [self.col_of[(s.name, s.machine)] for s in process_steps]
+        required = {self.cols[j][1] for j in cols}
+        out: List[Match] = []
+        for i, c in enumerate(self.companies):
+            hit, bonus, boost = self.hit[i], self.bonus[i], self.boost[i]
+            # 機械カバレッジ
+            covered = {self.cols[j][1] for j in cols if hit[j]}
+            score = 0.6 * len(covered) / max(1, len(required)) + sum(bonus[j] for j in cols)
+            score = apply_boost(score, [boost[j] for j in cols])
+            # ステップ割当（対応可能な工程）
+            cover = [self.cols[j][0] for j in cols if hit[j]]
+            out.append(Match(c, round(min(score, 1.0), 2), cover))
+        return rank(out, process_steps)
+
+    def step_score(self, i: int, j: int) -> float:
+        """企業 i の工程 j 単独でのスコア（matches と同じ式で工程1件分）。装置を持たなければ 0。"""
+        if not self.hit[i][j]:
+            return 0.0
+        return min(1.0, apply_boost(0.6 + self.bonus[i][j], [self.boost[i][j]]))
+
+    def keyword_hits(self, keywords: Sequence[str]) -> Dict[int, int]:
+        """企業IDごとのキーワード一致数（タブの優先度並べ替え用、キーワード集合ごとにメモ化）"""
+        key = tuple(keywords)
+        hits = self._kw_hits.get(key)
+        if hits is None:
+            hits = {}
+            for c in self.companies:
+                text = f"{c.machines} {c.skills} {c.notes}".lower()
+                hits[c.id] = sum(1 for kw in key if kw and kw in text)
+            self._kw_hits[key] = hits
+        return hits
+
+
+_matrix_lock = threading.Lock()
+_matrix_cache: "OrderedDict[Tuple, ScoreMatrix]" = OrderedDict()
+_companies_cache: Tuple[Optional[Tuple[str, int]], List[CompanyRow]] = (None, [])
+_grid_cache: Tuple[Optional[Tuple[str, int]], Optional[geo.GridIndex]] = (None, None)
+_envelope_cache: Tuple[Optional[Tuple[str, int]], Optional[envelope.EnvelopeIndex]] = (None, None)
+
+
+def _companies(db_path: str, version: int) -> List[CompanyRow]:
+    """企業一覧（企業DBバージョンが同じ間は再取得しない）"""
+    global _companies_cache
+    key, rows = _companies_cache
+    if key != (db_path, version):
+        rows = fetch_all()
+        _companies_cache = ((db_path, version), rows)
+    return rows
+
+
+def _candidates(db_path: str, version: int, where: Optional[geo.LocationFilter],
+                part: Optional[envelope.PartSize] = None, machines: Sequence[str] = ()) -> List[CompanyRow]:
+    """所在地条件・部品外形で絞り込んだ企業一覧（格子索引・範囲索引は企業DBバージョンごとに1回だけ作る）"""
+    global _grid_cache, _envelope_cache
+    all_rows = rows = _companies(db_path, version)
+    if where is not None and where.active:
+        key, grid = _grid_cache
+        if key != (db_path, version) or grid is None:
+            grid = geo.GridIndex(all_rows)
+            _grid_cache = ((db_path, version), grid)
+        rows = where.apply(all_rows, grid)
+    if part is not None and part.active:
+        key, index = _envelope_cache
+        if key != (db_path, version) or index is None:
+            index = envelope.EnvelopeIndex(all_rows)
+            _envelope_cache = ((db_path, version), index)
+        rows = envelope.filter_companies(rows, part, machines, index)
+    return rows
+
+
+@timed("score_matrix")
+def score_matrix(process_steps, use_llm: bool = True, where: Optional[geo.LocationFilter] = None,
+                 part: Optional[envelope.PartSize] = None) -> ScoreMatrix:
+    """企業DBの全社（where 指定時は所在地条件、part 指定時は工程の装置に部品が載る企業）に対するスコア行列。
+    (工程集合, 企業DBバージョン, LLM補助の有無, 所在地条件, 部品外形) が同じなら再利用する。"""
+    company_db.ensure_db()
+    use_llm = use_llm and llm.should_call("matching")
+    where = where if where is not None and where.active else None
+    part = part if part is not None and part.active else None
+    key = (str(company_db.DB_PATH), company_db.data_version(), use_llm,
+           tuple(sorted({(s.name, s.machine) for s in process_steps})), where, part)
+    with _matrix_lock:
+        matrix = _matrix_cache.get(key)
+        if matrix is not None:
+            _matrix_cache.move_to_end(key)
+    if matrix is None:
+        matrix = ScoreMatrix(_candidates(key[0], key[1], where, part, [m for _, m in key[3]]), process_steps)
+        # LLM補助が途中で打ち切られてもルールの寄与は確定しているので保持し、boostは以降のリクエストで埋める
+        if MATRIX_CACHE_SIZE > 0:
+            with _matrix_lock:
+                _matrix_cache[key] = matrix
+                while len(_matrix_cache) > MATRIX_CACHE_SIZE:
+                    _matrix_cache.popitem(last=False)
+    if use_llm and not matrix.complete:
+        matrix.fill_boosts()
+    return matrix
+
+
+@timed("match_companies")
+def match_companies(process_steps, companies: Optional[List[CompanyRow]] = None,
+                    where: Optional[geo.LocationFilter] = None,
+                    part: Optional[envelope.PartSize] = None) -> List[Match]:
+    """where（距離・地域）・part（部品外形）を渡すと、条件外の企業はスコア計算の前に除外する。"""
+    if companies is None:
+        return score_matrix(process_steps, where=where, part=part).matches(process_steps)
+    if where is not None and where.active:
+        companies = where.apply(companies)
+    companies = envelope.filter_companies(companies, part, [s.machine for s in process_steps])
+    matrix = ScoreMatrix(companies, process_steps)
+    # LLM補助（説明可能性向上のための微調整、任意）
+    if llm.should_call("matching"):
+        matrix.fill_boosts()
+    return matrix.matches(process_steps)
+
+
+def rank(matches: List[Match], process_steps) -> List[Match]:
+    """スコア順に並べ、単独でカバー不可ならアライアンス案を先頭に付ける。"""
+    matches.sort(key=lambda m: m.score, reverse=True)
+    # 単独でカバー不可の場合、装置カバレッジの最小集合被覆でアライアンスを提案（alliance.py）
     have_full_cover = any(set(m.steps) and len(set(m.steps)) == len(process_steps) for m in matches)
     if not have_full_cover and matches:
-        needed = set(s.machine for s in process_steps)
-        alliance: List[CompanyRow] = []
-        cover_steps: List[str] = []
-        for m in matches:
-            cm = set(_split_csv(m.company.machines))
-            if needed & cm:
-                alliance.append(m.company)
-                # どの工程が埋まったかを積算
-                for s in process_steps:
-                    if s.machine in cm:
-                        cover_steps.append(s.name)
-                needed -= cm
-            if not needed:
-                break
+        alliances = propose([s.machine for s in process_steps],
+                            [m.company for m in matches], [m.score for m in matches])
         # アライアンス提案を先頭マッチに紐付け（UI最小変更のため）
-        if alliance:
-            matches[0].alliance = alliance
+        if alliances:
+            matches[0].alliance = alliances[0].members
+            matches[0].alliances = alliances
     return matches
@@ -5,6 +5,9 @@ from PIL import Image
 import pytesseract
 from pdfminer.high_level import extract_text
 from . import llm
+from .dimension_extract import Dimensions, extract as extract_dimensions
+from .dxf_reader import DxfContent, read_dxf_cached
+from .metrics import timed
 
 @dataclass
 class Features:
@@ -24,8 +27,11 @@ class Features:
     # その他
     notes: Optional[str] = None
     dims_text: Optional[str] = None
+    dims: Optional[Dimensions] = None  # 本文から抽出した寸法・公差・粗さ
+    bbox: Optional[List[float]] = None  # CAD図面の外形範囲 [xmin, ymin, xmax, ymax]（mm）
 
 
+@timed("ocr_image")
 def _ocr_image(p: Path) -> str:
     try:
         img = Image.open(p)
@@ -35,6 +41,7 @@ def _ocr_image(p: Path) -> str:
         return f""
 
 
+@timed("extract_text_pdf")
 def _extract_text_from_pdf(p: Path) -> str:
     try:
         return extract_text(str(p))
@@ -42,18 +49,52 @@ def _extract_text_from_pdf(p: Path) -> str:
         return ""
 
 
-def analyze_file(p: Path) -> Features:
+def _read_cad(p: Path) -> Optional[DxfContent]:
+    try:
+        return read_dxf_cached(p)
+    except (OSError, ValueError):
+        return None
+
+
+def read_text(p: Path) -> str:
+    """拡張子に応じてOCR/PDF/DXFのテキスト抽出を行う。"""
     ext = p.suffix.lower().lstrip('.')
-    text = ""
     if ext in {"png", "jpg", "jpeg"}:
-        text = _ocr_image(p)
-    elif ext == "pdf":
-        text = _extract_text_from_pdf(p)
-    # DXF/DWGなどは本プロトタイプではOCR対象外
+        return _ocr_image(p)
+    if ext == "pdf":
+        return _extract_text_from_pdf(p)
+    if ext == "dxf":
+        cad = _read_cad(p)
+        return cad.text() if cad else ""
+    # DWG（バイナリ形式）は対象外
+    return ""
 
-    # LLMが設定されていれば補助推論
-    if llm.is_configured():
-        prompt = f"""
+
+# 表題欄の属性タグ → Features の項目
+_TITLE_BLOCK_TAGS = {
+    "title": ("TITLE", "NAME", "PART_NAME", "図名", "品名", "名称"),
+    "drawing_no": ("DWG_NO", "DWGNO", "DRAWING_NO", "DRAWING_NUMBER", "図番"),
+    "material": ("MATERIAL", "MAT", "材質"),
+}
+
+
+# ルールで判定する材質・部品種別（本文/ファイル名に含まれる最初の語。LLMより優先）
+MATERIAL_WORDS = ("SUS", "AL", "FC", "SS", "真鍮", "アルミ", "鋼")
+PART_TYPE_WORDS = ("ブラケット", "フランジ", "シャフト", "プレート", "ケース", "ハウジング")
+
+
+LLM_ARGS: Dict[str, Any] = dict(
+    system="製造図面解析",
+    temperature=0.1,
+    max_tokens=300,
+    timeout=20,
+    reasoning_effort="low",
+    site="diagram",
+)
+
+
+def llm_prompt(p: Path, text: str) -> str:
+    return f"""
 あなたは製造図面解析の専門家AIです。以下の入力から、次の項目のみを含むJSONを厳密に1つだけ出力してください。説明文やコードブロックは不要です。
 スキーマ: {{
     "title": "string(optional)",
@@ -77,63 +118,60 @@ def analyze_file(p: Path) -> Features:
 ファイル名: {p.name}
 抽出テキスト（冒頭800文字）: {text[:800]}
         """
-        js = llm.chat_json(
-            system="製造図面解析",
-            user=prompt,
-            temperature=0.1,
-            max_tokens=300,
-            timeout=20,
-            reasoning_effort="low",
-        ) or {}
-        material = js.get("material") if isinstance(js, dict) else None
-        part_type = js.get("part_type") if isinstance(js, dict) else None
-        title = js.get("title") if isinstance(js, dict) else None
-        drawing_no = js.get("drawing_no") if isinstance(js, dict) else None
-        surface_finish = js.get("surface_finish") if isinstance(js, dict) else None
-        tolerances = js.get("tolerances") if isinstance(js, dict) else None
-        recommended_process = js.get("recommended_process") if isinstance(js, dict) else None
-        recommended_machine = js.get("recommended_machine") if isinstance(js, dict) else None
-    else:
-        material = None
-        part_type = None
-        title = None
-        drawing_no = None
-        surface_finish = None
-        tolerances = None
-        recommended_process = None
-        recommended_machine = None
-    for m in ["SUS", "AL", "FC", "SS", "真鍮", "アルミ", "鋼"]:
+
+
+@timed("analyze_file")
+def analyze_file(p: Path) -> Features:
+    text = read_text(p)
+    # LLMが設定されていれば補助推論
+    js = None
+    if llm.should_call("diagram"):
+        js = llm.chat_json(user=llm_prompt(p, text), **LLM_ARGS)
+    return build_features(p, text, js)
+
+
+def build_features(p: Path, text: str, js: Optional[Dict[str, Any]] = None) -> Features:
+    """LLM推論結果（任意）にルール抽出を重ねて Features を組み立てる。
+    材質/部品種別はルールで判定できればLLMより優先する。
+    """
+    ext = p.suffix.lower().lstrip('.')
+    js = js if isinstance(js, dict) else {}
+    material = js.get("material")
+    part_type = js.get("part_type")
+    title = js.get("title")
+    drawing_no = js.get("drawing_no")
+    surface_finish = js.get("surface_finish")
+    tolerances = js.get("tolerances")
+    recommended_process = js.get("recommended_process")
+    recommended_machine = js.get("recommended_machine")
+    cad = _read_cad(p) if ext == "dxf" and p.exists() else None
+    for m in MATERIAL_WORDS:
         if m in text or m in p.name:
             material = m
             break
-    for k in ["ブラケット", "フランジ", "シャフト", "プレート", "ケース", "ハウジング"]:
+    for k in PART_TYPE_WORDS:
         if k in text or k in p.name:
             part_type = k
             break
+    if cad is not None:
+        # CADの表題欄は図面そのものの記載なので最優先
+        found = {key: next((cad.attribs[t] for t in tags if t in cad.attribs), None) for key, tags in _TITLE_BLOCK_TAGS.items()}
+        title = found["title"] or title
+        drawing_no = found["drawing_no"] or drawing_no
+        material = found["material"] or material
 
-    dims_text = None
-    for token in ["φ", "±", "R", "mm", "+0", "-0"]:
-        if token in text:
-            dims_text = "...寸法表記を検出..."
-            break
-
-    # 表面粗さ/公差のヒューリスティック抽出
-    if not surface_finish and any(k in text for k in ["Ra", "RA", "ｒａ"]):
-        # 簡易抽出（例: Ra1.6 を拾う）
-        import re
-        m = re.search(r"R[aA]\s*\d+(?:\.\d+)?", text)
-        if m:
-            surface_finish = m.group(0)
-    tol_list: List[str] = []
-    for tok in ["±0.01", "±0.02", "±0.05", "±0.1", "±0.20", "H7"]:
-        if tok in text:
-            tol_list.append(tok)
-    if tolerances is None and tol_list:
-        tolerances = tol_list
+    # 寸法・公差・表面粗さは1回の走査でまとめて抽出する
+    dims = extract_dimensions(text)
+    dims_text = dims.summary() if dims else None
+    if not surface_finish and dims.roughness:
+        kind, value = dims.roughness[0]
+        surface_finish = f"{kind}{value:g}"
+    if tolerances is None and (dims.tolerances or dims.fits):
+        tolerances = dims.tolerances + dims.fits
 
     # 推奨加工/装置の簡易推定
     if not recommended_process:
-        if "フランジ" in (part_type or "") or "φ" in (text or ""):
+        if "フランジ" in (part_type or "") or dims.diameters:
             recommended_process = "旋盤"
         elif "プレート" in (part_type or ""):
             recommended_process = "フライス"
@@ -156,4 +194,6 @@ def analyze_file(p: Path) -> Features:
         recommended_machine=recommended_machine,
         notes=(text[:500] if text else None),
         dims_text=dims_text,
+        dims=dims if dims else None,
+        bbox=[round(v, 3) for v in cad.bbox] if cad is not None and cad.bbox else None,
     )
@@ -0,0 +1,159 @@
+"""OCR/PDFテキストからの寸法・公差・表面粗さの抽出
+
+全角英数・記号を NFKC で正規化し（φ の異体字やマイナス記号も統一）、事前コンパイルした
+1本の正規表現で先頭から1回だけ走査する。各候補は名前付きグループで種別を判定する。
+"""
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, List, Set, Tuple
+
+# NFKC で統一されない記号（直径記号の異体字・各種マイナス・乗算記号）。
+# 非ASCII文字列への str.translate は遅いため、含まれる文字だけ str.replace で置き換える
+_REPLACE = (
+    ("Φ", "φ"), ("ϕ", "φ"), ("ø", "φ"), ("Ø", "φ"), ("⌀", "φ"),
+    ("−", "-"), ("–", "-"), ("—", "-"), ("‐", "-"),
+    ("×", "x"), ("*", "x"),
+)
+
+_NUM = r"\d+(?:\.\d+)?"
+# はめあい記号（穴: 大文字 / 軸: 小文字、等級 1〜18）。単独表記はねじ(M)・面取り(C)・半径(R)等と
+# 紛れやすいため、よく使う記号のみ受け付ける（"H7/g6" のような組は全記号可）
+_HOLE = r"(?:ZA|ZB|ZC|CD|EF|FG|JS|[A-HJKMNP-Z])"
+_SHAFT = r"(?:za|zb|zc|cd|ef|fg|js|[a-hjkmnp-z])"
+_GRADE = r"(?:1[0-8]|[1-9])"
+_HOLE_SINGLE = r"(?:JS|[EFGHJKNP])"
+_SHAFT_SINGLE = r"(?:js|[efghjkmnprs])"
+
+_PATTERN = re.compile(
+    rf"""
+    # 候補の先頭は「語頭の英字」「数値の先頭桁」「± + φ」のみ。それ以外の位置（かな漢字・空白・
+    # 語中の英字や数字、分数の分母）は選択肢を試さずに読み飛ばす
+    (?:(?<![A-Za-z])(?=[A-Za-z])|(?<![\d./])(?=\d)|(?=[±+φ]))
+    (?:
+      (?P<tol_pm>±\s*(?P<tol_pm_v>{_NUM}))
+    | (?P<tol_asym>\+\s*(?P<tol_up>{_NUM})\s*/?\s*-\s*(?P<tol_lo>{_NUM}))
+    | (?P<rough>R(?P<rough_k>[aAzZ])\s*(?P<rough_v>{_NUM}))
+    | (?P<thread>M(?P<thread_d>{_NUM})(?:\s*x\s*(?P<thread_p>{_NUM}))?)(?![\d.])
+    | (?P<fit_pair>(?P<fit_h>{_HOLE}{_GRADE})\s*/\s*(?P<fit_s>{_SHAFT}{_GRADE}))(?![\d.])
+    | (?P<dia>(?:(?P<dia_n>\d+)\s*[x-]\s*)?φ\s*(?P<dia_v>{_NUM})(?:\s*(?P<dia_u>mm))?)
+    | (?P<radius>R\s*(?P<radius_v>{_NUM}))
+    | (?P<chamfer>C(?P<chamfer_v>{_NUM}))(?![\d])
+    | (?P<pcd>PCD\s*(?P<pcd_v>{_NUM}))
+    | (?P<size>(?P<size_a>{_NUM})\s*x\s*(?P<size_b>{_NUM})(?:\s*x\s*(?P<size_c>{_NUM}))?(?:\s*(?P<size_u>mm|cm))?)
+    | (?P<length>(?:(?:(?P<length_w>\d+)[\s-])?(?P<length_n>\d+)/(?P<length_d>\d+)|(?P<length_v>{_NUM}))
+                 \s*(?P<length_u>mm|cm|μm|um|m|in)(?![A-Za-z]))
+    | (?P<fit>{_HOLE_SINGLE}{_GRADE}|{_SHAFT_SINGLE}{_GRADE})(?![\d.A-Za-z])
+    )
+    """,
+    re.VERBOSE,
+)
+
+_TO_MM = {"mm": 1.0, "cm": 10.0, "m": 1000.0, "μm": 0.001, "um": 0.001, "in": 25.4}
+
+
+@dataclass
+class Dimensions:
+    tolerances: List[str] = field(default_factory=list)     # "±0.05", "+0.02/-0.01"
+    fits: List[str] = field(default_factory=list)           # "H7", "H7/g6"
+    diameters: List[float] = field(default_factory=list)    # φ（mm）
+    hole_counts: List[int] = field(default_factory=list)    # "6xφ10" の 6（diameters と同順、指定なしは1）
+    radii: List[float] = field(default_factory=list)
+    chamfers: List[float] = field(default_factory=list)
+    threads: List[str] = field(default_factory=list)        # "M6", "M8x1.25"
+    pcd: List[float] = field(default_factory=list)
+    sizes: List[List[float]] = field(default_factory=list)  # "100x50" → [100.0, 50.0]
+    lengths: List[float] = field(default_factory=list)      # 単位付き寸法（mmに換算）
+    roughness: List[Tuple[str, float]] = field(default_factory=list)  # ("Ra", 1.6)
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, k) for k in self.__dataclass_fields__)
+
+    def summary(self, limit: int = 8) -> str:
+        """dims_text 用の短い要約（例: "φ80 / R5 / 100x50 / ±0.05 / H7 / Ra1.6"）"""
+        parts: List[str] = []
+        parts += [f"{n}xφ{_fmt(d)}" if n > 1 else f"φ{_fmt(d)}" for d, n in zip(self.diameters, self.hole_counts)]
+        parts += [f"R{_fmt(r)}" for r in self.radii]
+        parts += [f"C{_fmt(c)}" for c in self.chamfers]
+        parts += self.threads
+        parts += [f"PCD{_fmt(v)}" for v in self.pcd]
+        parts += ["x".join(_fmt(v) for v in s) for s in self.sizes]
+        parts += [f"{_fmt(v)}mm" for v in self.lengths]
+        parts += self.tolerances + self.fits
+        parts += [f"{k}{_fmt(v)}" for k, v in self.roughness]
+        parts = list(dict.fromkeys(parts))
+        return " / ".join(parts[:limit]) + (" …" if len(parts) > limit else "")
+
+
+def _fmt(v: float) -> str:
+    return f"{v:g}"
+
+
+def normalize(text: str) -> str:
+    s = unicodedata.normalize("NFKC", text or "")
+    for a, b in _REPLACE:
+        if a in s:
+            s = s.replace(a, b)
+    return s
+
+
+def _length(g) -> float:
+    """単位付き寸法をmmに換算する。インチの分数（"1/2 in"・帯分数 "1-1/2 in"）も受け付ける。
+    メートル系の分数（"100/200 mm" のような比）や分母0は寸法とみなさず ValueError"""
+    if g("length_v") is not None:
+        v = float(g("length_v"))
+    else:
+        den = int(g("length_d"))
+        if den == 0 or g("length_u") != "in":
+            raise ValueError("not a length")
+        v = int(g("length_w") or 0) + int(g("length_n")) / den
+    return round(v * _TO_MM[g("length_u")], 6)
+
+
+def extract(text: str) -> Dimensions:
+    """text 中の寸法・公差・はめあい・表面粗さを出現順（重複除去）で返す。"""
+    d = Dimensions()
+    seen: Set[Tuple[str, Any]] = set()
+
+    def add(lst: list, kind: str, v: Any, key: Any = None) -> bool:
+        k = (kind, v if key is None else key)
+        if k in seen:
+            return False
+        seen.add(k)
+        lst.append(v)
+        return True
+
+    for m in _PATTERN.finditer(normalize(text)):
+        kind = m.lastgroup  # 外側のグループが最後に閉じるため種別名になる
+        g = m.group
+        if kind == "tol_pm":
+            add(d.tolerances, "tol", "±" + g("tol_pm_v"))
+        elif kind == "tol_asym":
+            add(d.tolerances, "tol", f"+{g('tol_up')}/-{g('tol_lo')}")
+        elif kind == "rough":
+            add(d.roughness, kind, ("R" + g("rough_k").lower(), float(g("rough_v"))))
+        elif kind == "thread":
+            add(d.threads, kind, f"M{g('thread_d')}" + (f"x{g('thread_p')}" if g("thread_p") else ""))
+        elif kind == "fit_pair":
+            add(d.fits, "fit", f"{g('fit_h')}/{g('fit_s')}")
+        elif kind == "dia":
+            if add(d.diameters, kind, float(g("dia_v"))):
+                d.hole_counts.append(int(g("dia_n") or 1))
+        elif kind == "radius":
+            add(d.radii, kind, float(g("radius_v")))
+        elif kind == "chamfer":
+            add(d.chamfers, kind, float(g("chamfer_v")))
+        elif kind == "pcd":
+            add(d.pcd, kind, float(g("pcd_v")))
+        elif kind == "size":
+            k = _TO_MM.get(g("size_u") or "mm", 1.0)
+            v = [float(v) * k for v in (g("size_a"), g("size_b"), g("size_c")) if v]
+            add(d.sizes, kind, v, tuple(v))
+        elif kind == "length":
+            try:
+                add(d.lengths, kind, _length(g))
+            except ValueError:
+                continue  # 寸法でない分数
+        elif kind == "fit":
+            add(d.fits, kind, g("fit"))
+    return d
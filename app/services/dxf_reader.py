@@ -0,0 +1,268 @@
+"""DXF（ASCII）のストリーミング読み取り
+
+グループコード／値の2行組を先頭から1回だけ読み、図面テキストとして使える値を取り出す。
+ラスタライズやOCRは行わず、ファイル全体もメモリに載せない（保持するのは抽出済みテキストのみ）。
+
+- TEXT / MTEXT（書式コードを除去）/ ATTRIB（表題欄の属性。タグ → 値）
+- DIMENSION（上書き文字列、なければ実測値を φ/R/° 付きで整形）
+- 形状の範囲（ENTITIES の線・円・ポリライン等の座標。文字・寸法・ブロック参照（表題欄の枠）は含めない。
+  ヘッダの $EXTMIN/$EXTMAX は古いまま保存されていることが多いため使わない）
+
+バイナリDXFとDWGは対象外（ValueError）。
+"""
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import timed
+
+# 抽出テキストの上限（文字数）。超えた分は捨てて件数だけ数える
+MAX_TEXT_CHARS = int(os.getenv("CMA_DXF_MAX_TEXT_CHARS", "200000"))
+
+_BINARY_SENTINEL = b"AutoCAD Binary DXF"
+# $INSUNITS → mm 換算（0: 単位なしは mm とみなす）
+_UNIT_MM = {0: 1.0, 1: 25.4, 2: 304.8, 4: 1.0, 5: 10.0, 6: 1000.0, 8: 0.0000254, 9: 0.0254, 13: 0.001, 14: 100.0}
+# $DWGCODEPAGE → Pythonのコーデック（R2007(AC1021)以降は常にUTF-8）
+_CODEPAGES = {"ANSI_932": "cp932", "ANSI_936": "gbk", "ANSI_949": "cp949", "ANSI_950": "cp950", "ANSI_1252": "cp1252"}
+
+_TEXT_TYPES = {b"TEXT", b"MTEXT", b"ATTRIB", b"DIMENSION"}
+# 範囲に含める形状。code 11〜18 も座標として扱うのは _MULTI_POINT_TYPES のみ（ELLIPSE 等の 11/21 は方向ベクトル）
+_GEOMETRY_TYPES = {b"LINE", b"CIRCLE", b"ARC", b"LWPOLYLINE", b"POLYLINE", b"VERTEX", b"SPLINE", b"ELLIPSE",
+                   b"POINT", b"SOLID", b"TRACE", b"3DFACE"}
+_MULTI_POINT_TYPES = {b"LINE", b"SOLID", b"TRACE", b"3DFACE"}
+_X_CODES = {b"10", b"11", b"12", b"13", b"14", b"15", b"16", b"17", b"18"}
+_Y_CODES = {b"20", b"21", b"22", b"23", b"24", b"25", b"26", b"27", b"28"}
+
+_MTEXT_STACK = re.compile(r"\\S([^;]*?)[\^/#]([^;]*);")
+_MTEXT_CODES = re.compile(r"\\[ACFHQTWfhqtwc][^;]*;|\\[LlOoKkNn]|[{}]")
+_UNICODE_ESC = re.compile(r"\\U\+([0-9A-Fa-f]{4})")
+_SPECIAL = (("%%c", "φ"), ("%%C", "φ"), ("%%d", "°"), ("%%D", "°"), ("%%p", "±"), ("%%P", "±"))
+
+
+@dataclass
+class DxfContent:
+    texts: List[str] = field(default_factory=list)         # TEXT/MTEXT/DIMENSION の文字列（出現順）
+    attribs: Dict[str, str] = field(default_factory=dict)  # 表題欄などの属性（タグは大文字）
+    bbox: Optional[Tuple[float, float, float, float]] = None  # (xmin, ymin, xmax, ymax)（mm）
+    units_mm: float = 1.0
+    entities: Counter = field(default_factory=Counter)    # エンティティ種別ごとの件数
+    truncated: int = 0                                     # MAX_TEXT_CHARS を超えて捨てた文字列の数
+
+    def text(self) -> str:
+        """Features 抽出用のテキスト（属性は「タグ: 値」の行として先頭に置く）"""
+        lines = [f"{k}: {v}" for k, v in self.attribs.items()]
+        return "\n".join(lines + self.texts)
+
+    @property
+    def size_mm(self) -> Optional[Tuple[float, float]]:
+        if self.bbox is None:
+            return None
+        x0, y0, x1, y1 = self.bbox
+        return round(x1 - x0, 3), round(y1 - y0, 3)
+
+
+def clean_text(s: str) -> str:
+    """MTEXT の書式コードと %%c 等の特殊文字を取り除いた文字列"""
+    if "\\U+" in s:
+        s = _UNICODE_ESC.sub(lambda m: chr(int(m.group(1), 16)), s)
+    if "%%" in s:
+        for a, b in _SPECIAL:
+            s = s.replace(a, b)
+        s = s.replace("%%u", "").replace("%%o", "").replace("%%U", "").replace("%%O", "")
+    if "\\" in s or "{" in s:
+        s = _MTEXT_STACK.sub(lambda m: f"{m.group(1)}/{m.group(2)}", s)
+        s = s.replace("\\P", "\n").replace("\\~", " ")
+        s = _MTEXT_CODES.sub("", s)
+    return s.strip()
+
+
+def _fmt_dimension(kind: int, value: float) -> str:
+    kind &= 0x0F
+    if kind in (2, 5):  # 角度（実測値はラジアン）
+        return f"{value * 57.29577951308232:.4g}°"
+    v = f"{value:.4f}".rstrip("0").rstrip(".")
+    if kind == 3:
+        return "φ" + v
+    if kind == 4:
+        return "R" + v
+    return v
+
+
+class _Reader:
+    def __init__(self):
+        self.out = DxfContent()
+        self.version = ""
+        self.encoding = "utf-8"
+        self.chars = 0
+        self.seen: set = set()
+
+    def decode(self, raw: bytes) -> str:
+        raw = raw.rstrip(b"\r\n")
+        if self.encoding == "utf-8":
+            try:
+                return raw.decode("utf-8")
+            except UnicodeDecodeError:
+                # ヘッダのないShift_JISのDXF（国内CADの古い出力）
+                return raw.decode("cp932", errors="replace")
+        return raw.decode(self.encoding, errors="replace")
+
+    def add_text(self, s: str) -> None:
+        # 同じ注記・寸法の繰り返しは1回だけ保持する
+        if not s or s in self.seen:
+            return
+        if self.chars + len(s) > MAX_TEXT_CHARS:
+            self.out.truncated += 1
+            return
+        self.chars += len(s)
+        self.seen.add(s)
+        self.out.texts.append(s)
+
+    def header(self, name: str, codes: Dict[bytes, bytes]) -> None:
+        if name == "$INSUNITS":
+            self.out.units_mm = _UNIT_MM.get(int(codes.get(b"70", b"0").strip() or 0), 1.0)
+        elif name == "$ACADVER":
+            self.version = self.decode(codes.get(b"1", b"")).strip()
+        elif name == "$DWGCODEPAGE" and self.version < "AC1021":
+            cp = self.decode(codes.get(b"3", b"")).strip().upper()
+            self.encoding = _CODEPAGES.get(cp, self.encoding)
+
+    def entity(self, etype: bytes, codes: Dict[bytes, List[bytes]]) -> None:
+        if etype == b"TEXT":
+            self.add_text(clean_text(self.decode(codes.get(b"1", [b""])[0])))
+        elif etype == b"MTEXT":
+            # 250文字超の本文は code 3 に分割され、最後の断片が code 1
+            raw = b"".join(v.rstrip(b"\r\n") for v in codes.get(b"3", [])) + codes.get(b"1", [b""])[0].rstrip(b"\r\n")
+            self.add_text(clean_text(self.decode(raw)))
+        elif etype == b"ATTRIB":
+            tag = self.decode(codes.get(b"2", [b""])[0]).strip().upper()
+            value = clean_text(self.decode(codes.get(b"1", [b""])[0]))
+            if tag and value and tag not in self.out.attribs:
+                self.out.attribs[tag] = value
+        elif etype == b"DIMENSION":
+            text = clean_text(self.decode(codes.get(b"1", [b""])[0]))
+            measured = codes.get(b"42")
+            kind = int(codes.get(b"70", [b"0"])[0].strip() or 0)
+            value = _fmt_dimension(kind, float(measured[0])) if measured else ""
+            if not text:
+                text = value
+            elif "<>" in text:
+                # "%%c<>" のように記号が上書き側にあれば実測値は数値だけ差し込む
+                if text.split("<>", 1)[0].endswith(("φ", "R")):
+                    value = value.lstrip("φR")
+                text = text.replace("<>", value)
+            self.add_text(text)
+
+
+@timed("dxf_reader.read")
+def read_dxf(p: Path) -> DxfContent:
+    """ASCII DXF を1回走査して DxfContent を返す。"""
+    r = _Reader()
+    inf = float("inf")
+    xmin = ymin = inf
+    xmax = ymax = -inf
+    with open(p, "rb") as f:
+        if f.read(len(_BINARY_SENTINEL)) == _BINARY_SENTINEL:
+            raise ValueError("binary DXF is not supported")
+        f.seek(0)
+        it = iter(f)
+        section = b""
+        entities = True       # ENTITIES セクション内か（セクション指定のない簡易DXFも対象）
+        etype = b""           # 現在のエンティティ種別（テキスト系のみ値を集める）
+        codes: Dict[bytes, List[bytes]] = {}
+        hname = ""            # 現在のヘッダ変数
+        hcodes: Dict[bytes, bytes] = {}
+        circle = False        # CIRCLE/ARC は中心 ± 半径で範囲を広げる
+        cx = cy = radius = x = 0.0
+        xs, ys = _X_CODES, _Y_CODES
+        first_xs, first_ys = {b"10"}, {b"20"}
+        no_xs: frozenset = frozenset()
+        for code, value in zip(it, it):
+            code = code.strip()
+            if code == b"0":
+                if etype:
+                    r.entity(etype, codes)
+                    etype = b""
+                if circle:
+                    xmin, xmax = min(xmin, cx - radius), max(xmax, cx + radius)
+                    ymin, ymax = min(ymin, cy - radius), max(ymax, cy + radius)
+                    circle = False
+                v = value.strip()
+                if v == b"SECTION":
+                    code, value = next(it, b""), next(it, b"")
+                    section = value.strip() if code.strip() == b"2" else b""
+                    entities = section == b"ENTITIES"
+                    continue
+                if v == b"ENDSEC":
+                    if hname:
+                        r.header(hname, hcodes)
+                        hname = ""
+                    section, entities = b"", False
+                    continue
+                if v == b"EOF":
+                    break
+                if entities:
+                    r.out.entities[v.decode("ascii", "replace")] += 1
+                    if v in _TEXT_TYPES:
+                        etype, codes = v, {}
+                    elif v == b"CIRCLE" or v == b"ARC":
+                        circle, radius = True, 0.0
+                    if v in _MULTI_POINT_TYPES:
+                        xs, ys = _X_CODES, _Y_CODES
+                    elif v in _GEOMETRY_TYPES:
+                        xs, ys = first_xs, first_ys
+                    else:
+                        xs, ys = no_xs, no_xs
+                continue
+            if not entities:
+                if section == b"HEADER":
+                    if code == b"9":
+                        if hname:
+                            r.header(hname, hcodes)
+                        hname, hcodes = value.strip().decode("ascii", "replace"), {}
+                    else:
+                        hcodes[code] = value
+                continue
+            if etype:
+                codes.setdefault(code, []).append(value)
+            if code in xs:
+                x = float(value)
+            elif code in ys:
+                y = float(value)
+                if circle:
+                    cx, cy = x, y
+                else:
+                    if x < xmin:
+                        xmin = x
+                    if x > xmax:
+                        xmax = x
+                    if y < ymin:
+                        ymin = y
+                    if y > ymax:
+                        ymax = y
+            elif circle and code == b"40":
+                radius = float(value)
+        if etype:
+            r.entity(etype, codes)
+        if circle:
+            xmin, xmax = min(xmin, cx - radius), max(xmax, cx + radius)
+            ymin, ymax = min(ymin, cy - radius), max(ymax, cy + radius)
+    if xmin <= xmax and ymin <= ymax:
+        k = r.out.units_mm
+        r.out.bbox = (xmin * k, ymin * k, xmax * k, ymax * k)
+    return r.out
+
+
+@lru_cache(maxsize=8)
+def _read_cached(path: str, mtime_ns: int, size: int) -> DxfContent:
+    return read_dxf(Path(path))
+
+
+def read_dxf_cached(p: Path) -> DxfContent:
+    """同じファイル（パス・更新時刻・サイズが同じ）の再読込を避ける。
+    read_text と build_features がそれぞれ呼んでも走査は1回で済む。"""
+    st = p.stat()
+    return _read_cached(str(p), st.st_mtime_ns, st.st_size)
@@ -0,0 +1,192 @@
+"""装置の加工可能範囲（ワークエンベロープ）による候補の絞り込み
+
+企業DBの envelopes 列（JSON、任意）に装置ごとのストローク・最大旋削径を持たせる。
+
+    {"VMC": {"x": 500, "y": 400, "z": 300}, "NC旋盤": {"dia": 300, "length": 500}}
+
+値は "500x400x300" の文字列でもよい（x, y, z の順、mm）。
+CMA_ENVELOPE_FILTER=true のとき、図面に外形寸法（"100x50x20" の3軸表記）があれば、
+工程が必要とする装置の範囲データがすべて部品より小さい企業をスコア計算の前に除外する。
+範囲データのない装置・企業は除外しない（データ未登録で候補から消えないように）。
+"""
+import bisect
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .metrics import timed
+
+ENABLED = os.getenv("CMA_ENVELOPE_FILTER", "false").lower() in ("1", "true", "yes", "on")
+
+_AXES = ("x", "y", "z", "dia", "length")
+_TRIPLE = re.compile(r"^\s*(\d+(?:\.\d+)?)(?:\s*[x×*]\s*(\d+(?:\.\d+)?))?(?:\s*[x×*]\s*(\d+(?:\.\d+)?))?\s*$")
+
+
+@dataclass(frozen=True)
+class Envelope:
+    """装置1台の加工可能範囲（mm、不明は None）"""
+    x: Optional[float] = None
+    y: Optional[float] = None
+    z: Optional[float] = None
+    dia: Optional[float] = None     # 最大旋削径（旋盤）
+    length: Optional[float] = None  # 最大加工長（旋盤）
+
+    @property
+    def travel(self) -> Tuple[float, ...]:
+        return tuple(sorted((v for v in (self.x, self.y, self.z) if v is not None), reverse=True))
+
+    @property
+    def reach(self) -> float:
+        """この装置に載る部品の最大寸法の上限（索引のキー）"""
+        if self.dia is not None:
+            # 加工長が不明な旋盤は長さ方向を制限しない
+            return float("inf") if self.length is None else max(self.dia, self.length)
+        t = self.travel
+        return t[0] if t else float("inf")
+
+    def holds(self, part: "PartSize") -> bool:
+        if self.dia is not None:
+            cross = part.diameter if part.diameter is not None else (part.dims[1] if len(part.dims) > 1 else None)
+            if cross is not None and cross > self.dia:
+                return False
+            return self.length is None or part.longest <= self.length
+        # 部品は向きを変えて載せられるものとして、大きい順に並べた寸法同士を比べる
+        return all(p <= t for p, t in zip(part.dims, self.travel))
+
+
+@dataclass(frozen=True)
+class PartSize:
+    """図面から分かる部品の外形（mm）。dims は大きい順（2〜3個）"""
+    dims: Tuple[float, ...] = ()
+    diameter: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.dims) or self.diameter is not None
+
+    @property
+    def longest(self) -> float:
+        return self.dims[0] if self.dims else (self.diameter or 0.0)
+
+
+def _envelope(value: Any) -> Envelope:
+    if isinstance(value, str):
+        m = _TRIPLE.match(value)
+        if not m:
+            raise ValueError(f"envelope の形式が不正です: {value!r}")
+        value = dict(zip(("x", "y", "z"), (float(v) for v in m.groups() if v)))
+    elif isinstance(value, (list, tuple)):
+        value = dict(zip(("x", "y", "z"), value))
+    if not isinstance(value, dict):
+        raise ValueError(f"envelope の形式が不正です: {value!r}")
+    unknown = set(value) - set(_AXES)
+    if unknown:
+        raise ValueError(f"envelope の項目が不明です: {sorted(unknown)}")
+    out = {}
+    for k in _AXES:
+        v = value.get(k)
+        if v is None or v == "":
+            continue
+        v = float(v)
+        if v <= 0:
+            raise ValueError(f"envelope の {k} は正の数で指定してください")
+        out[k] = v
+    return Envelope(**out)
+
+
+def parse(raw: Any) -> Dict[str, Envelope]:
+    """envelopes 列（JSON文字列 or dict）→ {装置名: Envelope}。空なら {}。不正な値は ValueError。"""
+    if raw is None or raw == "":
+        return {}
+    data = json.loads(raw) if isinstance(raw, str) else raw
+    if not isinstance(data, dict):
+        raise ValueError("envelopes は {装置名: 範囲} のオブジェクトで指定してください")
+    return {str(name): _envelope(v) for name, v in data.items()}
+
+
+def normalize(raw: Any) -> Optional[str]:
+    """API入力を保存用のJSON文字列に正規化する（空なら None）。"""
+    envs = parse(raw)
+    if not envs:
+        return None
+    return json.dumps({name: {k: v for k, v in e.__dict__.items() if v is not None} for name, e in envs.items()},
+                      ensure_ascii=False)
+
+
+def part_size(features: Any) -> Optional[PartSize]:
+    """Features の明示の外形寸法（"100x50x20" の3軸表記。複数あれば最大のもの）を部品の外形とする。
+    2軸の "420x297" は用紙サイズや板の寸法と区別できず、DXFの形状範囲は図枠を含むため使わない。
+    無効時・分からなければ None。"""
+    if not ENABLED:
+        return None
+    dims = getattr(features, "dims", None)
+    sizes = [s for s in (getattr(dims, "sizes", None) or []) if len(s) == 3]
+    if not sizes:
+        return None
+    best = max(sizes, key=lambda s: max(s))
+    return PartSize(tuple(sorted(best, reverse=True)))
+
+
+def fits(envelopes: Dict[str, Envelope], part: PartSize, machines: Iterable[str]) -> bool:
+    """machines（工程が必要とする装置）のどれかで部品を加工できる見込みがあるか。
+    範囲データのない装置は載るものとみなす。"""
+    return any(m not in envelopes or envelopes[m].holds(part) for m in machines)
+
+
+def _machine_envelopes(c: Any) -> Dict[str, Envelope]:
+    try:
+        return parse(getattr(c, "envelopes", None))
+    except (ValueError, TypeError):
+        # 壊れたデータで候補から外さない
+        return {}
+
+
+class EnvelopeIndex:
+    """装置名ごとに、企業の「載せられる最大寸法」（reach）を昇順に並べた区間索引。
+    部品の最大寸法以上の企業だけを二分探索で取り出し、その中で装置ごとの判定を行う。"""
+
+    def __init__(self, companies: Sequence[Any]):
+        keyed: Dict[str, List[Tuple[float, int, Envelope]]] = {}
+        for c in companies:
+            for machine, e in _machine_envelopes(c).items():
+                keyed.setdefault(machine, []).append((e.reach, c.id, e))
+        self.reach: Dict[str, List[float]] = {}
+        self.entries: Dict[str, List[Tuple[int, Envelope]]] = {}
+        for machine, rows in keyed.items():
+            rows.sort(key=lambda t: t[0])
+            self.reach[machine] = [t[0] for t in rows]
+            self.entries[machine] = [(t[1], t[2]) for t in rows]
+
+    def __len__(self) -> int:
+        return len({cid for rows in self.entries.values() for cid, _ in rows})
+
+    @timed("envelope.excluded")
+    def excluded(self, part: PartSize, machines: Iterable[str]) -> Set[int]:
+        """必要な装置すべてに範囲データがあり、そのどれにも部品が載らない企業ID"""
+        out: Optional[Set[int]] = None
+        for m in set(machines):
+            entries = self.entries.get(m)
+            if not entries:
+                return set()  # 誰もこの装置の範囲データを持たない → 全社がこの装置で候補に残る
+            lo = bisect.bisect_left(self.reach[m], part.longest)
+            holders = {cid for cid, e in entries[lo:] if e.holds(part)}
+            too_small = {cid for cid, _ in entries} - holders
+            out = too_small if out is None else out & too_small
+            if not out:
+                return set()
+        return out or set()
+
+
+def filter_companies(companies: Iterable[Any], part: Optional[PartSize], machines: Iterable[str],
+                     index: Optional[EnvelopeIndex] = None) -> List:
+    """必要な装置のどれかに部品が載る企業（範囲データのない企業を含む）だけを元の順序で返す。"""
+    companies = list(companies)
+    machines = list(dict.fromkeys(machines))
+    if part is None or not part.active or not machines:
+        return companies
+    if index is not None:
+        ids = index.excluded(part, machines)
+        return [c for c in companies if c.id not in ids]
+    return [c for c in companies if fits(_machine_envelopes(c), part, machines)]
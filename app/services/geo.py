@@ -0,0 +1,302 @@
+"""企業所在地のオフライン・ジオコーディングと距離による候補絞り込み
+
+location 文字列（例: "東京都大田区", "川崎市", "Kawasaki", "Ota-ku, Tokyo"）を同梱の
+都道府県・市区の代表座標表で緯度経度に変換し、格子（GRID_DEG 度四方）索引で
+拠点から半径 max_km 以内の企業を求める。座標が分からない企業は距離条件付きの検索では除外する。
+"""
+import math
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# 既定の拠点（距離絞り込みで origin 未指定のとき）
+HUB_LOCATION = os.getenv("CMA_HUB_LOCATION", "大田区")
+GRID_DEG = 0.25  # 約 28km（緯度方向）
+# 距離条件の上限（日本全域を覆う程度）。これより大きい値はこの値に丸める
+MAX_KM = float(os.getenv("CMA_GEO_MAX_KM", "2000"))
+
+LatLon = Tuple[float, float]
+
+# (都道府県, 緯度, 経度, ローマ字) 座標は県庁所在地
+_PREFECTURES: List[Tuple[str, float, float, str]] = [
+    ("北海道", 43.0642, 141.3469, "hokkaido"), ("青森県", 40.8244, 140.7400, "aomori"),
+    ("岩手県", 39.7036, 141.1527, "iwate"), ("宮城県", 38.2688, 140.8721, "miyagi"),
+    ("秋田県", 39.7186, 140.1024, "akita"), ("山形県", 38.2404, 140.3633, "yamagata"),
+    ("福島県", 37.7503, 140.4676, "fukushima"), ("茨城県", 36.3418, 140.4468, "ibaraki"),
+    ("栃木県", 36.5657, 139.8836, "tochigi"), ("群馬県", 36.3911, 139.0608, "gunma"),
+    ("埼玉県", 35.8569, 139.6489, "saitama"), ("千葉県", 35.6051, 140.1233, "chiba"),
+    ("東京都", 35.6895, 139.6917, "tokyo"), ("神奈川県", 35.4478, 139.6425, "kanagawa"),
+    ("新潟県", 37.9026, 139.0232, "niigata"), ("富山県", 36.6953, 137.2113, "toyama"),
+    ("石川県", 36.5947, 136.6256, "ishikawa"), ("福井県", 36.0652, 136.2216, "fukui"),
+    ("山梨県", 35.6642, 138.5684, "yamanashi"), ("長野県", 36.6513, 138.1810, "nagano"),
+    ("岐阜県", 35.3912, 136.7223, "gifu"), ("静岡県", 34.9769, 138.3831, "shizuoka"),
+    ("愛知県", 35.1802, 136.9066, "aichi"), ("三重県", 34.7303, 136.5086, "mie"),
+    ("滋賀県", 35.0045, 135.8686, "shiga"), ("京都府", 35.0214, 135.7556, "kyoto"),
+    ("大阪府", 34.6863, 135.5200, "osaka"), ("兵庫県", 34.6913, 135.1830, "hyogo"),
+    ("奈良県", 34.6851, 135.8329, "nara"), ("和歌山県", 34.2260, 135.1675, "wakayama"),
+    ("鳥取県", 35.5036, 134.2383, "tottori"), ("島根県", 35.4723, 133.0505, "shimane"),
+    ("岡山県", 34.6618, 133.9344, "okayama"), ("広島県", 34.3966, 132.4596, "hiroshima"),
+    ("山口県", 34.1859, 131.4714, "yamaguchi"), ("徳島県", 34.0658, 134.5593, "tokushima"),
+    ("香川県", 34.3401, 134.0434, "kagawa"), ("愛媛県", 33.8417, 132.7657, "ehime"),
+    ("高知県", 33.5597, 133.5311, "kochi"), ("福岡県", 33.6064, 130.4181, "fukuoka"),
+    ("佐賀県", 33.2494, 130.2988, "saga"), ("長崎県", 32.7448, 129.8737, "nagasaki"),
+    ("熊本県", 32.7898, 130.7417, "kumamoto"), ("大分県", 33.2382, 131.6126, "oita"),
+    ("宮崎県", 31.9111, 131.4239, "miyazaki"), ("鹿児島県", 31.5602, 130.5581, "kagoshima"),
+    ("沖縄県", 26.2124, 127.6809, "okinawa"),
+]
+
+# (市区, 都道府県, 緯度, 経度, ローマ字) 座標は市役所・区役所
+_CITIES: List[Tuple[str, str, float, float, str]] = [
+    # 東京23区
+    ("千代田区", "東京都", 35.6940, 139.7536, "chiyoda"), ("中央区", "東京都", 35.6707, 139.7720, "chuo"),
+    ("港区", "東京都", 35.6581, 139.7516, "minato"), ("新宿区", "東京都", 35.6938, 139.7034, "shinjuku"),
+    ("文京区", "東京都", 35.7081, 139.7524, "bunkyo"), ("台東区", "東京都", 35.7126, 139.7800, "taito"),
+    ("墨田区", "東京都", 35.7107, 139.8015, "sumida"), ("江東区", "東京都", 35.6730, 139.8170, "koto"),
+    ("品川区", "東京都", 35.6092, 139.7302, "shinagawa"), ("目黒区", "東京都", 35.6415, 139.6982, "meguro"),
+    ("大田区", "東京都", 35.5613, 139.7160, "ota"), ("世田谷区", "東京都", 35.6464, 139.6533, "setagaya"),
+    ("渋谷区", "東京都", 35.6640, 139.6982, "shibuya"), ("中野区", "東京都", 35.7074, 139.6637, "nakano"),
+    ("杉並区", "東京都", 35.6995, 139.6364, "suginami"), ("豊島区", "東京都", 35.7263, 139.7167, "toshima"),
+    ("北区", "東京都", 35.7528, 139.7336, "kita"), ("荒川区", "東京都", 35.7361, 139.7834, "arakawa"),
+    ("板橋区", "東京都", 35.7512, 139.7093, "itabashi"), ("練馬区", "東京都", 35.7356, 139.6517, "nerima"),
+    ("足立区", "東京都", 35.7750, 139.8044, "adachi"), ("葛飾区", "東京都", 35.7434, 139.8472, "katsushika"),
+    ("江戸川区", "東京都", 35.7068, 139.8683, "edogawa"),
+    # 多摩
+    ("八王子市", "東京都", 35.6664, 139.3160, "hachioji"), ("立川市", "東京都", 35.6940, 139.4077, "tachikawa"),
+    ("町田市", "東京都", 35.5484, 139.4386, "machida"), ("府中市", "東京都", 35.6689, 139.4777, "fuchu"),
+    ("調布市", "東京都", 35.6506, 139.5407, "chofu"), ("三鷹市", "東京都", 35.6836, 139.5596, "mitaka"),
+    ("武蔵野市", "東京都", 35.7178, 139.5660, "musashino"), ("日野市", "東京都", 35.6713, 139.3950, "hino"),
+    ("青梅市", "東京都", 35.7880, 139.2758, "ome"),
+    # 神奈川
+    ("横浜市", "神奈川県", 35.4437, 139.6380, "yokohama"), ("川崎市", "神奈川県", 35.5309, 139.7030, "kawasaki"),
+    ("相模原市", "神奈川県", 35.5714, 139.3733, "sagamihara"), ("横須賀市", "神奈川県", 35.2813, 139.6722, "yokosuka"),
+    ("藤沢市", "神奈川県", 35.3390, 139.4900, "fujisawa"), ("平塚市", "神奈川県", 35.3350, 139.3494, "hiratsuka"),
+    ("厚木市", "神奈川県", 35.4431, 139.3626, "atsugi"), ("大和市", "神奈川県", 35.4874, 139.4580, "yamato"),
+    ("茅ヶ崎市", "神奈川県", 35.3337, 139.4036, "chigasaki"), ("小田原市", "神奈川県", 35.2646, 139.1522, "odawara"),
+    ("海老名市", "神奈川県", 35.4465, 139.3908, "ebina"), ("鎌倉市", "神奈川県", 35.3192, 139.5467, "kamakura"),
+    # 埼玉
+    ("さいたま市", "埼玉県", 35.8617, 139.6455, "saitama"), ("川口市", "埼玉県", 35.8078, 139.7241, "kawaguchi"),
+    ("川越市", "埼玉県", 35.9251, 139.4858, "kawagoe"), ("所沢市", "埼玉県", 35.7994, 139.4687, "tokorozawa"),
+    ("越谷市", "埼玉県", 35.8911, 139.7909, "koshigaya"), ("草加市", "埼玉県", 35.8254, 139.8055, "soka"),
+    ("春日部市", "埼玉県", 35.9754, 139.7524, "kasukabe"), ("上尾市", "埼玉県", 35.9774, 139.5932, "ageo"),
+    ("熊谷市", "埼玉県", 36.1473, 139.3886, "kumagaya"),
+    # 千葉
+    ("千葉市", "千葉県", 35.6074, 140.1065, "chiba"), ("船橋市", "千葉県", 35.6947, 139.9826, "funabashi"),
+    ("市川市", "千葉県", 35.7219, 139.9311, "ichikawa"), ("松戸市", "千葉県", 35.7876, 139.9031, "matsudo"),
+    ("柏市", "千葉県", 35.8676, 139.9758, "kashiwa"), ("市原市", "千葉県", 35.4980, 140.1155, "ichihara"),
+    # 北関東
+    ("宇都宮市", "栃木県", 36.5551, 139.8828, "utsunomiya"), ("前橋市", "群馬県", 36.3895, 139.0634, "maebashi"),
+    ("高崎市", "群馬県", 36.3220, 139.0032, "takasaki"), ("水戸市", "茨城県", 36.3659, 140.4714, "mito"),
+    ("つくば市", "茨城県", 36.0835, 140.0764, "tsukuba"),
+    # 主要都市
+    ("札幌市", "北海道", 43.0621, 141.3544, "sapporo"), ("仙台市", "宮城県", 38.2682, 140.8694, "sendai"),
+    ("新潟市", "新潟県", 37.9161, 139.0364, "niigata"), ("甲府市", "山梨県", 35.6621, 138.5682, "kofu"),
+    ("長野市", "長野県", 36.6485, 138.1948, "nagano"), ("富山市", "富山県", 36.6959, 137.2137, "toyama"),
+    ("金沢市", "石川県", 36.5613, 136.6562, "kanazawa"), ("静岡市", "静岡県", 34.9756, 138.3828, "shizuoka"),
+    ("浜松市", "静岡県", 34.7108, 137.7261, "hamamatsu"), ("名古屋市", "愛知県", 35.1815, 136.9066, "nagoya"),
+    ("豊田市", "愛知県", 35.0826, 137.1560, "toyota"), ("岐阜市", "岐阜県", 35.4233, 136.7607, "gifu"),
+    ("四日市市", "三重県", 34.9650, 136.6245, "yokkaichi"), ("京都市", "京都府", 35.0116, 135.7681, "kyoto"),
+    ("大阪市", "大阪府", 34.6937, 135.5023, "osaka"), ("堺市", "大阪府", 34.5733, 135.4830, "sakai"),
+    ("東大阪市", "大阪府", 34.6794, 135.6008, "higashiosaka"), ("神戸市", "兵庫県", 34.6901, 135.1955, "kobe"),
+    ("姫路市", "兵庫県", 34.8151, 134.6854, "himeji"), ("岡山市", "岡山県", 34.6551, 133.9195, "okayama"),
+    ("広島市", "広島県", 34.3853, 132.4553, "hiroshima"), ("北九州市", "福岡県", 33.8835, 130.8752, "kitakyushu"),
+    ("福岡市", "福岡県", 33.5904, 130.4017, "fukuoka"), ("熊本市", "熊本県", 32.8031, 130.7079, "kumamoto"),
+]
+
+# 地方名 → 都道府県（region 絞り込み用）
+REGIONS: Dict[str, Tuple[str, ...]] = {
+    "北海道": ("北海道",),
+    "東北": ("青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県"),
+    "関東": ("茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県"),
+    "首都圏": ("埼玉県", "千葉県", "東京都", "神奈川県"),
+    "中部": ("新潟県", "富山県", "石川県", "福井県", "山梨県", "長野県", "岐阜県", "静岡県", "愛知県"),
+    "東海": ("岐阜県", "静岡県", "愛知県", "三重県"),
+    "近畿": ("三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県"),
+    "関西": ("滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県"),
+    "中国": ("鳥取県", "島根県", "岡山県", "広島県", "山口県"),
+    "四国": ("徳島県", "香川県", "愛媛県", "高知県"),
+    "九州": ("福岡県", "佐賀県", "長崎県", "熊本県", "大分県", "宮崎県", "鹿児島県", "沖縄県"),
+}
+
+
+def _build() -> Tuple[List[Tuple[str, int, LatLon, str]], Dict[str, Tuple[int, LatLon, str]]]:
+    kanji: List[Tuple[str, int, LatLon, str]] = []   # (表記, 詳細度, 座標, 都道府県)
+    roman: Dict[str, Tuple[int, LatLon, str]] = {}
+    for pref, lat, lon, r in _PREFECTURES:
+        kanji.append((pref, 1, (lat, lon), pref))
+        short = pref[:-1] if pref[-1] in "都府県" else pref
+        if len(short) >= 2:
+            kanji.append((short, 1, (lat, lon), pref))
+        roman[r] = (1, (lat, lon), pref)
+    for name, pref, lat, lon, r in _CITIES:
+        kanji.append((name, 2, (lat, lon), pref))
+        # 「川崎」「横浜」のような市の省略表記（区は「北」等が曖昧なため省略不可）
+        if name.endswith("市") and len(name) >= 3:
+            kanji.append((name[:-1], 2, (lat, lon), pref))
+        # 市区のローマ字は都道府県のローマ字より優先（chiba, saitama 等は市の座標を採る）
+        roman[r] = (2, (lat, lon), pref)
+    return kanji, roman
+
+
+_KANJI, _ROMAN = _build()
+_ROMAN_SUFFIX = re.compile(r"(?:-?(?:ku|shi|city|ward|ken|to|fu|prefecture|pref))$")
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").strip().lower()
+
+
+@lru_cache(maxsize=4096)
+def resolve(location: str) -> Optional[Tuple[LatLon, str]]:
+    """location → ((緯度, 経度), 都道府県)。最も詳細（市区 > 都道府県）かつ長い表記を採用する。"""
+    s = _normalize(location)
+    if not s:
+        return None
+    m = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*", s)
+    if m:
+        return (float(m.group(1)), float(m.group(2))), ""
+    # 他の表記の一部として現れたもの（「東京都」中の「京都」）は除く
+    hits = [(s.find(name), len(name), level, ll, pref) for name, level, ll, pref in _KANJI if name in s]
+    hits = [h for h in hits if not any(o is not h and o[0] <= h[0] and h[0] + h[1] <= o[0] + o[1] and o[1] > h[1] for o in hits)]
+    if hits:
+        _, _, _, ll, pref = max(hits, key=lambda h: (h[2], h[1]))
+        return ll, pref
+    best: Optional[Tuple[int, LatLon, str]] = None
+    for tok in re.split(r"[^a-z]+", s):
+        tok = _ROMAN_SUFFIX.sub("", tok) if tok not in _ROMAN else tok
+        hit = _ROMAN.get(tok)
+        if hit and (best is None or hit[0] > best[0]):
+            best = hit
+    return (best[1], best[2]) if best else None
+
+
+def geocode(location: str) -> Optional[LatLon]:
+    r = resolve(location or "")
+    return r[0] if r else None
+
+
+def prefecture(location: str) -> Optional[str]:
+    r = resolve(location or "")
+    return r[1] if r and r[1] else None
+
+
+def distance_km(a: LatLon, b: LatLon) -> float:
+    """大円距離（haversine）"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(min(1.0, math.sqrt(h)))
+
+
+def origin_of(origin: Optional[str]) -> Optional[LatLon]:
+    """origin（地名 or "緯度,経度"、未指定なら CMA_HUB_LOCATION）の座標"""
+    return geocode(origin or HUB_LOCATION)
+
+
+def region_prefectures(region: str) -> Set[str]:
+    """region（地方名・都道府県名をカンマ区切り）→ 都道府県の集合"""
+    out: Set[str] = set()
+    for part in re.split(r"[,、\s]+", region or ""):
+        if not part:
+            continue
+        if part in REGIONS:
+            out.update(REGIONS[part])
+        else:
+            pref = prefecture(part)
+            if pref:
+                out.add(pref)
+    return out
+
+
+def _coords(c) -> Optional[LatLon]:
+    lat, lon = getattr(c, "lat", None), getattr(c, "lon", None)
+    if lat is not None and lon is not None:
+        return float(lat), float(lon)
+    return geocode(getattr(c, "location", "") or "")
+
+
+class GridIndex:
+    """緯度経度の格子索引。within() は半径内に掛かる格子だけを調べる。"""
+
+    def __init__(self, companies: Sequence, cell: float = GRID_DEG):
+        self.cell = cell
+        self.cells: Dict[Tuple[int, int], List[Tuple[int, LatLon]]] = {}
+        for i, c in enumerate(companies):
+            ll = _coords(c)
+            if ll is not None:
+                self.cells.setdefault(self._key(ll), []).append((i, ll))
+
+    def _key(self, ll: LatLon) -> Tuple[int, int]:
+        return int(math.floor(ll[0] / self.cell)), int(math.floor(ll[1] / self.cell))
+
+    def within(self, origin: LatLon, max_km: float) -> List[int]:
+        """origin から max_km 以内の企業index（入力順）"""
+        max_km = check_max_km(max_km)
+        dlat = max_km / 111.0
+        dlon = max_km / (111.0 * max(0.01, math.cos(math.radians(origin[0]))))
+        r0, c0 = self._key((origin[0] - dlat, origin[1] - dlon))
+        r1, c1 = self._key((origin[0] + dlat, origin[1] + dlon))
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self.cells):
+            # 範囲が索引の格子数より広ければ、空の格子を数え上げずに全格子を調べる
+            buckets = [v for (r, c), v in self.cells.items() if r0 <= r <= r1 and c0 <= c <= c1]
+        else:
+            buckets = [self.cells.get((r, c), ()) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+        out = [i for b in buckets for i, ll in b if distance_km(origin, ll) <= max_km]
+        out.sort()
+        return out
+
+
+def check_max_km(value) -> float:
+    """距離条件を検査する。数値でない・有限でない・0以下なら ValueError、MAX_KM 超は MAX_KM に丸める。"""
+    if isinstance(value, bool):
+        raise ValueError("max_km は正の数で指定してください")
+    try:
+        km = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"max_km が数値ではありません: {value!r}") from None
+    if not math.isfinite(km) or km <= 0:
+        raise ValueError("max_km は正の数で指定してください")
+    return min(km, MAX_KM)
+
+
+def filter_companies(companies: Sequence, max_km: Optional[float] = None, origin: Optional[str] = None,
+                     region: Optional[str] = None, index: Optional[GridIndex] = None) -> List:
+    """距離（拠点から max_km 以内）・地域（region の都道府県）で企業を絞り込む。条件なしならそのまま返す。"""
+    out = list(companies)
+    if max_km is not None:
+        ll = origin_of(origin)
+        if ll is None:
+            raise ValueError(f"origin の位置が分かりません: {origin}")
+        idx = index if index is not None else GridIndex(out)
+        out = [out[i] for i in idx.within(ll, check_max_km(max_km))]
+    if region:
+        prefs = region_prefectures(region)
+        if not prefs:
+            raise ValueError(f"region が分かりません: {region}")
+        out = [c for c in out if prefecture(getattr(c, "location", "") or "") in prefs]
+    return out
+
+
+def geocode_rows(rows: Iterable[Tuple[int, str]]) -> List[Tuple[Optional[float], Optional[float], int]]:
+    """[(id, location)] → UPDATE 用の [(lat, lon, id)]（分からない所在地は None）"""
+    out = []
+    for cid, loc in rows:
+        ll = geocode(loc or "")
+        out.append((ll[0] if ll else None, ll[1] if ll else None, cid))
+    return out
+
+
+@dataclass(frozen=True)
+class LocationFilter:
+    """マッチング前の候補絞り込み条件（スコア行列キャッシュのキーにもなる）"""
+    max_km: Optional[float] = None
+    origin: Optional[str] = None   # 地名 or "緯度,経度"（未指定は CMA_HUB_LOCATION）
+    region: Optional[str] = None   # 地方名・都道府県名（カンマ区切り）
+
+    @property
+    def active(self) -> bool:
+        return self.max_km is not None or bool(self.region)
+
+    def apply(self, companies: Sequence, index: Optional[GridIndex] = None) -> List:
+        return filter_companies(companies, self.max_km, self.origin, self.region, index)
@@ -0,0 +1,11 @@
+"""ファイル内容のハッシュ（バッチの重複検出・サムネイルの保存先に使う）"""
+import hashlib
+from pathlib import Path
+
+
+def file_sha256(p: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
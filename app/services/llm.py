@@ -1,10 +1,25 @@
+import asyncio
+import copy
+import hashlib
 import json
 import os
-from typing import Optional, Dict, Any
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Iterator
+from . import metrics
+from .metrics import timed
 
 _client = None
 _provider = None  # "azure" or "openai"
 _model = None     # OpenAI: model name, Azure: deployment name
+_client_kwargs: Dict[str, Any] = {}
+# 非同期クライアント/同時実行数の上限はイベントループごとに保持
+_aclients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_asems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
 
 # Tunables (env overridable)
 DEFAULT_MAX_TOKENS = int(os.getenv("CMA_LLM_MAX_TOKENS", "1024"))
@@ -12,6 +27,267 @@ DEFAULT_TEMPERATURE = float(os.getenv("CMA_LLM_TEMPERATURE", "0.2"))
 DEFAULT_JSON_ENFORCE = os.getenv("CMA_LLM_JSON_ENFORCE", "true").lower() in ("1", "true", "yes", "on")
 DEFAULT_REASONING_EFFORT = os.getenv("CMA_LLM_REASONING_EFFORT", "medium")  # low|medium|high
 DEFAULT_TIMEOUT = float(os.getenv("CMA_LLM_TIMEOUT_SEC", "30"))
+CACHE_SIZE = int(os.getenv("CMA_LLM_CACHE_SIZE", "0"))  # 同一プロンプトの結果のキャッシュ件数（既定は無効）
+CONCURRENCY = int(os.getenv("CMA_LLM_CONCURRENCY", "8"))  # 非同期呼び出しの同時実行数
+# レイテンシ上限: リクエスト全体の予算、予算残がこれ未満なら呼び出さない
+REQUEST_BUDGET_SEC = float(os.getenv("CMA_REQUEST_BUDGET_SEC", "40"))
+MIN_CALL_SEC = float(os.getenv("CMA_LLM_MIN_CALL_SEC", "1.0"))
+# サーキットブレーカ: 連続N回の失敗/低速応答で一定時間LLMを使わない
+BREAKER_FAILURES = int(os.getenv("CMA_LLM_BREAKER_FAILURES", "3"))
+BREAKER_SLOW_SEC = float(os.getenv("CMA_LLM_BREAKER_SLOW_SEC", "15"))
+BREAKER_COOLDOWN_SEC = float(os.getenv("CMA_LLM_BREAKER_COOLDOWN_SEC", "60"))
+
+metrics.describe("cma_llm_call_seconds", "histogram", "Wall time of logical LLM calls by call site")
+metrics.describe("cma_llm_calls_total", "counter", "Logical LLM calls by call site, path and outcome")
+metrics.describe("cma_llm_attempts_total", "counter", "Network requests issued to the LLM provider")
+metrics.describe("cma_llm_tokens_total", "counter", "Tokens reported in response usage")
+metrics.describe("cma_llm_cache_hits_total", "counter", "chat_json results served from the in-process cache")
+metrics.describe("cma_llm_skipped_total", "counter", "LLM calls skipped in favour of rule-based paths, by reason")
+metrics.describe("cma_llm_breaker_open", "gauge", "1 while the LLM circuit breaker is open")
+
+# 呼び出し元（diagram/breakdown/matching など）ごとの集計
+_stats_lock = threading.Lock()
+_site_stats: Dict[str, Dict[str, Any]] = {}
+_recent: "deque[Dict[str, Any]]" = deque(maxlen=200)
+_cache: "OrderedDict[str, Any]" = OrderedDict()
+
+
+class _Call:
+    """1回の論理呼び出し（リトライ/フォールバックを含む）の記録"""
+
+    def __init__(self, site: Optional[str]):
+        self.site = site or "other"
+        self.t0 = time.perf_counter()
+        self.attempts = 0
+        self.path: List[str] = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit = False
+        self.error: Optional[str] = None
+        self.clamped = False  # 直近の試行のタイムアウトをリクエスト期限に合わせて短縮したか
+
+    def attempt(self, kind: str) -> None:
+        self.attempts += 1
+        self.path.append(kind)
+
+    def add_usage(self, resp: Any) -> None:
+        usage = getattr(resp, "usage", None)
+        if usage is None:
+            return
+        # chat.completions: prompt/completion_tokens, responses: input/output_tokens
+        self.prompt_tokens += int(getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None) or 0)
+        self.completion_tokens += int(getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None) or 0)
+
+    def finish(self, ok: bool) -> None:
+        dt = time.perf_counter() - self.t0
+        path = ">".join(self.path) or ("cache" if self.cache_hit else "none")
+        outcome = "ok" if ok else "error"
+        rec = {
+            "ts": time.time(), "site": self.site, "seconds": round(dt, 4), "attempts": self.attempts, "path": path,
+            "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+            "cache_hit": self.cache_hit, "ok": ok, "error": self.error,
+        }
+        with _stats_lock:
+            st = _site_stats.setdefault(self.site, {
+                "calls": 0, "errors": 0, "attempts": 0, "cache_hits": 0, "fallbacks": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "total_sec": 0.0, "max_sec": 0.0, "paths": {},
+            })
+            st["calls"] += 1
+            st["errors"] += 0 if ok else 1
+            st["attempts"] += self.attempts
+            st["cache_hits"] += 1 if self.cache_hit else 0
+            st["fallbacks"] += 1 if len(self.path) > 1 else 0
+            st["prompt_tokens"] += self.prompt_tokens
+            st["completion_tokens"] += self.completion_tokens
+            st["total_sec"] += dt
+            st["max_sec"] = max(st["max_sec"], dt)
+            st["paths"][path] = st["paths"].get(path, 0) + 1
+            _recent.append(rec)
+        metrics.observe("cma_llm_call_seconds", dt, site=self.site)
+        metrics.inc("cma_llm_calls_total", site=self.site, path=path, outcome=outcome)
+        if self.attempts:
+            metrics.inc("cma_llm_attempts_total", self.attempts, site=self.site)
+        if self.prompt_tokens:
+            metrics.inc("cma_llm_tokens_total", self.prompt_tokens, site=self.site, kind="prompt")
+        if self.completion_tokens:
+            metrics.inc("cma_llm_tokens_total", self.completion_tokens, site=self.site, kind="completion")
+        if self.cache_hit:
+            metrics.inc("cma_llm_cache_hits_total", site=self.site)
+
+
+def telemetry() -> Dict[str, Any]:
+    """呼び出し元ごとの集計と直近の呼び出し履歴"""
+    with _stats_lock:
+        sites = {}
+        for site, st in _site_stats.items():
+            d = dict(st, paths=dict(st["paths"]))
+            d["avg_sec"] = round(st["total_sec"] / st["calls"], 4) if st["calls"] else 0.0
+            d["total_sec"] = round(st["total_sec"], 4)
+            d["max_sec"] = round(st["max_sec"], 4)
+            sites[site] = d
+        recent = list(_recent)
+    return {"provider": _provider, "model": _model, "cache_size": CACHE_SIZE, "cache_entries": len(_cache),
+            "breaker": _breaker.state(), "sites": sites, "recent": recent[::-1]}
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class CallSkipped(RuntimeError):
+    """chat/achat を受け付けなかった（ルールのみモード・期限切れ・ブレーカ開放）"""
+
+
+# リクエスト単位の期限（time.monotonic 基準）とルールのみモード
+_deadline: ContextVar[Optional[float]] = ContextVar("cma_llm_deadline", default=None)
+_rules_only: ContextVar[bool] = ContextVar("cma_llm_rules_only", default=False)
+
+
+@contextmanager
+def deadline(seconds: Optional[float] = None) -> Iterator[None]:
+    """この区間内のLLM呼び出しを seconds 秒以内に収める（入れ子では短い方を採用）。"""
+    seconds = REQUEST_BUDGET_SEC if seconds is None else seconds
+    cur = _deadline.get()
+    new = time.monotonic() + seconds
+    token = _deadline.set(new if cur is None else min(cur, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def rules_only(on: bool = True) -> Iterator[None]:
+    """この区間ではLLMを呼ばずルールベースの経路のみを使う（fast モード）。"""
+    token = _rules_only.set(bool(on) or _rules_only.get())
+    try:
+        yield
+    finally:
+        _rules_only.reset(token)
+
+
+def remaining() -> Optional[float]:
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+def is_rules_only() -> bool:
+    return _rules_only.get()
+
+
+class _Breaker:
+    """closed → (連続失敗) → open → (cooldown経過) → half-open(試行1件) → closed/open"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+
+    def _open_now(self) -> bool:
+        return self.opened_at is not None and (
+            time.monotonic() - self.opened_at < BREAKER_COOLDOWN_SEC or self.trial)
+
+    def would_allow(self) -> bool:
+        """allow() が通すかどうか（試行枠は消費しない）"""
+        with self.lock:
+            return not self._open_now()
+
+    def allow(self) -> bool:
+        """呼び出しを通すか。half-open では1件だけ通し、record() まで他を止める"""
+        with self.lock:
+            if self._open_now():
+                return False
+            if self.opened_at is not None:
+                self.trial = True  # half-open: 1件だけ通す
+            return True
+
+    def release(self) -> None:
+        """結果を記録せずに試行枠だけ返す（期限切れなどプロバイダの状態を判定できない呼び出し）"""
+        with self.lock:
+            self.trial = False
+
+    def record(self, ok: bool, seconds: float) -> None:
+        failed = (not ok) or (BREAKER_SLOW_SEC > 0 and seconds >= BREAKER_SLOW_SEC)
+        with self.lock:
+            self.trial = False
+            if not failed:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.opened_at is not None or self.failures >= BREAKER_FAILURES:
+                    self.opened_at = time.monotonic()
+            is_open = self.opened_at is not None
+        metrics.set_gauge("cma_llm_breaker_open", 1 if is_open else 0)
+
+    def state(self) -> Dict[str, Any]:
+        with self.lock:
+            if self.opened_at is None:
+                return {"state": "closed", "failures": self.failures}
+            left = BREAKER_COOLDOWN_SEC - (time.monotonic() - self.opened_at)
+            return {"state": "open" if left > 0 else "half-open", "failures": self.failures, "retry_in_sec": round(max(0.0, left), 1)}
+
+
+_breaker = _Breaker()
+
+
+def _skip_reason(admit: bool = False) -> Optional[str]:
+    """呼び出さない理由。admit=True のときだけブレーカの試行枠を消費する（実際に呼び出す直前のみ）"""
+    if _rules_only.get():
+        return "rules_only"
+    left = remaining()
+    if left is not None and left < MIN_CALL_SEC:
+        return "deadline"
+    if not (_breaker.allow() if admit else _breaker.would_allow()):
+        return "breaker"
+    return None
+
+
+def _admit(call: "_Call") -> Optional[str]:
+    """実際に呼び出す直前の受け付け（ブレーカの試行枠を消費）。受け付けない場合は理由を返す"""
+    reason = _skip_reason(admit=True)
+    if reason:
+        metrics.inc("cma_llm_skipped_total", site=call.site, reason=reason)
+    return reason
+
+
+def should_call(site: Optional[str] = None) -> bool:
+    """LLMを呼ぶべきか（未設定・fastモード・期限切れ・ブレーカ開放時は False）。
+    判定のみでブレーカの状態は変えない（呼び出しの受け付けは chat_json/achat_json 側で1回だけ行う）。"""
+    if not is_configured():
+        return False
+    reason = _skip_reason()
+    if reason:
+        metrics.inc("cma_llm_skipped_total", site=site or "other", reason=reason)
+        return False
+    return True
+
+
+def _cache_key(system: str, user: str, **params) -> str:
+    if CACHE_SIZE <= 0:
+        return ""
+    raw = json.dumps([_model, system, user, params], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> Any:
+    if not key:
+        return None
+    with _stats_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return copy.deepcopy(_cache[key])
+    return None
+
+
+def _cache_put(key: str, value: Any) -> None:
+    if CACHE_SIZE <= 0:
+        return
+    with _stats_lock:
+        _cache[key] = copy.deepcopy(value)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
 
 
 def _ensure_client():
@@ -19,7 +295,7 @@ def _ensure_client():
     Azure環境変数: AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_DEPLOYMENT
     OpenAI環境変数: OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
     """
-    global _client, _provider, _model
+    global _client, _provider, _model, _client_kwargs
     if _client is not None:
         return _client
 
@@ -31,7 +307,9 @@ def _ensure_client():
     if az_api_key and az_endpoint:
         try:
             from openai import AzureOpenAI
-            _client = AzureOpenAI(azure_endpoint=az_endpoint, api_key=az_api_key, api_version=az_api_version)
+            kwargs = dict(azure_endpoint=az_endpoint, api_key=az_api_key, api_version=az_api_version)
+            _client = AzureOpenAI(**kwargs)
+            _client_kwargs = kwargs
             _provider = "azure"
             _model = az_deployment  # Azureはdeployment名をmodelに指定
             return _client
@@ -45,7 +323,9 @@ def _ensure_client():
     if api_key:
         try:
             from openai import OpenAI
-            _client = OpenAI(api_key=api_key, base_url=base_url) if base_url else OpenAI(api_key=api_key)
+            kwargs = dict(api_key=api_key, base_url=base_url) if base_url else dict(api_key=api_key)
+            _client = OpenAI(**kwargs)
+            _client_kwargs = kwargs
             _provider = "openai"
             return _client
         except Exception:
@@ -53,56 +333,99 @@ def _ensure_client():
     return None
 
 
-def is_configured() -> bool:
-    return _ensure_client() is not None
+def _ensure_async_client():
+    """同じ設定の AsyncOpenAI / AsyncAzureOpenAI を返す（接続プールがループに紐づくためイベントループごとに生成）。"""
+    if _ensure_client() is None:
+        return None
+    loop = asyncio.get_running_loop()
+    with _stats_lock:
+        client = _aclients.get(loop)
+    if client is None:
+        try:
+            if _provider == "azure":
+                from openai import AsyncAzureOpenAI
+                client = AsyncAzureOpenAI(**_client_kwargs)
+            else:
+                from openai import AsyncOpenAI
+                client = AsyncOpenAI(**_client_kwargs)
+        except Exception:
+            return None
+        with _stats_lock:
+            _aclients[loop] = client
+    return client
 
 
-def chat(system: str, user: str, json_mode: bool = False, temperature: Optional[float] = None, max_tokens: Optional[int] = None, timeout: Optional[float] = None, reasoning_effort: Optional[str] = None) -> str:
-    client = _ensure_client()
-    if not client:
-        raise RuntimeError("LLM client not configured")
-    # Defaults
-    if temperature is None:
-        temperature = DEFAULT_TEMPERATURE
-    if max_tokens is None:
-        max_tokens = DEFAULT_MAX_TOKENS
-    if timeout is None:
-        timeout = DEFAULT_TIMEOUT
-    if reasoning_effort is None:
-        reasoning_effort = DEFAULT_REASONING_EFFORT
-    # Azure o1系はresponses APIを利用
-    if _provider == "azure" and _model and str(_model).lower().startswith("o1"):
-        # responses APIはinput文字列を受け付ける
-        params: Dict[str, Any] = {
-            "model": _model,
-            "input": f"System: {system}\nUser: {user}",
-            "max_output_tokens": max_tokens,
-        }
-        if json_mode and DEFAULT_JSON_ENFORCE:
-            params["response_format"] = {"type": "json_object"}
-        if reasoning_effort:
-            params["reasoning"] = {"effort": reasoning_effort}
+async def aclose_client() -> None:
+    """実行中のイベントループ用の非同期クライアントを閉じる（ループを終了する前に呼ぶ）。"""
+    with _stats_lock:
+        client = _aclients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
         try:
-            # timeout はwith_optionsで付与
-            resp = client.with_options(timeout=timeout).responses.create(**params)
-            # openai v1にはoutput_textのショートカットがある
-            text = getattr(resp, "output_text", None)
-            if text:
-                return text
-            # フォールバック: 最初のテキストを拾う
-            out = getattr(resp, "output", None)
-            if out and isinstance(out, list) and out:
-                content = getattr(out[0], "content", None)
-                if content and isinstance(content, list) and content:
-                    txt = getattr(content[0], "text", None)
-                    if txt and getattr(txt, "value", None):
-                        return txt.value
-            return ""
+            await client.close()
         except Exception:
-            # 失敗時は従来のchat APIで試行（多くは失敗するが保険）
             pass
 
-    # 通常のchat.completions API
+
+def is_configured() -> bool:
+    return _ensure_client() is not None
+
+
+def _defaults(temperature: Optional[float], max_tokens: Optional[int], timeout: Optional[float], reasoning_effort: Optional[str]):
+    return (
+        DEFAULT_TEMPERATURE if temperature is None else temperature,
+        DEFAULT_MAX_TOKENS if max_tokens is None else max_tokens,
+        DEFAULT_TIMEOUT if timeout is None else timeout,
+        DEFAULT_REASONING_EFFORT if reasoning_effort is None else reasoning_effort,
+    )
+
+
+def _clamp_timeout(timeout: float, call: _Call) -> float:
+    """リクエスト期限に合わせてタイムアウトを短縮（残りが MIN_CALL_SEC 未満なら DeadlineExceeded）"""
+    left = remaining()
+    call.clamped = left is not None and left < timeout
+    if left is None:
+        return timeout
+    if left < MIN_CALL_SEC:
+        raise DeadlineExceeded(f"request budget exhausted ({left:.1f}s left)")
+    return min(timeout, left)
+
+
+def _use_responses_api() -> bool:
+    # Azure o1系はresponses APIを利用
+    return _provider == "azure" and bool(_model) and str(_model).lower().startswith("o1")
+
+
+def _responses_params(system: str, user: str, json_mode: bool, max_tokens: int, reasoning_effort: Optional[str]) -> Dict[str, Any]:
+    # responses APIはinput文字列を受け付ける
+    params: Dict[str, Any] = {
+        "model": _model,
+        "input": f"System: {system}\nUser: {user}",
+        "max_output_tokens": max_tokens,
+    }
+    if json_mode and DEFAULT_JSON_ENFORCE:
+        params["response_format"] = {"type": "json_object"}
+    if reasoning_effort:
+        params["reasoning"] = {"effort": reasoning_effort}
+    return params
+
+
+def _responses_text(resp: Any) -> str:
+    # openai v1にはoutput_textのショートカットがある
+    text = getattr(resp, "output_text", None)
+    if text:
+        return text
+    # フォールバック: 最初のテキストを拾う
+    out = getattr(resp, "output", None)
+    if out and isinstance(out, list) and out:
+        content = getattr(out[0], "content", None)
+        if content and isinstance(content, list) and content:
+            txt = getattr(content[0], "text", None)
+            if txt and getattr(txt, "value", None):
+                return txt.value
+    return ""
+
+
+def _chat_params(system: str, user: str, json_mode: bool, temperature: float, max_tokens: int) -> Dict[str, Any]:
     params: Dict[str, Any] = {
         "model": _model,
         "messages": [
@@ -115,21 +438,224 @@ def chat(system: str, user: str, json_mode: bool = False, temperature: Optional[
     if json_mode and DEFAULT_JSON_ENFORCE:
         params["response_format"] = {"type": "json_object"}
     params["max_tokens"] = max_tokens
-    resp = client.with_options(timeout=timeout).chat.completions.create(**params)
-    return resp.choices[0].message.content or ""
+    return params
+
+
+def chat(system: str, user: str, json_mode: bool = False, temperature: Optional[float] = None, max_tokens: Optional[int] = None, timeout: Optional[float] = None, reasoning_effort: Optional[str] = None, site: Optional[str] = None) -> str:
+    call = _Call(site)
+    reason = _admit(call)
+    if reason:
+        raise CallSkipped(reason)
+    try:
+        text = _chat(system, user, json_mode, temperature, max_tokens, timeout, reasoning_effort, call)
+    except Exception as e:
+        call.error = f"{type(e).__name__}: {e}"
+        call.finish(False)
+        _settle(call, _failure(e, call))
+        raise
+    call.finish(True)
+    _settle(call, None)
+    return text
 
 
-def chat_json(system: str, user: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None, timeout: Optional[float] = None, reasoning_effort: Optional[str] = None) -> Optional[dict]:
+async def achat(system: str, user: str, json_mode: bool = False, temperature: Optional[float] = None, max_tokens: Optional[int] = None, timeout: Optional[float] = None, reasoning_effort: Optional[str] = None, site: Optional[str] = None) -> str:
+    """chat の非同期版（集計・ブレーカ・期限は同期版と共通）"""
+    call = _Call(site)
     try:
-        text = chat(system, user, json_mode=True, temperature=temperature, max_tokens=max_tokens, timeout=timeout, reasoning_effort=reasoning_effort)
-        return json.loads(text)
-    except Exception:
+        async with _concurrency():
+            # 受け付けは同時実行枠を得てから行う（待っている間に期限切れ・ブレーカ開放になりうる）
+            reason = _admit(call)
+            if reason:
+                raise CallSkipped(reason)
+            text = await _achat(system, user, json_mode, temperature, max_tokens, timeout, reasoning_effort, call)
+    except CallSkipped:
+        raise
+    except Exception as e:
+        call.error = f"{type(e).__name__}: {e}"
+        call.finish(False)
+        _settle(call, _failure(e, call))
+        raise
+    call.finish(True)
+    _settle(call, None)
+    return text
+
+
+@timed("llm.chat")
+def _chat(system: str, user: str, json_mode: bool, temperature: Optional[float], max_tokens: Optional[int], timeout: Optional[float], reasoning_effort: Optional[str], _call: _Call) -> str:
+    client = _ensure_client()
+    if not client:
+        raise RuntimeError("LLM client not configured")
+    temperature, max_tokens, timeout, reasoning_effort = _defaults(temperature, max_tokens, timeout, reasoning_effort)
+    if _use_responses_api():
+        params = _responses_params(system, user, json_mode, max_tokens, reasoning_effort)
+        t = _clamp_timeout(timeout, _call)
         try:
-            text = chat(system, user, json_mode=False, temperature=temperature, max_tokens=max_tokens, timeout=timeout, reasoning_effort=reasoning_effort)
-            start = text.find("{")
-            end = text.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                return json.loads(text[start : end + 1])
+            _call.attempt("responses:json" if json_mode else "responses")
+            resp = client.with_options(timeout=t).responses.create(**params)
+            _call.add_usage(resp)
+            return _responses_text(resp)
         except Exception:
-            return None
+            # 失敗時は従来のchat APIで試行（多くは失敗するが保険）
+            pass
+
+    # 通常のchat.completions API
+    params = _chat_params(system, user, json_mode, temperature, max_tokens)
+    t = _clamp_timeout(timeout, _call)
+    _call.attempt("chat:json" if json_mode else "chat")
+    resp = client.with_options(timeout=t).chat.completions.create(**params)
+    _call.add_usage(resp)
+    return resp.choices[0].message.content or ""
+
+
+async def _achat(system: str, user: str, json_mode: bool, temperature: Optional[float], max_tokens: Optional[int], timeout: Optional[float], reasoning_effort: Optional[str], _call: _Call) -> str:
+    with metrics.span("llm.chat"):
+        client = _ensure_async_client()
+        if not client:
+            raise RuntimeError("LLM client not configured")
+        temperature, max_tokens, timeout, reasoning_effort = _defaults(temperature, max_tokens, timeout, reasoning_effort)
+        if _use_responses_api():
+            params = _responses_params(system, user, json_mode, max_tokens, reasoning_effort)
+            t = _clamp_timeout(timeout, _call)
+            try:
+                _call.attempt("responses:json" if json_mode else "responses")
+                resp = await client.with_options(timeout=t).responses.create(**params)
+                _call.add_usage(resp)
+                return _responses_text(resp)
+            except Exception:
+                pass
+
+        params = _chat_params(system, user, json_mode, temperature, max_tokens)
+        t = _clamp_timeout(timeout, _call)
+        _call.attempt("chat:json" if json_mode else "chat")
+        resp = await client.with_options(timeout=t).chat.completions.create(**params)
+        _call.add_usage(resp)
+        return resp.choices[0].message.content or ""
+
+
+def _extract_json(text: str) -> Optional[dict]:
+    """通常モードの応答本文から {...} を抜き出して解析する。"""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        return json.loads(text[start : end + 1])
     return None
+
+
+def _json_cached(call: _Call, key: str) -> Any:
+    """キャッシュ済みの結果（なければ None）"""
+    cached = _cache_get(key)
+    if cached is not None:
+        call.cache_hit = True
+        call.finish(True)
+    return cached
+
+
+def _failure(e: Exception, call: _Call) -> str:
+    """失敗の分類: "budget"（リクエスト期限切れ・期限で短縮したタイムアウト）/ "provider"（タイムアウト・接続断等）/
+    "response"（応答内容の不備）"""
+    if isinstance(e, DeadlineExceeded) or (call.clamped and _is_timeout(e)):
+        return "budget"
+    return "provider" if _is_transient(e) else "response"
+
+
+def _settle(call: _Call, failure: Optional[str]) -> None:
+    # 期限切れはプロバイダの障害ではないのでブレーカに数えず、half-open の試行枠だけ返す
+    if failure == "budget":
+        _breaker.release()
+    else:
+        _breaker.record(failure != "provider", time.perf_counter() - call.t0)
+
+
+def _can_retry_text(failure: Optional[str]) -> bool:
+    # タイムアウト/接続断/期限切れの後は再要求しない（遅延が倍になるだけのため）
+    left = remaining()
+    return failure == "response" and (left is None or left >= MIN_CALL_SEC)
+
+
+def _json_finish(call: _Call, key: str, result: Any, failure: Optional[str]) -> Any:
+    if result is not None:
+        _cache_put(key, result)
+    call.finish(result is not None)
+    # 応答内容の不備（JSON解析失敗等）はプロバイダ障害として数えない
+    _settle(call, None if result is not None else failure)
+    return result
+
+
+def chat_json(system: str, user: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None, timeout: Optional[float] = None, reasoning_effort: Optional[str] = None, site: Optional[str] = None) -> Optional[dict]:
+    call = _Call(site)
+    key = _cache_key(system, user, temperature=temperature, max_tokens=max_tokens, reasoning_effort=reasoning_effort)
+    cached = _json_cached(call, key)
+    if cached is not None or _admit(call):
+        return cached
+    result = None
+    failure: Optional[str] = None
+    try:
+        text = _chat(system, user, True, temperature, max_tokens, timeout, reasoning_effort, call)
+        result = json.loads(text)
+    except Exception as e:
+        call.error = f"{type(e).__name__}: {e}"
+        failure = _failure(e, call)
+        if _can_retry_text(failure):
+            try:
+                # JSONモード失敗時は通常モードで再要求し、本文から {...} を抜き出す
+                text = _chat(system, user, False, temperature, max_tokens, timeout, reasoning_effort, call)
+                result = _extract_json(text)
+                if result is not None:
+                    call.error = None
+            except Exception as e2:
+                call.error = f"{type(e2).__name__}: {e2}"
+                failure = _failure(e2, call)
+    return _json_finish(call, key, result, failure)
+
+
+async def achat_json(system: str, user: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None, timeout: Optional[float] = None, reasoning_effort: Optional[str] = None, site: Optional[str] = None) -> Optional[dict]:
+    """chat_json の非同期版（キャッシュ・集計・ブレーカは同期版と共通）"""
+    call = _Call(site)
+    key = _cache_key(system, user, temperature=temperature, max_tokens=max_tokens, reasoning_effort=reasoning_effort)
+    cached = _json_cached(call, key)
+    if cached is not None:
+        return cached
+    result = None
+    failure: Optional[str] = None
+    try:
+        async with _concurrency():
+            # 受け付けは同時実行枠を得てから行う（まとめて投入された呼び出しが、枠待ちの間に
+            # 期限切れ・ブレーカ開放になっても呼び出さないように）
+            if _admit(call):
+                return None
+            text = await _achat(system, user, True, temperature, max_tokens, timeout, reasoning_effort, call)
+        result = json.loads(text)
+    except Exception as e:
+        call.error = f"{type(e).__name__}: {e}"
+        failure = _failure(e, call)
+        if _can_retry_text(failure):
+            try:
+                async with _concurrency():
+                    text = await _achat(system, user, False, temperature, max_tokens, timeout, reasoning_effort, call)
+                result = _extract_json(text)
+                if result is not None:
+                    call.error = None
+            except Exception as e2:
+                call.error = f"{type(e2).__name__}: {e2}"
+                failure = _failure(e2, call)
+    return _json_finish(call, key, result, failure)
+
+
+def _concurrency() -> asyncio.Semaphore:
+    """イベントループごとの同時呼び出し数の上限（CMA_LLM_CONCURRENCY）"""
+    loop = asyncio.get_running_loop()
+    with _stats_lock:
+        sem = _asems.get(loop)
+        if sem is None:
+            sem = _asems[loop] = asyncio.Semaphore(max(1, CONCURRENCY))
+    return sem
+
+
+def _is_timeout(e: Exception) -> bool:
+    return isinstance(e, TimeoutError) or type(e).__name__ == "APITimeoutError"
+
+
+def _is_transient(e: Exception) -> bool:
+    return isinstance(e, (DeadlineExceeded, TimeoutError, ConnectionError)) or type(e).__name__ in (
+        "APITimeoutError", "APIConnectionError", "InternalServerError", "RateLimitError",
+    )
@@ -0,0 +1,205 @@
+"""プロセス内の軽量メトリクス（カウンタ/ヒストグラム）と区間計測(span)
+
+- span("name") / @timed("name") で処理時間を cma_span_seconds{span="name"} に集計
+- render_prometheus() で Prometheus テキスト形式を出力（/metrics）
+- CMA_TRACE_LOG を設定すると、リクエスト単位のspan一覧をJSONLで追記
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRACE_LOG = os.getenv("CMA_TRACE_LOG")
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, _Labels], float] = {}
+_gauges: Dict[Tuple[str, _Labels], float] = {}
+_hists: Dict[Tuple[str, _Labels], "_Hist"] = {}
+_help: Dict[str, Tuple[str, str]] = {
+    "cma_span_seconds": ("histogram", "Latency of instrumented pipeline stages"),
+    "cma_span_errors_total": ("counter", "Exceptions raised inside instrumented stages"),
+    "cma_http_request_seconds": ("histogram", "HTTP request latency by endpoint"),
+    "cma_http_requests_total": ("counter", "HTTP requests by endpoint, method and status"),
+}
+
+# リクエスト単位のトレース（None の間は記録しない）
+_trace: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("cma_trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("cma_span_parent", default=None)
+
+
+class _Hist:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 末尾は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, _Labels]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name: str, kind: str, help_text: str) -> None:
+    _help[name] = (kind, help_text)
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    with _lock:
+        _gauges[_key(name, labels)] = float(value)
+
+
+def observe(name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> None:
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = _Hist(buckets)
+        h.observe(value)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    parent = _parent.get()
+    token = _parent.set(name)
+    t0 = time.perf_counter()
+    err = None
+    try:
+        yield
+    except BaseException as e:
+        err = type(e).__name__
+        inc("cma_span_errors_total", span=name, error=err)
+        raise
+    finally:
+        _parent.reset(token)
+        record(name, time.perf_counter() - t0, parent=parent, error=err)
+
+
+def record(name: str, seconds: float, parent: Optional[str] = None, error: Optional[str] = None) -> None:
+    """計測済みの区間を cma_span_seconds とリクエストトレースに記録する。"""
+    observe("cma_span_seconds", seconds, span=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append({"span": name, "parent": parent if parent is not None else _parent.get(),
+                      "seconds": round(seconds, 6), "error": error})
+
+
+def timed(name: str):
+    """関数全体を span(name) で計測するデコレータ"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def start_trace():
+    return _trace.set([])
+
+
+def end_trace(token, spans: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """トレースを閉じて span 一覧を返す。spans は start_trace 時点のコンテキストで trace_spans() から得た一覧
+    （ストリーミング応答の終了時など、別のコンテキストから閉じる場合に渡す）。"""
+    if spans is None:
+        spans = _trace.get() or []
+    try:
+        _trace.reset(token)
+    except ValueError:
+        pass  # 別のコンテキストで作られた token（そのコンテキストごと破棄される）
+    return spans
+
+
+def trace_spans() -> Optional[List[Dict[str, Any]]]:
+    """現在のトレースの span 一覧（記録中のリストそのもの）。トレース中でなければ None"""
+    return _trace.get()
+
+
+def write_trace(record: Dict[str, Any]) -> None:
+    if not TRACE_LOG:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _lock:
+        with open(TRACE_LOG, "a", encoding="utf-8") as fp:
+            fp.write(line + "\n")
+
+
+def _fmt_labels(labels: _Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+def render_prometheus() -> str:
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        hists = {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in _hists.items()}
+    out: List[str] = []
+    names = sorted({k[0] for k in counters} | {k[0] for k in gauges} | {k[0] for k in hists})
+    for name in names:
+        kind, help_text = _help.get(name, ("untyped", ""))
+        if help_text:
+            out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for (n, labels), v in sorted(counters.items()):
+            if n == name:
+                out.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v)}")
+        for (n, labels), v in sorted(gauges.items()):
+            if n == name:
+                out.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v)}")
+        for (n, labels), (buckets, counts, total, count) in sorted(hists.items()):
+            if n != name:
+                continue
+            acc = 0
+            for b, c in zip(buckets, counts):
+                acc += c
+                out.append(f"{name}_bucket{_fmt_labels(labels, (('le', _fmt_num(b)),))} {acc}")
+            out.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {count}")
+            out.append(f"{name}_sum{_fmt_labels(labels)} {total!r}")
+            out.append(f"{name}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(out) + "\n"
+
+
+def snapshot() -> Dict[str, Any]:
+    """span別の件数/合計/平均（JSON向け）"""
+    with _lock:
+        items = [(dict(labels), h.count, h.sum) for (n, labels), h in _hists.items() if n == "cma_span_seconds"]
+    return {
+        lb.get("span", ""): {"count": c, "total_sec": round(s, 6), "avg_sec": round(s / c, 6) if c else 0.0}
+        for lb, c, s in items
+    }
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _hists.clear()
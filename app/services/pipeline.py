@@ -0,0 +1,282 @@
+"""図面1件分の 解析 → 工程分解 → 企業マッチング をまとめて実行する。
+
+非同期版（arun_pipeline / aiter_pipeline）は独立した処理を重ねて実行する:
+- 企業候補のDB取得は図面のOCRと並行
+- ルールで材質・部品種別が確定していれば、工程分解LLMを図面解析LLMと並行
+- 企業ごとのマッチングLLMは CMA_LLM_CONCURRENCY 件まで同時
+- 複数図面では次の図面のOCRが前の図面のLLM待ちと重なる
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ..db.company_db import CompanyRow, ensure_db, fetch_all
+from . import company_matching as cm
+from . import diagram_analysis as da
+from . import process_breakdown as pb
+from .diagram_analysis import Features, analyze_file
+from .process_breakdown import ProcessStep, breakdown_process
+from .company_matching import Match, match_companies
+from . import envelope, llm, metrics
+from .hashing import file_sha256  # 従来どおり pipeline からも import できるように
+
+# OCR(外部プロセス)とLLM呼び出しが主体のためスレッドで並列化する
+DEFAULT_WORKERS = int(os.getenv("CMA_BATCH_WORKERS", "0")) or min(16, (os.cpu_count() or 1) * 2)
+DEFAULT_TOP_N = int(os.getenv("CMA_BATCH_TOP_N", "10"))
+# run_pipeline / iter_pipeline で非同期ランナーを使うか
+USE_ASYNC = os.getenv("CMA_PIPELINE_ASYNC", "true").lower() in ("1", "true", "yes", "on")
+
+
+def features_to_dict(f: Features) -> Dict[str, Any]:
+    return asdict(f)
+
+
+def steps_to_dicts(steps: Sequence[ProcessStep]) -> List[Dict[str, Any]]:
+    return [asdict(s) for s in steps]
+
+
+def matches_to_dicts(matches: Sequence[Match], top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+    out = []
+    for m in (matches[:top_n] if top_n else matches):
+        out.append({
+            "company": {"id": m.company.id, "name": m.company.name},
+            "score": m.score,
+            "steps": list(m.steps),
+            "alliance": [{"id": c.id, "name": c.name} for c in m.alliance] if m.alliance else None,
+            "alliances": [
+                {"members": [{"id": c.id, "name": c.name} for c in a.members], "cost": a.cost,
+                 "missing": list(a.missing), "exact": a.exact}
+                for a in m.alliances
+            ] if m.alliances else None,
+        })
+    return out
+
+
+def run_pipeline(p: Path, top_n: Optional[int] = DEFAULT_TOP_N, rules_only: bool = False, budget: Optional[float] = None) -> Dict[str, Any]:
+    """1図面を処理し、JSONシリアライズ可能なdictを返す。
+    budget 秒（既定 CMA_REQUEST_BUDGET_SEC）を超えるLLM呼び出しは行わず、rules_only ならLLMを使わない。
+    """
+    if USE_ASYNC:
+        return asyncio.run(_closing(arun_pipeline(p, top_n=top_n, rules_only=rules_only, budget=budget)))
+    return _run_sync(p, top_n, rules_only, budget)
+
+
+def _run_sync(p: Path, top_n: Optional[int], rules_only: bool, budget: Optional[float] = None) -> Dict[str, Any]:
+    with llm.deadline(budget), llm.rules_only(rules_only):
+        features = analyze_file(p)
+        steps = breakdown_process(features)
+        matches = match_companies(steps, part=envelope.part_size(features))
+    return _result(features, steps, matches, top_n)
+
+
+def _result(features: Features, steps: Sequence[ProcessStep], matches: Sequence[Match], top_n: Optional[int]) -> Dict[str, Any]:
+    return {
+        "features": features_to_dict(features),
+        "steps": steps_to_dicts(steps),
+        "matches": matches_to_dicts(matches, top_n),
+    }
+
+
+def _item(index: int, p: Path, t0: float, result: Optional[Dict[str, Any]] = None,
+          error: Optional[Exception] = None) -> Dict[str, Any]:
+    """バッチ1件分の結果行"""
+    out: Dict[str, Any] = {"index": index, "filename": p.name, "ok": error is None}
+    if error is None:
+        out["result"] = result
+    else:
+        out["error"] = f"{type(error).__name__}: {error}"
+    out["seconds"] = round(time.perf_counter() - t0, 3)
+    return out
+
+
+def _run_item(index: int, p: Path, top_n: Optional[int], rules_only: bool) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        return _item(index, p, t0, _run_sync(p, top_n, rules_only))
+    except Exception as e:
+        # 1件の失敗でバッチ全体を止めない
+        return _item(index, p, t0, error=e)
+
+
+def iter_pipeline(paths: Sequence[Path], workers: Optional[int] = None, top_n: Optional[int] = DEFAULT_TOP_N, rules_only: bool = False) -> Iterator[Dict[str, Any]]:
+    """複数図面をワーカープールで処理し、完了順に1件ずつ結果を返す。"""
+    workers = max(1, min(workers or DEFAULT_WORKERS, len(paths) or 1))
+    if USE_ASYNC:
+        yield from iter_async(lambda: aiter_pipeline(paths, workers, top_n, rules_only))
+        return
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(_run_item, i, p, top_n, rules_only) for i, p in enumerate(paths)]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+# ---- 非同期ランナー ----
+
+def _load_companies() -> List[CompanyRow]:
+    ensure_db()
+    return fetch_all()
+
+
+async def _adiagram(p: Path, text: str) -> Optional[Dict[str, Any]]:
+    return await llm.achat_json(user=da.llm_prompt(p, text), **da.LLM_ARGS)
+
+
+async def _abreakdown(features: Features) -> List[ProcessStep]:
+    with metrics.span("breakdown_process"):
+        cached = pb.library_steps(features)
+        if cached is not None:
+            return cached
+        steps: List[ProcessStep] = []
+        if llm.should_call("breakdown"):
+            steps = pb.parse_llm_steps(await llm.achat_json(user=pb.llm_prompt(features), **pb.LLM_ARGS))
+        return pb.finish_steps(features, steps)
+
+
+async def _amatch(steps: Sequence[ProcessStep], companies: Sequence[CompanyRow], use_llm: bool = True,
+                 part: Optional[envelope.PartSize] = None) -> List[Match]:
+    with metrics.span("match_companies"):
+        matrix = cm.ScoreMatrix(envelope.filter_companies(companies, part, [s.machine for s in steps]), steps)
+        if use_llm and llm.should_call("matching"):
+            await matrix.afill_boosts()
+        return matrix.matches(steps)
+
+
+def _start_llm(p: Path, text: str, provisional: Features) -> Tuple[Optional["asyncio.Future"], Optional["asyncio.Future"]]:
+    """図面解析LLMを開始し、材質・種別がルールで確定していれば工程分解も並行で開始する。"""
+    diagram = asyncio.ensure_future(_adiagram(p, text)) if llm.should_call("diagram") else None
+    # 材質・種別はルール判定がLLMより優先されるため、両方確定していれば工程分解の入力は変わらない
+    breakdown = None
+    if diagram is None or (provisional.material and provisional.part_type):
+        breakdown = asyncio.ensure_future(_abreakdown(provisional))
+    return diagram, breakdown
+
+
+async def arun_pipeline(p: Path, top_n: Optional[int] = DEFAULT_TOP_N, rules_only: bool = False, budget: Optional[float] = None,
+                        companies: Optional[Awaitable[List[CompanyRow]]] = None) -> Dict[str, Any]:
+    """run_pipeline の非同期版。companies に取得中の企業一覧を渡すと複数図面で共有できる。"""
+    with llm.deadline(budget), llm.rules_only(rules_only):
+        if companies is None:
+            companies = asyncio.ensure_future(asyncio.to_thread(_load_companies))
+        with metrics.span("analyze_file"):
+            text = await asyncio.to_thread(da.read_text, p)
+            provisional = da.build_features(p, text)
+            diagram, breakdown = _start_llm(p, text, provisional)
+            features = da.build_features(p, text, await diagram) if diagram is not None else provisional
+        if breakdown is None:
+            breakdown = asyncio.ensure_future(_abreakdown(features))
+        steps = await breakdown
+        matches = await _amatch(steps, await companies, part=envelope.part_size(features))
+    return _result(features, steps, matches, top_n)
+
+
+async def _arun_item(index: int, p: Path, top_n: Optional[int], rules_only: bool, companies: Awaitable[List[CompanyRow]]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        return _item(index, p, t0, await arun_pipeline(p, top_n=top_n, rules_only=rules_only, companies=companies))
+    except Exception as e:
+        return _item(index, p, t0, error=e)
+
+
+async def aiter_pipeline(paths: Sequence[Path], workers: Optional[int] = None, top_n: Optional[int] = DEFAULT_TOP_N, rules_only: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    """iter_pipeline の非同期版。最大 workers 件を同時に処理し、完了順に返す。"""
+    workers = max(1, min(workers or DEFAULT_WORKERS, len(paths) or 1))
+    sem = asyncio.Semaphore(workers)
+    companies = asyncio.ensure_future(asyncio.to_thread(_load_companies))
+
+    async def one(i: int, p: Path) -> Dict[str, Any]:
+        async with sem:
+            return await _arun_item(i, p, top_n, rules_only, companies)
+
+    for fut in asyncio.as_completed([one(i, p) for i, p in enumerate(paths)]):
+        yield await fut
+
+
+async def aiter_progressive(p: Path, rules_only: bool = False, budget: Optional[float] = None) -> AsyncIterator[Tuple[str, str, Any]]:
+    """ルールのみの結果を先に、LLMで精緻化した結果を後から (event, stage, 値) で返す。
+    event は features / steps / matches、stage は rules / llm。
+    """
+    with llm.deadline(budget), llm.rules_only(rules_only):
+        companies = asyncio.ensure_future(asyncio.to_thread(_load_companies))
+        with metrics.span("analyze_file"):
+            text = await asyncio.to_thread(da.read_text, p)
+            provisional = da.build_features(p, text)
+        rule_steps = pb.rule_steps(provisional)
+        yield "features", "rules", provisional
+        yield "steps", "rules", rule_steps
+        yield "matches", "rules", await _amatch(rule_steps, await companies, use_llm=False, part=envelope.part_size(provisional))
+        diagram, breakdown = _start_llm(p, text, provisional)
+
+        features = da.build_features(p, text, await diagram) if diagram is not None else provisional
+        if features != provisional:
+            yield "features", "llm", features
+        if breakdown is None:
+            breakdown = asyncio.ensure_future(_abreakdown(features))
+        steps = await breakdown
+        if steps != rule_steps:
+            yield "steps", "llm", steps
+        if llm.should_call("matching") or steps != rule_steps:
+            yield "matches", "llm", await _amatch(steps, await companies, part=envelope.part_size(features))
+
+
+async def _closing(coro: Awaitable[Any]) -> Any:
+    """coro を実行し、このループで作った LLM クライアントを閉じてから返す（asyncio.run 用）。"""
+    try:
+        return await coro
+    finally:
+        await llm.aclose_client()
+
+
+def iter_async(make: Callable[[], AsyncIterator[Any]]) -> Iterator[Any]:
+    """非同期イテレータを別スレッドのイベントループで回し、同期ジェネレータとして返す。
+    呼び出し側が途中で読むのをやめる（close / 破棄）と、ループ側のタスクを取り消して終了させる。"""
+    q: "queue.Queue" = queue.Queue()
+    done = object()
+    stopped = threading.Event()
+    running: Dict[str, Any] = {}
+
+    async def pump() -> None:
+        running["loop"], running["task"] = asyncio.get_running_loop(), asyncio.current_task()
+        if stopped.is_set():
+            return
+        agen = make()
+        try:
+            async for item in agen:
+                q.put(item)
+        finally:
+            aclose = getattr(agen, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def run() -> None:
+        try:
+            asyncio.run(_closing(pump()))
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            q.put(e)
+        finally:
+            q.put(done)
+
+    threading.Thread(target=run, daemon=True, name="cma-pipeline-async").start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        loop, task = running.get("loop"), running.get("task")
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # ループは終了済み
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
-from typing import List, Optional
-from . import llm
+from typing import Any, Dict, List, Optional
+from . import llm, process_plans
+from .metrics import timed
 
 @dataclass
 class ProcessStep:
@@ -11,42 +12,50 @@ class ProcessStep:
     precision: Optional[str] = None  # 例: 粗/仕上/検査
 
 
-def breakdown_process(features) -> List[ProcessStep]:
-    steps: List[ProcessStep] = []
-    # LLM提案（あれば採用）
-    if llm.is_configured():
-        schema = (
-            '{"name": "string", "machine": "string", "minutes": "integer", '
-            '"tolerance": "string(optional)", "precision": "string(optional)"}'
-        )
-        prompt = f"""
+LLM_ARGS: Dict[str, Any] = dict(
+    system="工程分解",
+    temperature=0.1,
+    max_tokens=500,
+    timeout=25,
+    reasoning_effort="medium",
+    site="breakdown",
+)
+
+
+def llm_prompt(features) -> str:
+    schema = (
+        '{"name": "string", "machine": "string", "minutes": "integer", '
+        '"tolerance": "string(optional)", "precision": "string(optional)"}'
+    )
+    return f"""
 あなたは工程設計の専門家です。以下の条件で3〜5工程の推奨工程のみをJSON配列で厳密に出力してください。説明文や前置きは禁止。
 各要素スキーマ: {schema}
 前提: 材質={features.material}, 種別={features.part_type}
         """
-        js = llm.chat_json(
-            system="工程分解",
-            user=prompt,
-            temperature=0.1,
-            max_tokens=500,
-            timeout=25,
-            reasoning_effort="medium",
-        )
-        if isinstance(js, list):
-            for item in js:
-                try:
-                    steps.append(
-                        ProcessStep(
-                            name=str(item.get("name")),
-                            machine=str(item.get("machine")),
-                            minutes=int(item.get("minutes", 10)),
-                            tolerance=item.get("tolerance"),
-                            precision=item.get("precision"),
-                        )
+
+
+def parse_llm_steps(js) -> List[ProcessStep]:
+    steps: List[ProcessStep] = []
+    if isinstance(js, list):
+        for item in js:
+            try:
+                steps.append(
+                    ProcessStep(
+                        name=str(item.get("name")),
+                        machine=str(item.get("machine")),
+                        minutes=int(item.get("minutes", 10)),
+                        tolerance=item.get("tolerance"),
+                        precision=item.get("precision"),
                     )
-                except Exception:
-                    pass
-    # 極簡易ルール（フォールバック）
+                )
+            except Exception:
+                pass
+    return steps
+
+
+def rule_steps(features) -> List[ProcessStep]:
+    """極簡易ルール（フォールバック）。材質と寸法表記の有無のみに依存する。"""
+    steps: List[ProcessStep] = []
     material = (features.material or "").upper()
     if "SUS" in material:
         steps.append(ProcessStep("荒加工", "VMC", 30, precision="粗"))
@@ -60,3 +69,29 @@ def breakdown_process(features) -> List[ProcessStep]:
     if features.dims_text:
         steps.append(ProcessStep("検査", "三次元測定機", 10, precision="検査"))
     return steps
+
+
+def library_steps(features) -> Optional[List[ProcessStep]]:
+    """工程計画ライブラリに登録済みなら、その工程リスト"""
+    rows = process_plans.lookup(process_plans.key_of(features))
+    return None if rows is None else [ProcessStep(**r) for r in rows]
+
+
+def finish_steps(features, llm_steps: List[ProcessStep]) -> List[ProcessStep]:
+    """LLM提案にルールの工程を足す。LLMが答えた組み合わせはライブラリに書き戻す。"""
+    steps = llm_steps + rule_steps(features)
+    if llm_steps:
+        process_plans.store(process_plans.key_of(features), steps)
+    return steps
+
+
+@timed("breakdown_process")
+def breakdown_process(features) -> List[ProcessStep]:
+    cached = library_steps(features)
+    if cached is not None:
+        return cached
+    steps: List[ProcessStep] = []
+    # LLM提案（あれば採用）
+    if llm.should_call("breakdown"):
+        steps.extend(parse_llm_steps(llm.chat_json(user=llm_prompt(features), **LLM_ARGS)))
+    return finish_steps(features, steps)
@@ -0,0 +1,95 @@
+"""材質 × 部品種別ごとの工程計画ライブラリ
+
+工程分解の結果は図面の材質・部品種別・寸法表記の有無だけで決まる（LLMの入力は材質と種別、
+ルールの分岐は材質と寸法表記）。この3つを正規化したキーで工程リストを企業DBの process_plans
+テーブルに保存し、オンラインでは主キー1回の検索で返す。
+
+- 未登録のキーだけLLMに問い合わせ、結果を書き戻す（source='llm'）
+- `python -m app.plans warm` で既知の組み合わせを事前に埋める
+- 管理者が `/admin/plans` で編集した計画（source='admin'）はLLMの結果で上書きしない
+"""
+import json
+import os
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..db import company_db
+from .diagram_analysis import MATERIAL_WORDS, PART_TYPE_WORDS
+
+ENABLED = os.getenv("CMA_PROCESS_PLANS", "true").lower() in ("1", "true", "yes", "on")
+
+PlanKey = Tuple[str, str, int]  # (材質, 部品種別, 寸法表記あり=1)
+
+_STEP_FIELDS = ("name", "machine", "minutes", "tolerance", "precision")
+
+
+def _norm(s: Optional[str]) -> str:
+    return " ".join(unicodedata.normalize("NFKC", s or "").upper().split())
+
+
+def make_key(material: Optional[str], part_type: Optional[str], has_dims: Any) -> PlanKey:
+    return _norm(material), _norm(part_type), 1 if has_dims else 0
+
+
+def key_of(features: Any) -> PlanKey:
+    return make_key(getattr(features, "material", None), getattr(features, "part_type", None),
+                    getattr(features, "dims_text", None))
+
+
+def known_keys() -> List[PlanKey]:
+    """ルールで判定できる材質・部品種別（不明を含む）と寸法表記の有無の全組み合わせ"""
+    return [make_key(m, t, d) for m in (None,) + MATERIAL_WORDS for t in (None,) + PART_TYPE_WORDS for d in (0, 1)]
+
+
+def validate_steps(raw: Any) -> List[Dict[str, Any]]:
+    """工程リスト（dict の配列）を検査して保存用に整える。不正なら ValueError"""
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("steps は1件以上の配列で指定してください")
+    out = []
+    for i, s in enumerate(raw, 1):
+        if not isinstance(s, dict):
+            raise ValueError(f"{i}番目の工程がオブジェクトではありません")
+        name, machine = str(s.get("name") or "").strip(), str(s.get("machine") or "").strip()
+        if not name or not machine:
+            raise ValueError(f"{i}番目の工程に name と machine が必要です")
+        try:
+            minutes = int(s.get("minutes") or 10)
+        except (TypeError, ValueError):
+            raise ValueError(f"{i}番目の工程の minutes が数値ではありません") from None
+        if minutes <= 0:
+            raise ValueError(f"{i}番目の工程の minutes は正の数で指定してください")
+        out.append({
+            "name": name,
+            "machine": machine,
+            "minutes": minutes,
+            "tolerance": s.get("tolerance") or None,
+            "precision": s.get("precision") or None,
+        })
+    return out
+
+
+def lookup(key: PlanKey) -> Optional[List[Dict[str, Any]]]:
+    """登録済みの工程リスト（dict）。未登録・無効化時は None"""
+    if not ENABLED:
+        return None
+    row = company_db.fetch_process_plan(*key)
+    return json.loads(row[0]) if row else None
+
+
+def store(key: PlanKey, steps: Sequence[Any], source: str = "llm", keep_admin: bool = True) -> bool:
+    """工程リスト（ProcessStep または dict）を保存する。管理者の計画は keep_admin=False のときだけ上書き"""
+    if not ENABLED and source != "admin":
+        return False
+    rows = [s if isinstance(s, dict) else {k: getattr(s, k) for k in _STEP_FIELDS} for s in steps]
+    return company_db.save_process_plan(*key, json.dumps(rows, ensure_ascii=False), source, keep_admin=keep_admin)
+
+
+def delete(key: PlanKey) -> bool:
+    return company_db.delete_process_plan(*key)
+
+
+def list_plans() -> List[Dict[str, Any]]:
+    return [
+        {"material": m, "part_type": t, "has_dims": bool(d), "steps": json.loads(s), "source": src, "updated_at": ts}
+        for m, t, d, s, src, ts in company_db.fetch_process_plans()
+    ]
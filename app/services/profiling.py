@@ -0,0 +1,201 @@
+"""管理者向けオンデマンド・プロファイラ
+
+arm() で「次のN件」または「一定割合」のリクエストを計測対象にし、リクエストごとに
+- cProfile の pstats（snakeviz / pstats で閲覧）
+- スタックサンプリングによる folded stacks（flamegraph.pl / speedscope で閲覧）
+- 任意で tracemalloc の上位確保箇所
+を PROFILE_DIR に保存する。サーバの再起動は不要。
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PROFILE_DIR = Path(os.getenv("CMA_PROFILE_DIR") or (Path(__file__).resolve().parent.parent / "profiles"))
+SAMPLE_INTERVAL = float(os.getenv("CMA_PROFILE_SAMPLE_MS", "5")) / 1000.0
+MAX_PROFILES = int(os.getenv("CMA_PROFILE_KEEP", "200"))
+KINDS = {"pstats": ".pstats", "folded": ".folded", "top": ".txt", "alloc": ".alloc.txt", "meta": ".json"}
+
+_lock = threading.Lock()
+_active = threading.Lock()  # cProfile は同時に1つだけ有効にする
+_state: Dict[str, Any] = {"remaining": 0, "sample_pct": 0.0, "tracemalloc": False, "armed_at": None}
+
+
+def arm(count: int = 0, sample_pct: float = 0.0, trace_malloc: bool = False) -> Dict[str, Any]:
+    with _lock:
+        _state.update(remaining=max(0, int(count)), sample_pct=min(100.0, max(0.0, float(sample_pct))),
+                      tracemalloc=bool(trace_malloc), armed_at=time.time())
+    return status()
+
+
+def disarm() -> Dict[str, Any]:
+    return arm(0, 0.0, False)
+
+
+def status() -> Dict[str, Any]:
+    with _lock:
+        return dict(_state)
+
+
+def _armed() -> bool:
+    with _lock:
+        return _state["remaining"] > 0 or _state["sample_pct"] > 0
+
+
+def should_profile() -> bool:
+    with _lock:
+        if _state["remaining"] > 0:
+            _state["remaining"] -= 1
+            return True
+        return _state["sample_pct"] > 0 and random.random() * 100.0 < _state["sample_pct"]
+
+
+class _StackSampler(threading.Thread):
+    """対象スレッドのスタックを一定間隔で採取し folded 形式で集計する。"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True, name="cma-profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._halt.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, trace_malloc: bool = False):
+        self.trace_malloc = trace_malloc
+        self.profiler = cProfile.Profile()
+        self.sampler: Optional[_StackSampler] = None
+        self._started_tracemalloc = False
+        self.t0 = 0.0
+
+    @classmethod
+    def begin(cls) -> Optional["RequestProfile"]:
+        """計測対象なら開始済みの RequestProfile を返す（他の計測中ならスキップ）。
+        計測枠を確保してから残り件数を消費するので、他の計測中のリクエストで件数は減らない。"""
+        if not _armed() or not _active.acquire(blocking=False):
+            return None
+        if not should_profile():
+            _active.release()
+            return None
+        prof = cls(trace_malloc=status()["tracemalloc"])
+        try:
+            prof.start()
+        except Exception:
+            _active.release()
+            return None
+        return prof
+
+    def start(self) -> None:
+        if self.trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._started_tracemalloc = True
+        self.sampler = _StackSampler(threading.get_ident(), SAMPLE_INTERVAL)
+        self.sampler.start()
+        self.t0 = time.perf_counter()
+        self.profiler.enable()
+
+    def finish(self, meta: Dict[str, Any]) -> str:
+        """計測を終了してファイルに保存し、プロファイルIDを返す。"""
+        try:
+            self.profiler.disable()
+            seconds = time.perf_counter() - self.t0
+            self.sampler.stop()
+            snap = tracemalloc.take_snapshot() if self.trace_malloc and tracemalloc.is_tracing() else None
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            return _save(self.profiler, self.sampler.stacks, snap, dict(meta, seconds=round(seconds, 6)))
+        finally:
+            _active.release()
+
+
+def _save(profiler: cProfile.Profile, stacks: Counter, snap: Optional[tracemalloc.Snapshot], meta: Dict[str, Any]) -> str:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", meta.get("path", "")).strip("_")[:40] or "root"
+    # 時刻順に並ぶ接頭辞＋同じミリ秒・複数プロセスでも衝突しない乱数部
+    pid = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}-{uuid.uuid4().hex[:8]}-{slug}"
+    base = PROFILE_DIR / pid
+    profiler.dump_stats(str(base) + KINDS["pstats"])
+
+    buf = io.StringIO()
+    pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(60)
+    (Path(str(base) + KINDS["top"])).write_text(buf.getvalue(), encoding="utf-8")
+
+    (Path(str(base) + KINDS["folded"])).write_text(
+        "".join(f"{stack} {n}\n" for stack, n in stacks.most_common()), encoding="utf-8")
+
+    kinds = ["pstats", "top", "folded"]
+    if snap is not None:
+        snap = snap.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        lines = []
+        for st in snap.statistics("lineno")[:40]:
+            frame = st.traceback[0]
+            lines.append(f"{st.size / 1024:10.1f} KiB {st.count:8d} blocks  {frame.filename}:{frame.lineno}")
+        (Path(str(base) + KINDS["alloc"])).write_text("\n".join(lines) + "\n", encoding="utf-8")
+        kinds.append("alloc")
+    meta.update(id=pid, kinds=kinds, samples=sum(stacks.values()), created=time.time())
+    (Path(str(base) + KINDS["meta"])).write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding="utf-8")
+    _prune()
+    return pid
+
+
+def _prune() -> None:
+    metas = sorted(PROFILE_DIR.glob("*" + KINDS["meta"]))
+    for m in metas[:-MAX_PROFILES] if len(metas) > MAX_PROFILES else []:
+        pid = m.name[: -len(KINDS["meta"])]
+        for ext in KINDS.values():
+            Path(str(PROFILE_DIR / pid) + ext).unlink(missing_ok=True)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    if not PROFILE_DIR.exists():
+        return []
+    out = []
+    for m in sorted(PROFILE_DIR.glob("*" + KINDS["meta"]), reverse=True):
+        try:
+            out.append(json.loads(m.read_text(encoding="utf-8")))
+        except ValueError:
+            continue
+    return out
+
+
+def profile_file(pid: str, kind: str) -> Optional[Path]:
+    if kind not in KINDS or not re.fullmatch(r"[A-Za-z0-9_\-]+", pid):
+        return None
+    p = Path(str(PROFILE_DIR / pid) + KINDS[kind])
+    return p if p.exists() else None
+
+
+def clear() -> int:
+    n = 0
+    for m in PROFILE_DIR.glob("*") if PROFILE_DIR.exists() else []:
+        if m.is_file():
+            m.unlink()
+            n += 1
+    return n
@@ -1,12 +1,24 @@
-from typing import List, Sequence, Mapping, Any
+from typing import List, Sequence, Mapping, Any, Optional
+from collections import OrderedDict
+from dataclasses import asdict
+import hashlib
+import json
+import os
+import threading
 from jinja2 import Template
+from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
 from io import BytesIO
 from .diagram_analysis import Features
 from .process_breakdown import ProcessStep
 from .company_matching import Match
+from .metrics import timed
 
 # optional Word(.docx) support
 try:
@@ -78,49 +90,143 @@ _TEMPLATE = Template(
 )
 
 
+@timed("render_report_html")
 def render_report_html(f: Features, steps: List[ProcessStep], matches: List[Match]) -> str:
   return _TEMPLATE.render(f=f, steps=steps, matches=matches)
 
 
+# PDF: CJKフォントはプロセスごとに一度だけ登録する（CMA_PDF_FONT_PATH でTTF/TTCを指定可能）
+PDF_CJK_CID_FONT = "HeiseiKakuGo-W5"
+PDF_CACHE_SIZE = int(os.getenv("CMA_PDF_CACHE_SIZE", "32"))
+
+_pdf_font_name: Optional[str] = None
+_pdf_styles: Optional[dict] = None
+_pdf_lock = threading.Lock()
+_pdf_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
+
+def _pdf_setup() -> dict:
+  """フォント登録と段落スタイル生成（初回のみ）。"""
+  global _pdf_font_name, _pdf_styles
+  if _pdf_styles is not None:
+    return _pdf_styles
+  with _pdf_lock:
+    if _pdf_styles is None:
+      font_path = os.getenv("CMA_PDF_FONT_PATH")
+      if font_path:
+        pdfmetrics.registerFont(TTFont("CMA-CJK", font_path))
+        _pdf_font_name = "CMA-CJK"
+      else:
+        pdfmetrics.registerFont(UnicodeCIDFont(PDF_CJK_CID_FONT))
+        _pdf_font_name = PDF_CJK_CID_FONT
+      font = _pdf_font_name
+      _pdf_styles = {
+        "title": ParagraphStyle("cma-title", fontName=font, fontSize=16, leading=22, spaceAfter=4 * mm),
+        "h2": ParagraphStyle("cma-h2", fontName=font, fontSize=12, leading=16, spaceBefore=4 * mm, spaceAfter=2 * mm),
+        "body": ParagraphStyle("cma-body", fontName=font, fontSize=9, leading=12, wordWrap="CJK"),
+        "cell": ParagraphStyle("cma-cell", fontName=font, fontSize=8, leading=10, wordWrap="CJK"),
+      }
+  return _pdf_styles
+
+
+def _pdf_table(header: List[str], rows: List[List[Any]], col_widths: List[float], font: str) -> Table:
+  # repeatRows=1 でページ送り時にヘッダ行を再掲（改ページはTableの分割に任せる）
+  tbl = Table([header] + rows, colWidths=col_widths, repeatRows=1)
+  tbl.setStyle(TableStyle([
+    ("FONT", (0, 0), (-1, -1), font, 8),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e7efff")),
+    ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#9ca3af")),
+    ("VALIGN", (0, 0), (-1, -1), "TOP"),
+  ]))
+  return tbl
+
+
+@timed("render_report_pdf")
 def render_report_pdf(f: Features, steps: List[ProcessStep], matches: List[Match]) -> bytes:
+  st = _pdf_setup()
+  font = _pdf_font_name
+  story: List[Any] = [Paragraph("CMA マッチングレポート", st["title"])]
+
+  # 1. 図面解析結果
+  story.append(Paragraph("1. 図面解析結果", st["h2"]))
+  lines = [
+    f"ファイル: {f.filename} ({f.ext})",
+    f"材質候補: {f.material or '不明'}",
+    f"部品種別候補: {f.part_type or '不明'}",
+  ]
+  if f.title:
+    lines.append(f"タイトル: {f.title}")
+  if f.drawing_no:
+    lines.append(f"図番: {f.drawing_no}")
+  if f.surface_finish:
+    lines.append(f"表面粗さ: {f.surface_finish}")
+  if f.tolerances:
+    lines.append("公差: " + ", ".join(f.tolerances))
+  if f.recommended_process or f.recommended_machine:
+    lines.append(f"推奨加工/装置: {f.recommended_process or '-'} / {f.recommended_machine or '-'}")
+  for line in lines:
+    story.append(Paragraph(_esc(line), st["body"]))
+
+  # 2. 加工工程案
+  story.append(Paragraph("2. 加工工程案", st["h2"]))
+  if steps:
+    rows = [[s.name or "", s.machine or "", str(s.minutes), s.tolerance or "-", getattr(s, "precision", None) or "-"] for s in steps]
+    story.append(_pdf_table(["工程", "装置", "目安時間(min)", "公差", "精度"], rows, [50 * mm, 45 * mm, 25 * mm, 25 * mm, 25 * mm], font))
+  else:
+    story.append(Paragraph("工程情報なし", st["body"]))
+
+  # 3. 企業マッチング結果
+  story.append(Paragraph("3. 企業マッチング結果", st["h2"]))
+  if matches:
+    # 折り返しが必要な列のみParagraphにする（大量行のレイアウトコストを抑える）
+    rows = [
+      [Paragraph(_esc(m.company.name), st["cell"]), f"{m.score:.2f}",
+       Paragraph(_esc(", ".join(m.steps)) if m.steps else "-", st["cell"])]
+      for m in matches
+    ]
+    story.append(_pdf_table(["企業", "スコア", "対応工程"], rows, [60 * mm, 20 * mm, 90 * mm], font))
+    if getattr(matches[0], "alliance", None):
+      story.append(Spacer(1, 3 * mm))
+      story.append(Paragraph(_esc("アライアンス提案: " + ", ".join(c.name for c in matches[0].alliance)), st["body"]))
+  else:
+    story.append(Paragraph("候補なし", st["body"]))
+
   buf = BytesIO()
-  c = canvas.Canvas(buf, pagesize=A4)
-  width, height = A4
-  y = height - 20 * mm
-  c.setFont("Helvetica-Bold", 16)
-  c.drawString(20 * mm, y, "CMA マッチングレポート")
-  y -= 12 * mm
-  c.setFont("Helvetica", 10)
-  # 1. Features
-  c.drawString(20 * mm, y, f"ファイル: {f.filename} ({f.ext})  材質: {f.material or '不明'}  種別: {f.part_type or '不明'}")
-  y -= 8 * mm
-  # 2. Steps
-  c.setFont("Helvetica-Bold", 12)
-  c.drawString(20 * mm, y, "加工工程案")
-  y -= 7 * mm
-  c.setFont("Helvetica", 10)
-  for s in steps:
-    line = f"- {s.name} / {s.machine} / {s.minutes}min / tol: {s.tolerance or '-'}"
-    c.drawString(22 * mm, y, line)
-    y -= 6 * mm
-    if y < 20 * mm:
-      c.showPage(); y = height - 20 * mm
-  # 3. Matches
-  c.setFont("Helvetica-Bold", 12)
-  c.drawString(20 * mm, y, "企業マッチング結果")
-  y -= 7 * mm
-  c.setFont("Helvetica", 10)
-  for m in matches:
-    line = f"- {m.company.name}  score={m.score}  steps: {', '.join(m.steps) if m.steps else '-'}"
-    c.drawString(22 * mm, y, line)
-    y -= 6 * mm
-    if y < 20 * mm:
-      c.showPage(); y = height - 20 * mm
-  c.showPage()
-  c.save()
+  doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=20 * mm, rightMargin=20 * mm, topMargin=20 * mm, bottomMargin=20 * mm,
+                          title="CMA マッチングレポート")
+  doc.build(story)
   return buf.getvalue()
 
 
+def _esc(s: str) -> str:
+  return (s or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def report_fingerprint(f: Features, steps: List[ProcessStep], matches: List[Match]) -> str:
+  """レポート内容（特徴・工程・マッチ結果）から決まるハッシュ値。"""
+  payload = [asdict(f), [asdict(s) for s in steps], [asdict(m) for m in matches]]
+  raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+  return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render_report_pdf_cached(f: Features, steps: List[ProcessStep], matches: List[Match], fingerprint: Optional[str] = None) -> bytes:
+  """render_report_pdf の結果をフィンガープリント単位でLRUキャッシュする。"""
+  key = fingerprint or report_fingerprint(f, steps, matches)
+  with _pdf_lock:
+    data = _pdf_cache.get(key)
+    if data is not None:
+      _pdf_cache.move_to_end(key)
+      return data
+  data = render_report_pdf(f, steps, matches)
+  if PDF_CACHE_SIZE > 0:
+    with _pdf_lock:
+      _pdf_cache[key] = data
+      while len(_pdf_cache) > PDF_CACHE_SIZE:
+        _pdf_cache.popitem(last=False)
+  return data
+
+
+@timed("render_report_docx")
 def render_report_docx(f: Features, steps: List[ProcessStep], matches: List[Match]) -> bytes:
   """マッチングレポートを Word(.docx) として生成する"""
   if Document is None:
@@ -196,6 +302,7 @@ def render_report_docx(f: Features, steps: List[ProcessStep], matches: List[Matc
   return out.getvalue()
 
 
+@timed("render_assignments_docx")
 def render_assignments_docx(drawing_file: str, items: Sequence[Mapping[str, Any]]) -> bytes:
   """選択された図面に対する割当一覧のみを Word(.docx) で出力する簡易レポート"""
   if Document is None:
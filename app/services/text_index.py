@@ -0,0 +1,173 @@
+"""企業テキスト（装置・スキル・備考）の文字 n-gram TF-IDF 索引
+
+日本語を分かち書きせずに扱えるよう、NFKC正規化・小文字化した文字列の 2/3-gram を語とする。
+各社の n-gram 頻度は企業DBの company_ngrams テーブルに row_version と共に保存し、
+企業DBのバージョンが変わったときは追加/更新/削除された企業分だけ再計算する。
+転置索引（n-gram → {企業ID: 1 + log(頻度)}）に対するコサイン類似度で上位 k 社を返す。
+"""
+import heapq
+import json
+import math
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..db import company_db
+from ..db.company_db import CompanyRow
+from .metrics import timed
+
+NGRAM_SIZES = (2, 3)
+
+
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def ngrams(text: str) -> Counter:
+    s = normalize(text)
+    grams: Counter = Counter()
+    for n in NGRAM_SIZES:
+        for k in range(len(s) - n + 1):
+            g = s[k:k + n]
+            if not g.isspace():
+                grams[g] += 1
+    return grams
+
+
+def company_text(c: CompanyRow) -> str:
+    return f"{c.machines} {c.skills} {c.notes}"
+
+
+class NgramIndex:
+    """転置索引。IDFと文書ノルムは全件再計算時点の値を使い、差分更新では変わった企業のノルムだけ求める。
+    差分更新の件数が企業数の REFRESH_RATIO を超えたら次の問い合わせで全件再計算する。"""
+
+    REFRESH_RATIO = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key: Optional[Tuple[str, int]] = None   # (DBパス, 企業DBバージョン)
+        self.docs: Dict[int, Tuple[int, Counter]] = {}   # 企業ID → (row_version, n-gram頻度)
+        self.postings: Dict[str, Dict[int, float]] = {}  # n-gram → {企業ID: 1 + log(頻度)}
+        self.norms: Dict[int, float] = {}
+        self.idf: Dict[str, float] = {}   # 全件再計算時点のIDF（未知のn-gramは初出時の値で固定）
+        self._stale: set = set()          # ノルム未計算の企業ID
+        self._changes = 0
+        self._full = True                 # 次の問い合わせで全件再計算するか
+        self._loaded: Optional[str] = None  # 保存済み頻度を読み込んだDBパス
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _idf(self, gram: str) -> float:
+        w = self.idf.get(gram)
+        if w is None:
+            w = self.idf[gram] = math.log((len(self.docs) + 1) / (len(self.postings.get(gram, ())) + 1)) + 1.0
+        return w
+
+    def _norm(self, grams: Counter) -> float:
+        return math.sqrt(sum(((1.0 + math.log(tf)) * self._idf(g)) ** 2 for g, tf in grams.items())) or 1.0
+
+    def _add(self, cid: int, version: int, grams: Counter) -> None:
+        self._remove(cid)
+        self.docs[cid] = (version, grams)
+        for g, tf in grams.items():
+            self.postings.setdefault(g, {})[cid] = 1.0 + math.log(tf)
+        self._stale.add(cid)
+        self._changes += 1
+
+    def _remove(self, cid: int) -> None:
+        old = self.docs.pop(cid, None)
+        if old is None:
+            return
+        for g in old[1]:
+            post = self.postings.get(g)
+            if post is not None:
+                post.pop(cid, None)
+                if not post:
+                    del self.postings[g]
+        self.norms.pop(cid, None)
+        self._stale.discard(cid)
+        self._changes += 1
+
+    def _reset(self) -> None:
+        self.docs.clear()
+        self.postings.clear()
+        self.norms.clear()
+        self._stale.clear()
+        self._full = True
+
+    @timed("text_index.sync")
+    def sync(self) -> None:
+        """企業DBとの差分（row_version の変化・追加・削除）だけ索引と保存済み頻度を更新する。"""
+        company_db.ensure_db()
+        key = (str(company_db.DB_PATH), company_db.data_version())
+        with self.lock:
+            if key == self.key:
+                return
+            if self._loaded != key[0]:
+                # DBが切り替わったら保存済みの頻度から読み込み直す（テキストの再分解は不要）
+                self._reset()
+                for cid, (version, raw) in company_db.fetch_ngram_docs().items():
+                    self._add(cid, version, Counter(json.loads(raw)))
+                self._loaded = key[0]
+            versions = company_db.fetch_row_versions()
+            deleted = [cid for cid in self.docs if cid not in versions]
+            for cid in deleted:
+                self._remove(cid)
+            changed = [cid for cid, v in versions.items() if self.docs.get(cid, (None,))[0] != v]
+            rows: List[Tuple[int, int, str]] = []
+            if changed:
+                wanted = set(changed)
+                companies = company_db.fetch_all() if len(changed) > 50 else [company_db.fetch_by_id(cid) for cid in changed]
+                for c in companies:
+                    if c is None or c.id not in wanted:
+                        continue
+                    grams = ngrams(company_text(c))
+                    self._add(c.id, versions[c.id], grams)
+                    rows.append((c.id, versions[c.id], json.dumps(grams, ensure_ascii=False)))
+            if rows or deleted:
+                company_db.save_ngram_docs(rows, deleted)
+            self.key = key
+
+    def _refresh_norms(self) -> None:
+        if self._full or self._changes > max(50, self.REFRESH_RATIO * len(self.docs)):
+            self.idf = {}
+            self.norms = {cid: self._norm(grams) for cid, (_, grams) in self.docs.items()}
+            self._full, self._changes = False, 0
+        else:
+            for cid in self._stale:
+                self.norms[cid] = self._norm(self.docs[cid][1])
+        self._stale.clear()
+
+    @timed("text_index.query")
+    def query(self, text: str, k: int = 10, ids: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        """text とのコサイン類似度の上位 k 社 [(企業ID, 類似度)]。ids を渡すとその企業に限定する。"""
+        q = ngrams(text)
+        with self.lock:
+            self._refresh_norms()
+            # 半数超の企業に現れる n-gram（「加工」等）は順位にほぼ寄与しないため走査しない
+            limit = max(1, len(self.docs) // 2)
+            weights = {g: (1.0 + math.log(tf)) * self._idf(g) for g, tf in q.items()
+                       if g in self.postings and len(self.postings[g]) <= limit}
+            qnorm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            scores: Dict[int, float] = {}
+            get = scores.get
+            for g, wq in weights.items():
+                w = wq * self._idf(g)
+                for cid, tw in self.postings[g].items():
+                    scores[cid] = get(cid, 0.0) + w * tw
+            allowed = set(ids) if ids is not None else None
+            items = ((cid, s / (self.norms.get(cid, 1.0) * qnorm)) for cid, s in scores.items()
+                     if allowed is None or cid in allowed)
+            return heapq.nlargest(k, items, key=lambda x: x[1])
+
+
+_index = NgramIndex()
+
+
+def relevance(text: str, k: int = 10, ids: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+    """企業DBの索引を最新化して上位 k 社を返す（1リクエスト1回の想定）。"""
+    _index.sync()
+    return _index.query(text, k, ids)
@@ -0,0 +1,199 @@
+"""アップロード図面のサムネイル・プレビュー（派生画像）
+
+派生画像は元ファイルの内容ハッシュ（sha256）ごとのディレクトリに保存する。
+
+    uploads/derived/<sha256>/source    … 元ファイル名（遅延生成で元ファイルを探すため）
+    uploads/derived/<sha256>/256.webp  … 長辺 256px のサムネイル（WebP 非対応の Pillow では .jpg）
+    uploads/derived/<sha256>/page1.png … PDF の1ページ目（pdftoppm がある環境のみ）
+
+URL に内容ハッシュを含むため、同じURLの中身は変わらない（長期キャッシュ可能）。
+派生画像は register() 後の最初の要求時に作る。
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError, features as pil_features
+
+from .hashing import file_sha256
+from .metrics import timed
+
+DERIVED_DIR = Path(os.getenv("CMA_THUMB_DIR", str(Path(__file__).resolve().parent.parent / "uploads" / "derived")))
+_DEFAULT_SIZES = (256, 1024)
+
+
+def _parse_sizes(raw: str) -> Tuple[int, ...]:
+    """CMA_THUMB_SIZES（カンマ区切りの長辺px）。有効な値が1つもなければ既定値"""
+    sizes = sorted({int(s) for s in raw.split(",") if s.strip().isdigit() and int(s) > 0})
+    return tuple(sizes) or _DEFAULT_SIZES
+
+
+SIZES = _parse_sizes(os.getenv("CMA_THUMB_SIZES", "256,1024"))
+QUALITY = int(os.getenv("CMA_THUMB_QUALITY", "80"))
+PDF_DPI = int(os.getenv("CMA_THUMB_PDF_DPI", "100"))
+FORMAT = "webp" if pil_features.check("webp") else "jpg"
+THUMB_SIZE = min(SIZES)    # 一覧のサムネイル
+PREVIEW_SIZE = max(SIZES)  # 詳細画面のプレビュー
+
+IMAGE_EXT = {"png", "jpg", "jpeg"}
+_MIME = {"webp": "image/webp", "jpg": "image/jpeg", "png": "image/png"}
+_DECODE_ERRORS = (OSError, Image.DecompressionBombError, UnidentifiedImageError)  # 壊れた・巨大すぎる画像
+_locks: Dict[str, List] = {}  # sha → [生成中のロック, 待機・使用中の数]（0になったら削除）
+_locks_guard = threading.Lock()
+
+
+@lru_cache(maxsize=1024)
+def _sha(path: str, mtime_ns: int, size: int) -> str:
+    return file_sha256(Path(path))
+
+
+def content_hash(p: Path) -> str:
+    """元ファイルの sha256（パス・更新時刻・サイズが同じ間は再計算しない）"""
+    st = p.stat()
+    return _sha(str(p), st.st_mtime_ns, st.st_size)
+
+
+def supported(p: Path) -> bool:
+    ext = p.suffix.lower().lstrip(".")
+    return ext in IMAGE_EXT or (ext == "pdf" and shutil.which("pdftoppm") is not None)
+
+
+def _readable(p: Path) -> bool:
+    """Pillow が画像として開けるか（ヘッダのみ読む）"""
+    try:
+        with Image.open(p):
+            return True
+    except _DECODE_ERRORS:
+        return False
+
+
+def register(p: Path) -> Optional[str]:
+    """派生画像を作れるファイルなら sha256 を返し、遅延生成用に元ファイルの場所を記録する。"""
+    if not supported(p) or (p.suffix.lower().lstrip(".") in IMAGE_EXT and not _readable(p)):
+        return None
+    sha = content_hash(p)
+    d = DERIVED_DIR / sha
+    d.mkdir(parents=True, exist_ok=True)
+    src = d / "source"
+    if not src.exists() or src.read_text(encoding="utf-8") != str(p):
+        _atomic_write(src, str(p).encode("utf-8"))
+    return sha
+
+
+def name_for(size: int) -> str:
+    return f"{size}.{FORMAT}"
+
+
+def mimetype(name: str) -> str:
+    return _MIME.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+def _atomic_write(dst: Path, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, dst)
+
+
+@contextmanager
+def _lock(sha: str) -> Iterator[None]:
+    with _locks_guard:
+        entry = _locks.setdefault(sha, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _locks.pop(sha, None)
+
+
+def _parse_name(name: str) -> Optional[Tuple[str, Optional[int]]]:
+    """"256.webp" → ("thumb", 256)、"page1.png" → ("page1", None)。未知の名前は None。"""
+    if name == "page1.png":
+        return "page1", None
+    stem, _, ext = name.partition(".")
+    if ext == FORMAT and stem.isdigit() and int(stem) in SIZES:
+        return "thumb", int(stem)
+    return None
+
+
+def _source(sha: str) -> Optional[Path]:
+    """記録された元ファイル（内容が変わっていれば None）"""
+    ref = DERIVED_DIR / sha / "source"
+    if not ref.exists():
+        return None
+    p = Path(ref.read_text(encoding="utf-8"))
+    if not p.exists() or content_hash(p) != sha:
+        return None
+    return p
+
+
+@timed("thumbnails.pdf_page1")
+def _render_pdf_page1(src: Path, dst: Path) -> bool:
+    exe = shutil.which("pdftoppm")
+    if exe is None:
+        return False
+    with tempfile.TemporaryDirectory(dir=dst.parent) as tmp:
+        out = Path(tmp) / "page"
+        try:
+            subprocess.run([exe, "-png", "-f", "1", "-l", "1", "-r", str(PDF_DPI), "-singlefile", str(src), str(out)],
+                           check=True, capture_output=True, timeout=60)
+        except (OSError, subprocess.SubprocessError):
+            return False
+        os.replace(out.with_suffix(".png"), dst)
+    return True
+
+
+@timed("thumbnails.resize")
+def _render_thumb(src: Path, dst: Path, size: int) -> None:
+    with Image.open(src) as im:
+        im.draft("RGB", (size, size))  # JPEG は縮小デコードで読み込みを軽くする
+        im = im.convert("RGBA" if FORMAT == "webp" and im.mode in ("RGBA", "LA", "P") else "RGB")
+        im.thumbnail((size, size), Image.LANCZOS)
+        fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=".tmp", suffix=dst.suffix)
+        os.close(fd)
+        try:
+            if FORMAT == "webp":
+                im.save(tmp, "WEBP", quality=QUALITY, method=4)
+            else:
+                im.save(tmp, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+            os.replace(tmp, dst)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def derive(sha: str, name: str) -> Optional[Path]:
+    """派生画像のパス。未作成なら作る。作れない（未知の名前・元ファイルなし・変換不可）なら None。"""
+    kind = _parse_name(name)
+    if kind is None or len(sha) != 64 or not all(c in "0123456789abcdef" for c in sha):
+        return None
+    dst = DERIVED_DIR / sha / name
+    if dst.exists():
+        return dst
+    with _lock(sha):
+        if dst.exists():
+            return dst
+        src = _source(sha)
+        if src is None:
+            return None
+        if src.suffix.lower() == ".pdf":
+            page1 = DERIVED_DIR / sha / "page1.png"
+            if not page1.exists() and not _render_pdf_page1(src, page1):
+                return None
+            src = page1
+        if kind[0] == "thumb":
+            try:
+                _render_thumb(src, dst, kind[1])
+            except _DECODE_ERRORS:
+                return None
+    return dst if dst.exists() else None
@@ -0,0 +1,46 @@
+"""PDFレポート生成の計測（1k件のマッチ表）
+
+    python -m bench.bench_report_pdf [--matches 1000] [--repeat 3]
+"""
+import argparse
+import json
+import time
+
+from app.services import report_generation as rg
+from bench.synthetic import make_report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--matches", type=int, default=1000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+    f, steps, matches = make_report(args.matches)
+
+    t0 = time.perf_counter()
+    first = rg.render_report_pdf(f, steps, matches)
+    cold = time.perf_counter() - t0
+
+    warm = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        rg.render_report_pdf(f, steps, matches)
+        warm.append(time.perf_counter() - t0)
+
+    fp = rg.report_fingerprint(f, steps, matches)
+    rg.render_report_pdf_cached(f, steps, matches, fingerprint=fp)
+    t0 = time.perf_counter()
+    rg.render_report_pdf_cached(f, steps, matches)
+    cached = time.perf_counter() - t0
+
+    print(json.dumps({
+        "matches": args.matches,
+        "pdf_bytes": len(first),
+        "cold_sec": round(cold, 4),
+        "warm_min_sec": round(min(warm), 4),
+        "cached_sec": round(cached, 5),
+    }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
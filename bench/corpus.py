@@ -0,0 +1,16 @@
+"""samples/ の図面をOCR/PDF/DXFコーパスとして扱う。"""
+from pathlib import Path
+from typing import Dict, List
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / "samples"
+
+
+def sample_files() -> List[Path]:
+    return sorted(p for p in SAMPLES_DIR.iterdir() if p.is_file() and not p.name.startswith("."))
+
+
+def by_ext() -> Dict[str, List[Path]]:
+    out: Dict[str, List[Path]] = {}
+    for p in sample_files():
+        out.setdefault(p.suffix.lower().lstrip("."), []).append(p)
+    return out
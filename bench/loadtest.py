@@ -0,0 +1,218 @@
+"""4ステップ（/analyze → /process/ui → /match/ui → /assignments/save）の負荷試験
+
+    # 起動済みのサーバに対して実行
+    python -m bench.loadtest --base-url http://127.0.0.1:8000 --users 8 --iterations 5
+
+    # モックLLMとアプリをこのプロセス内で起動して実行（一時DB/一時アップロード先を使用）
+    python -m bench.loadtest --spawn --users 8 --iterations 5 --mock-latency lognormal:0.8,0.5 --mock-error-rate 0.02
+
+仮想ユーザーごとに Cookie を分けて samples/ の図面を順に流し、ステップ別のレイテンシ
+（p50/p90/p99）とフロー全体のスループットを表示する。サーバは直前の解析結果を
+プロセス共有で保持するため、同時実行では他ユーザーの工程が混ざる場合がある。
+"""
+import argparse
+import json
+import mimetypes
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bench.corpus import sample_files
+
+STEPS = ("analyze", "process", "match", "save")
+
+
+def _multipart(field: str, p: Path) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    ctype = mimetypes.guess_type(p.name)[0] or "application/octet-stream"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{p.name}\"\r\n"
+            f"Content-Type: {ctype}\r\n\r\n").encode("utf-8")
+    return head + p.read_bytes() + f"\r\n--{boundary}--\r\n".encode("ascii"), f"multipart/form-data; boundary={boundary}"
+
+
+class User:
+    def __init__(self, base_url: str, fast: bool, timeout: float):
+        self.base = base_url.rstrip("/")
+        self.fast = fast
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def _req(self, path: str, data: Optional[bytes] = None, ctype: Optional[str] = None) -> Tuple[int, bytes]:
+        req = urllib.request.Request(self.base + path, data=data, method="POST" if data is not None else "GET")
+        if ctype:
+            req.add_header("Content-Type", ctype)
+        if self.fast:
+            req.add_header("X-CMA-Fast", "1")
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def _json(self, path: str, body: Dict) -> Tuple[int, bytes]:
+        return self._req(path, json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def flow(self, p: Path, record) -> bool:
+        """1図面分の4ステップを実行する。途中で失敗したら False。"""
+        t0 = time.perf_counter()
+        status, body = self._req("/analyze", *_multipart("file", p))
+        record("analyze", time.perf_counter() - t0, status)
+        if status != 200:
+            return False
+        filename = json.loads(body).get("filename") or p.name
+
+        t0 = time.perf_counter()
+        status, body = self._json("/process/ui", {"filename": filename})
+        record("process", time.perf_counter() - t0, status)
+        if status != 200:
+            return False
+        task = re.search(r'<td>\d+</td><td>([^<]+)</td>', body.decode("utf-8", "replace"))
+
+        t0 = time.perf_counter()
+        status, body = self._json("/match/ui", {})
+        record("match", time.perf_counter() - t0, status)
+        if status != 200:
+            return False
+        company = re.search(r'data-id="(\d+)"', body.decode("utf-8", "replace"))
+        if not company:
+            return True  # 該当企業なし（保存はスキップ）
+
+        t0 = time.perf_counter()
+        status, _ = self._json("/assignments/save", {
+            "task": task.group(1).strip() if task else "荒加工", "company_id": int(company.group(1)), "drawing_file": filename,
+        })
+        record("save", time.perf_counter() - t0, status)
+        return status == 200
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lat: Dict[str, List[float]] = {k: [] for k in STEPS + ("flow",)}
+        self.errors: Dict[str, int] = {k: 0 for k in STEPS + ("flow",)}
+
+    def __call__(self, step: str, seconds: float, status: int = 200) -> None:
+        with self.lock:
+            self.lat[step].append(seconds)
+            if status >= 400:
+                self.errors[step] += 1
+
+
+def percentile(xs: Sequence[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    s = sorted(xs)
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def run(base_url: str, files: Sequence[Path], users: int, iterations: int, fast: bool = False, timeout: float = 120.0) -> Dict:
+    rec = Recorder()
+
+    def worker(u: int) -> None:
+        user = User(base_url, fast, timeout)
+        for i in range(iterations):
+            p = files[(u * iterations + i) % len(files)]
+            t0 = time.perf_counter()
+            try:
+                ok = user.flow(p, rec)
+            except Exception as e:
+                print(f"user {u}: {type(e).__name__}: {e}", file=sys.stderr)
+                ok = False
+            rec("flow", time.perf_counter() - t0, 200 if ok else 599)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as ex:
+        list(ex.map(worker, range(users)))
+    wall = time.perf_counter() - t0
+
+    flows = len(rec.lat["flow"])
+    report = {"users": users, "iterations": iterations, "fast": fast, "wall_sec": round(wall, 3),
+              "flows": flows, "flows_per_sec": round(flows / wall, 3) if wall else 0.0, "steps": {}}
+    for step in STEPS + ("flow",):
+        xs = rec.lat[step]
+        report["steps"][step] = {
+            "count": len(xs), "errors": rec.errors[step],
+            "mean_ms": round(statistics.fmean(xs) * 1000, 1) if xs else 0.0,
+            "p50_ms": round(percentile(xs, 0.50) * 1000, 1),
+            "p90_ms": round(percentile(xs, 0.90) * 1000, 1),
+            "p99_ms": round(percentile(xs, 0.99) * 1000, 1),
+        }
+    return report
+
+
+def print_report(r: Dict) -> None:
+    print(f"users={r['users']} iterations={r['iterations']} fast={r['fast']}  "
+          f"{r['flows']} flows in {r['wall_sec']:.1f}s  ({r['flows_per_sec']:.2f} flows/s)")
+    print(f"{'step':<10}{'count':>7}{'errors':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}  (ms)")
+    for step, s in r["steps"].items():
+        print(f"{step:<10}{s['count']:>7}{s['errors']:>8}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}{s['p90_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+
+
+def spawn(mock_latency: str, mock_error_rate: float, seed: int, tmp: Path) -> str:
+    """モックLLMとアプリ（一時DB/一時アップロード先）をバックグラウンドで起動し、アプリのURLを返す。"""
+    from bench import mock_llm
+    mock = mock_llm.serve("127.0.0.1", 0, mock_latency, mock_error_rate, seed, background=True)
+    os.environ.update(OPENAI_API_KEY="mock", OPENAI_BASE_URL=f"http://127.0.0.1:{mock.server_address[1]}/v1",
+                      OPENAI_MODEL=os.getenv("OPENAI_MODEL", "mock"))
+    for k in ("AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"):
+        os.environ.pop(k, None)
+
+    import logging
+    from werkzeug.serving import make_server
+    from app import server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    from app.db import company_db
+    db = tmp / "companies.sqlite"
+    shutil.copy(company_db.DB_PATH, db)
+    company_db.DB_PATH = db
+    server.UPLOAD_DIR = tmp / "uploads"
+    server.UPLOAD_DIR.mkdir()
+    httpd = make_server("127.0.0.1", 0, server.create_app(), threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="cma-loadtest-app").start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.loadtest")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--spawn", action="store_true", help="モックLLMとアプリをこのプロセス内で起動する")
+    ap.add_argument("--users", type=int, default=4, help="同時ユーザー数")
+    ap.add_argument("--iterations", type=int, default=3, help="ユーザーあたりのフロー回数")
+    ap.add_argument("--files", nargs="*", type=Path, help="既定: samples/ の図面")
+    ap.add_argument("--fast", action="store_true", help="X-CMA-Fast を付けてルールのみで処理させる")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--mock-latency", default="lognormal:0.8,0.5")
+    ap.add_argument("--mock-error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", type=Path, help="結果をJSONで保存")
+    args = ap.parse_args(argv)
+
+    files = args.files or sample_files()
+    if not files:
+        ap.error("図面がありません（--files を指定してください）")
+    with tempfile.TemporaryDirectory() as tmp:
+        base = spawn(args.mock_latency, args.mock_error_rate, args.seed, Path(tmp)) if args.spawn else args.base_url
+        report = run(base, files, args.users, args.iterations, args.fast, args.timeout)
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 1 if report["steps"]["flow"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""決定的なローカル OpenAI 互換モックサーバ（chat.completions / responses）
+
+    python -m bench.mock_llm --port 8900 --latency lognormal:0.8,0.5 --error-rate 0.02 --seed 1
+    export OPENAI_API_KEY=dummy OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_MODEL=mock
+
+図面解析 / 工程分解 / 企業マッチング の各プロンプトを system メッセージで判別し、
+スキーマどおりの JSON を返す。応答内容はプロンプトのハッシュから決まり、遅延とエラーは
+--seed で固定した乱数列に従う。
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """fixed:S / uniform:A,B / normal:MU,SD / lognormal:MEDIAN,SIGMA（秒）"""
+    kind, _, args = spec.partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()] if args else []
+    if kind == "fixed":
+        return lambda r: vals[0] if vals else 0.0
+    if kind == "uniform":
+        return lambda r: r.uniform(vals[0], vals[1])
+    if kind == "normal":
+        return lambda r: max(0.0, r.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        import math
+        mu = math.log(vals[0])
+        return lambda r: r.lognormvariate(mu, vals[1])
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+_MATERIALS = ("SUS304", "SUS316", "AL6061", "SS400", "FC250", "真鍮", "チタン")
+_PARTS = ("フランジ", "ブラケット", "シャフト", "プレート", "ハウジング", "ギア")
+
+
+def _h(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def canned(system: str, user: str) -> Tuple[str, str]:
+    """(用途, 応答本文) を返す。"""
+    h = _h(system + "\n" + user)
+    if "図面解析" in system:
+        m = re.search(r"ファイル名:\s*(\S+)", user)
+        name = m.group(1) if m else ""
+        material = next((x for x in _MATERIALS if x[:2] in name), _MATERIALS[h % len(_MATERIALS)])
+        part = next((x for x in _PARTS if x in name), _PARTS[(h >> 4) % len(_PARTS)])
+        return "diagram", json.dumps({
+            "title": f"{part} 図面", "drawing_no": f"MOCK-{h % 10000:04d}", "part_type": part, "material": material,
+            "surface_finish": ("Ra1.6", "Ra3.2", "Ra0.8")[h % 3], "tolerances": ["±0.05", "H7"][: 1 + h % 2],
+            "recommended_process": ("フライス", "旋盤")[h % 2], "recommended_machine": ("VMC", "NC旋盤")[h % 2],
+        }, ensure_ascii=False)
+    if "工程分解" in system:
+        plans = (
+            [("荒加工", "VMC", 30), ("穴あけ", "タッピングセンタ", 20), ("仕上げ", "VMC", 25), ("検査", "三次元測定機", 10)],
+            [("外径荒削り", "NC旋盤", 25), ("内径仕上げ", "NC旋盤", 20), ("研削", "円筒研削盤", 30)],
+            [("切断", "バンドソー", 10), ("フライス加工", "汎用フライス", 30), ("穴あけ", "ボール盤", 15), ("バリ取り", "バレル研磨機", 10)],
+        )
+        steps = [{"name": n, "machine": m, "minutes": t, "precision": "中"} for n, m, t in plans[h % len(plans)]]
+        return "breakdown", json.dumps(steps, ensure_ascii=False)
+    if "マッチング" in system:
+        return "boost", json.dumps({"boost": round((h % 1000) / 1000.0, 3)})
+    return "other", json.dumps({"ok": True})
+
+
+class MockState:
+    def __init__(self, latency: Callable[[random.Random], float], error_rate: float, seed: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def draw(self) -> Tuple[float, bool]:
+        with self.lock:
+            return self.latency(self.rnd), self.rnd.random() < self.error_rate
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):  # 標準エラーへのアクセスログを抑止
+            pass
+
+        def _send(self, code: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                return self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+            if self.path.rstrip("/").endswith("/stats"):
+                return self._send(200, {"counts": dict(state.counts)})
+            self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                req = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._send(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path.endswith("/chat/completions"):
+                msgs = req.get("messages") or []
+                system = next((m.get("content", "") for m in msgs if m.get("role") == "system"), "")
+                user = next((m.get("content", "") for m in msgs if m.get("role") == "user"), "")
+                api = "chat"
+            elif path.endswith("/responses"):
+                text = str(req.get("input") or "")
+                system, _, user = text.partition("\nUser: ")
+                system = system.replace("System: ", "", 1)
+                api = "responses"
+            else:
+                return self._send(404, {"error": {"message": "not found"}})
+
+            delay, fail = state.draw()
+            time.sleep(delay)
+            kind, content = canned(system, user)
+            state.count(f"{api}:{kind}:{'error' if fail else 'ok'}")
+            if fail:
+                return self._send(500, {"error": {"message": "mock injected failure", "type": "server_error"}})
+            model = req.get("model") or "mock"
+            usage_in = max(1, (len(system) + len(user)) // 2)
+            usage_out = max(1, len(content) // 2)
+            if api == "chat":
+                body = {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": usage_in, "completion_tokens": usage_out, "total_tokens": usage_in + usage_out},
+                }
+            else:
+                body = {
+                    "id": f"resp_{uuid.uuid4().hex[:12]}", "object": "response", "created_at": int(time.time()),
+                    "model": model, "status": "completed",
+                    "output": [{"type": "message", "id": f"msg_{uuid.uuid4().hex[:12]}", "status": "completed", "role": "assistant",
+                                "content": [{"type": "output_text", "text": content, "annotations": []}]}],
+                    "usage": {"input_tokens": usage_in, "output_tokens": usage_out, "total_tokens": usage_in + usage_out},
+                }
+            self._send(200, body)
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8900, latency: str = "fixed:0", error_rate: float = 0.0,
+          seed: int = 0, background: bool = False) -> Optional[ThreadingHTTPServer]:
+    state = MockState(parse_latency(latency), error_rate, seed)
+    httpd = ThreadingHTTPServer((host, port), make_handler(state))
+    httpd.daemon_threads = True
+    if background:
+        threading.Thread(target=httpd.serve_forever, daemon=True, name="cma-mock-llm").start()
+        return httpd
+    print(f"mock LLM on http://{host}:{httpd.server_address[1]}/v1 (latency={latency}, error_rate={error_rate}, seed={seed})", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return None
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.mock_llm")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:A,B | normal:MU,SD | lognormal:MEDIAN,SIGMA")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500 を返す割合")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    serve(args.host, args.port, args.latency, args.error_rate, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
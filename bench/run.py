@@ -0,0 +1,399 @@
+"""マイクロベンチマーク・スイート
+
+    python -m bench.run [--sizes 1k,10k] [--only match] [--save-baseline] [--threshold 0.25]
+
+合成企業DB（1k/10k/100k件）・合成工程リスト・samples/ の図面を使って主要処理を計測する。
+結果は bench/results/latest.json に保存し、bench/baseline.json（--save-baseline で作成）と
+比較して中央値が threshold 以上遅くなったものを REGRESSION として報告する（終了コード1）。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# LLMは計測対象外（ネットワーク待ちでぶれるため）。import前に無効化する
+for _k in ("OPENAI_API_KEY", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"):
+    os.environ.pop(_k, None)
+
+from app.db import company_db  # noqa: E402
+from app.services import report_generation as rg  # noqa: E402
+from app.services.alliance import propose  # noqa: E402
+from app.services.assignment_solver import Job, solve as solve_assignments  # noqa: E402
+from app.services.company_matching import ScoreMatrix, _matrix_cache, match_companies  # noqa: E402
+from app.services.diagram_analysis import analyze_file  # noqa: E402
+from app.services.dimension_extract import extract as extract_dimensions  # noqa: E402
+from app.services.dxf_reader import read_dxf  # noqa: E402
+from app.services.envelope import PartSize  # noqa: E402
+from app.services.geo import GridIndex, origin_of  # noqa: E402
+from app.services.task_mapping import _CATS, classify_machine  # noqa: E402
+from app.services.text_index import NgramIndex  # noqa: E402
+from app.services.thumbnails import FORMAT as THUMB_FORMAT, IMAGE_EXT, _render_thumb  # noqa: E402
+from bench.corpus import sample_files  # noqa: E402
+from bench.synthetic import SIZES, make_dxf, make_ocr_text, make_report, make_steps, populate_db  # noqa: E402
+
+BENCH_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+DEFAULT_RESULTS = BENCH_DIR / "results" / "latest.json"
+
+
+class Bench:
+    def __init__(self, name: str, fn: Callable[[Dict], Callable[[], object]], sized: bool, repeat: int, number: int):
+        self.name = name
+        self.fn = fn          # ctx -> 計測対象の関数（準備処理は計測外）
+        self.sized = sized    # 企業DBサイズごとに計測するか
+        self.repeat = repeat
+        self.number = number
+
+
+BENCHES: List[Bench] = []
+
+
+def bench(name: str, sized: bool = False, repeat: int = 5, number: int = 1):
+    def deco(fn):
+        BENCHES.append(Bench(name, fn, sized, repeat, number))
+        return fn
+    return deco
+
+
+# ---- 企業マッチング / 分類 ----
+
+@bench("match_companies", sized=True, repeat=3)
+def _b_match(ctx):
+    steps = make_steps(5, seed=1)
+    return lambda: match_companies(steps)
+
+
+@bench("score_matrix[build]", sized=True, repeat=3)
+def _b_matrix_build(ctx):
+    steps = make_steps(5, seed=1)
+    companies = company_db.fetch_all()
+    return lambda: ScoreMatrix(companies, steps)
+
+
+def _cold_match(part):
+    # 行列キャッシュを毎回クリアしてスコア計算まで計測する
+    steps = make_steps(5, seed=1)
+
+    def run():
+        _matrix_cache.clear()
+        return match_companies(steps, part=part)
+    return run
+
+
+@bench("match_companies[cold]", sized=True, repeat=3)
+def _b_match_cold(ctx):
+    return _cold_match(None)
+
+
+@bench("match_companies[cold, part 1200x600]", sized=True, repeat=3)
+def _b_match_part(ctx):
+    return _cold_match(PartSize((1200.0, 600.0, 50.0)))
+
+
+@bench("alliance", sized=True, repeat=3)
+def _b_alliance(ctx):
+    steps = make_steps(8, seed=2)
+    companies = company_db.fetch_all()
+    scores = [((c.id * 2654435761) % 1000) / 1000 for c in companies]
+    return lambda: propose([s.machine for s in steps], companies, scores)
+
+
+@bench("assignment_solver", sized=True, repeat=3)
+def _b_assignment_solver(ctx):
+    jobs = [Job(f"d{i}.pdf", make_steps(5, seed=i % 50)) for i in range(500)]
+    companies = company_db.fetch_all()
+    return lambda: solve_assignments(jobs, companies=companies)
+
+
+@bench("text_index.query", sized=True, repeat=5)
+def _b_text_index(ctx):
+    index = NgramIndex()
+    index.sync()
+    index.query("")  # ノルム計算は計測外
+    text = ScoreMatrix([], make_steps(5, seed=1)).query_text()
+    return lambda: index.query(text, 5)
+
+
+@bench("geo.within", sized=True, repeat=5, number=20)
+def _b_geo_within(ctx):
+    index = GridIndex(company_db.fetch_all())
+    hub = origin_of(None)
+    return lambda: index.within(hub, 20.0)
+
+
+@bench("classify_machine", number=200)
+def _b_classify(ctx):
+    machines = [m for c in _CATS for m in c.machines] + ["unknown machine", "5軸マシニング", "CNC lathe 2"]
+    return lambda: [classify_machine(m) for m in machines]
+
+
+# ---- 図面解析（samples/ コーパス） ----
+
+@bench("analyze_file[samples]", repeat=3)
+def _b_analyze(ctx):
+    files = sample_files()
+    return lambda: [analyze_file(p) for p in files]
+
+
+@bench("thumbnail[samples, 256px]", repeat=3)
+def _b_thumbnail(ctx):
+    files = [p for p in sample_files() if p.suffix.lower().lstrip(".") in IMAGE_EXT]
+    out = Path(company_db.DB_PATH).parent
+
+    def run():
+        for i, p in enumerate(files):
+            _render_thumb(p, out / f"thumb_{i}.{THUMB_FORMAT}", 256)
+    return run
+
+
+def _legacy_dims(text: str):
+    """dimension_extract 導入前に build_features が行っていた寸法/公差/粗さ判定の写し（比較用）。
+    記号の有無・Ra の正規表現・固定の公差トークンの部分一致だけで、値は抽出しない。"""
+    import re
+    dims_text = None
+    for token in ["φ", "±", "R", "mm", "+0", "-0"]:
+        if token in text:
+            dims_text = "...寸法表記を検出..."
+            break
+    surface_finish = None
+    if any(k in text for k in ["Ra", "RA", "ｒａ"]):
+        m = re.search(r"R[aA]\s*\d+(?:\.\d+)?", text)
+        if m:
+            surface_finish = m.group(0)
+    tol_list = [tok for tok in ["±0.01", "±0.02", "±0.05", "±0.1", "±0.20", "H7"] if tok in text]
+    return dims_text, surface_finish, tol_list
+
+
+def _ocr_corpus():
+    # 1図面 = 40行 × 500図面
+    return [make_ocr_text(40, seed=i) for i in range(500)]
+
+
+@bench("dims.legacy[ocr500]", repeat=3)
+def _b_dims_legacy(ctx):
+    docs = _ocr_corpus()
+    return lambda: [_legacy_dims(t) for t in docs]
+
+
+@bench("dims.extract[ocr500]", repeat=3)
+def _b_dims_extract(ctx):
+    docs = _ocr_corpus()
+    return lambda: [extract_dimensions(t) for t in docs]
+
+
+@bench("dxf_reader[100k entities]", repeat=3)
+def _b_dxf(ctx):
+    # 約11MB。ファイルは一時DBと同じディレクトリに作る
+    path = Path(company_db.DB_PATH).parent / "bench.dxf"
+    make_dxf(path, 100_000)
+    return lambda: read_dxf(path)
+
+
+@bench("breakdown_process[plan library hit]", number=100)
+def _b_plan_hit(ctx):
+    from app.services import process_plans
+    from app.services.diagram_analysis import Features
+    from app.services.process_breakdown import breakdown_process
+    features = Features(filename="bench.png", ext="png", material="SUS", part_type="フランジ", dims_text="φ80")
+    process_plans.store(process_plans.key_of(features), make_steps(5))
+    return lambda: breakdown_process(features)
+
+
+# ---- 一覧ページ（条件付きGET・描画済みページキャッシュ） ----
+
+def _page_client():
+    from app.server import create_app
+    return create_app().test_client()
+
+
+@bench("page /companies[render]", sized=True, repeat=3)
+def _b_page_render(ctx):
+    client = _page_client()
+    # クエリ文字列を毎回変えてキャッシュを外す
+    counter = iter(range(1 << 30))
+    return lambda: client.get(f"/companies?n={next(counter)}")
+
+
+@bench("page /companies[cached]", sized=True, repeat=5, number=10)
+def _b_page_cached(ctx):
+    client = _page_client()
+    client.get("/companies")
+    return lambda: client.get("/companies")
+
+
+@bench("page /companies[304]", sized=True, repeat=5, number=10)
+def _b_page_304(ctx):
+    client = _page_client()
+    etag = client.get("/companies").headers["ETag"]
+    return lambda: client.get("/companies", headers={"If-None-Match": etag})
+
+
+@bench("page /match/ui[warm]", sized=True, repeat=3)
+def _b_page_match(ctx):
+    client = _page_client()
+    client.application.config["last_steps"] = make_steps(6)
+    client.get("/match/ui?task=milling")
+    return lambda: client.get("/match/ui?task=milling")
+
+
+# ---- company_db クエリ ----
+
+@bench("db.fetch_all", sized=True, repeat=3)
+def _b_fetch_all(ctx):
+    return company_db.fetch_all
+
+
+@bench("db.fetch_by_id", sized=True, number=100)
+def _b_fetch_by_id(ctx):
+    n = ctx["n"]
+    return lambda: [company_db.fetch_by_id(1 + (i * 7919) % n) for i in range(10)]
+
+
+@bench("db.search_by_text", sized=True, repeat=3)
+def _b_search(ctx):
+    return lambda: company_db.search_by_text("タップ")
+
+
+@bench("db.fetch_page[category, 50]", sized=True, number=20)
+def _b_fetch_page(ctx):
+    from app.services.task_mapping import keywords_for_category
+    words = keywords_for_category("turning")
+    return lambda: company_db.fetch_page(ctx["n"] // 2, 50, any_of=words)
+
+
+@bench("db.fetch_assignments", sized=True, repeat=3)
+def _b_assignments(ctx):
+    return company_db.fetch_assignments
+
+
+@bench("db.fetch_assignment_files", sized=True, repeat=3)
+def _b_assignment_files(ctx):
+    return company_db.fetch_assignment_files
+
+
+@bench("db.fetch_assignments_for_file", sized=True, number=20)
+def _b_assignments_for_file(ctx):
+    return lambda: company_db.fetch_assignments_for_file("drawing_0042.png")
+
+
+# ---- レポート生成（1kマッチ） ----
+
+@bench("render_report_html[1k]", repeat=3)
+def _b_html(ctx):
+    f, steps, matches = make_report(1000)
+    return lambda: rg.render_report_html(f, steps, matches)
+
+
+@bench("render_report_docx[1k]", repeat=3)
+def _b_docx(ctx):
+    f, steps, matches = make_report(1000)
+    return lambda: rg.render_report_docx(f, steps, matches)
+
+
+@bench("render_report_pdf[1k]", repeat=3)
+def _b_pdf(ctx):
+    f, steps, matches = make_report(1000)
+    rg.render_report_pdf(f, steps, matches)  # フォント登録を計測から除外
+    return lambda: rg.render_report_pdf(f, steps, matches)
+
+
+@bench("render_assignments_docx[200]", repeat=3)
+def _b_assign_docx(ctx):
+    items = [{"id": i, "task_name": f"工程{i}", "company_name": f"企業{i}", "created_at": "2025-07-11 00:00:00"} for i in range(200)]
+    return lambda: rg.render_assignments_docx("drawing.png", items)
+
+
+# ---- 実行/比較 ----
+
+def _time(run: Callable[[], object], repeat: int, number: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - t0) / number)
+    return {"min": min(samples), "median": statistics.median(samples), "repeat": repeat, "number": number}
+
+
+def run_all(sizes: List[str], only: Optional[str]) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    selected = [b for b in BENCHES if not only or only in b.name]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_default = Path(tmp) / "bench_default.sqlite"
+        populate_db(db_default, SIZES["1k"], n_assignments=1000)
+        for b in (b for b in selected if not b.sized):
+            company_db.DB_PATH = db_default
+            results[b.name] = _time(b.fn({"n": SIZES["1k"]}), b.repeat, b.number)
+            _report(b.name, results[b.name])
+        for size in sizes:
+            n = SIZES[size]
+            sized = [b for b in selected if b.sized]
+            if not sized:
+                continue
+            db = Path(tmp) / f"bench_{size}.sqlite"
+            populate_db(db, n, n_assignments=n)
+            for b in sized:
+                key = f"{b.name}[{size}]"
+                # 大きなDBでは繰り返し回数を抑える
+                repeat = b.repeat if n <= 10_000 else 1
+                results[key] = _time(b.fn({"n": n}), repeat, b.number)
+                _report(key, results[key])
+    return results
+
+
+def _report(name: str, r: Dict[str, float]) -> None:
+    print(f"{name:<40} median {r['median'] * 1000:10.3f} ms   min {r['min'] * 1000:10.3f} ms", flush=True)
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or base.get("median", 0) <= 0:
+            continue
+        ratio = r["median"] / base["median"]
+        flag = "REGRESSION" if ratio > 1 + threshold else ("improved" if ratio < 1 - threshold else "ok")
+        print(f"{name:<40} {ratio:6.2f}x baseline  {flag}")
+        if flag == "REGRESSION":
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.run")
+    ap.add_argument("--sizes", default="1k,10k", help="企業DBサイズ（1k,10k,100k）")
+    ap.add_argument("--only", help="名前に含まれる文字列で絞り込み")
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--out", type=Path, default=DEFAULT_RESULTS)
+    ap.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存")
+    ap.add_argument("--threshold", type=float, default=0.25, help="回帰とみなす中央値の悪化率")
+    args = ap.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        ap.error(f"unknown size: {', '.join(unknown)}")
+    results = run_all(sizes, args.only)
+    doc = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"baseline saved: {args.baseline}")
+        return 0
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")).get("results", {})
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
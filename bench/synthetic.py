@@ -0,0 +1,171 @@
+"""ベンチマーク用の合成データ（企業DB・工程リスト・レポート）"""
+import json
+import random
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from app.db import company_db
+from app.db.company_db import CompanyRow
+from app.services.company_matching import Match
+from app.services.diagram_analysis import Features
+from app.services.process_breakdown import ProcessStep
+from app.services.task_mapping import _CATS, classify_machine
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+
+_MATERIALS = ("SUS304", "SUS316", "ステンレス", "AL6061", "アルミ", "SS400", "S45C", "FC250", "真鍮", "チタン", "aluminum", "stainless")
+_PARTS = ("フランジ", "ブラケット", "シャフト", "プレート", "ケース", "ハウジング", "ギア", "flange", "bracket", "shaft")
+_NOTES = (
+    "小ロット歓迎。", "短納期対応可。", "薄肉注意。", "量産対応。", "ISO9001取得。", "試作から量産まで一貫対応。",
+    "精密加工の実績豊富。", "high precision", "prototype friendly", "24h operation", "ねじ穴加工の実績豊富。",
+)
+_PREFIX = ("大田", "蒲田", "川崎", "横浜", "品川", "羽田", "東京", "相模", "多摩", "城南")
+_SUFFIX = ("精機", "製作所", "工業", "精工", "テック", "マシナリー", "工作所", "Engineering")
+_LOCATIONS = ("Tokyo", "Kawasaki", "Yokohama", "大田区", "品川区", "川崎市", "横浜市", "相模原市", "さいたま市")
+_CAPACITY = ("Low", "Medium", "High")
+
+
+def make_companies(n: int, seed: int = 0) -> List[Tuple[str, str, str, str, str, str]]:
+    """(name, machines, skills, notes, capacity, location) のタプルを n 件生成する。"""
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        cats = rnd.sample(_CATS, k=rnd.randint(1, 3))
+        machines = sorted({rnd.choice(c.machines) for c in cats for _ in range(rnd.randint(1, 2))})
+        skills = [rnd.choice(c.synonyms) for c in cats] + rnd.sample(_MATERIALS, 2) + [rnd.choice(_PARTS)]
+        notes = "".join(rnd.sample(_NOTES, 2)) + rnd.choice(cats[0].synonyms)
+        name = f"{rnd.choice(_PREFIX)}{rnd.choice(_SUFFIX)}{i:06d}"
+        rows.append((name, ",".join(machines), ",".join(skills), notes, rnd.choice(_CAPACITY), rnd.choice(_LOCATIONS)))
+    return rows
+
+
+def make_envelopes(machines: str, rnd: random.Random) -> Optional[str]:
+    """フライス系・旋削系の装置に加工可能範囲を付ける（約3割の企業は未登録）"""
+    if rnd.random() < 0.3:
+        return None
+    out = {}
+    for m in machines.split(","):
+        key = classify_machine(m)
+        if key == "milling":
+            x = rnd.choice((400, 500, 800, 1000, 1500, 2000))
+            out[m] = {"x": x, "y": x // 2, "z": x // 2}
+        elif key == "turning":
+            out[m] = {"dia": rnd.choice((150, 250, 400, 600)), "length": rnd.choice((300, 500, 1000))}
+    return json.dumps(out, ensure_ascii=False) if out else None
+
+
+def populate_db(path: Path, n: int, n_assignments: int = 0, seed: int = 0) -> None:
+    """path に合成企業DBを作成し、company_db の接続先を切り替える。"""
+    if path.exists():
+        path.unlink()
+    company_db.DB_PATH = path
+    company_db.init_db(seed=False)
+    with company_db._conn() as con:
+        rows = make_companies(n, seed)
+        rnd = random.Random(seed + 2)
+        con.executemany(
+            "INSERT INTO companies(name,machines,skills,notes,capacity,location,envelopes) VALUES(?,?,?,?,?,?,?)",
+            [r + (make_envelopes(r[1], rnd),) for r in rows],
+        )
+        if n_assignments:
+            rnd = random.Random(seed + 1)
+            con.executemany(
+                "INSERT INTO assignments(task_name, company_id, drawing_file) VALUES(?,?,?)",
+                [(f"工程{i % 7}", rnd.randint(1, n), f"drawing_{i % 200:04d}.png") for i in range(n_assignments)],
+            )
+
+
+def make_steps(n: int, seed: int = 0) -> List[ProcessStep]:
+    rnd = random.Random(seed)
+    steps = []
+    for i in range(n):
+        c = rnd.choice(_CATS)
+        steps.append(ProcessStep(
+            name=f"{rnd.choice(c.synonyms)}{i}",
+            machine=rnd.choice(c.machines),
+            minutes=rnd.choice((5, 10, 15, 20, 30, 45)),
+            tolerance=rnd.choice((None, "±0.05", "±0.1", "H7")),
+            precision=rnd.choice(("粗", "中", "仕上", "検査")),
+        ))
+    return steps
+
+
+_OCR_ZEN = str.maketrans("0123456789.+-RaHx", "０１２３４５６７８９．＋－ＲａＨ×")
+_OCR_TOKENS = (
+    lambda r: f"φ{r.choice((6, 8, 10, 12.5, 20, 40, 80))}{r.choice(('', 'H7', 'h6', 'mm'))}",
+    lambda r: f"{r.choice((2, 4, 6))}xφ{r.choice((5.5, 6.6, 9))} 通し",
+    lambda r: f"R{r.choice((0.5, 1, 2, 5, 10))}",
+    lambda r: f"C{r.choice((0.2, 0.5, 1))}",
+    lambda r: f"±{r.choice(('0.01', '0.02', '0.05', '0.1', '0.20'))}",
+    lambda r: f"+0.{r.randint(1, 5):02d}/-0.{r.randint(0, 3):02d}",
+    lambda r: f"Ra{r.choice((0.4, 0.8, 1.6, 3.2, 6.3))}",
+    lambda r: f"Rz{r.choice((3.2, 6.3, 12.5))}",
+    lambda r: f"{r.randint(10, 400)}x{r.randint(10, 300)}x{r.randint(3, 60)}",
+    lambda r: f"{r.randint(5, 500)}mm",
+    lambda r: f"M{r.choice((4, 5, 6, 8, 10))}x{r.choice((0.7, 0.8, 1, 1.25, 1.5))}",
+    lambda r: "H7/g6",
+)
+_OCR_WORDS = ("材質", "SUS304", "A5052", "表面処理", "アルマイト", "図番", "DWG-1234", "尺度 1:2", "注記", "バリなきこと",
+              "指示なき角部", "一般公差 JIS B 0405-m", "REV.A", "承認", "設計", "検図", "|", "—", "ー", "Rev", "SCALE")
+
+
+def make_ocr_text(n_lines: int, seed: int = 0) -> str:
+    """図面OCR結果を模した文字列（寸法表記・注記・ノイズ混在。一部の行は全角化）"""
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        words = [rnd.choice(_OCR_TOKENS)(rnd) if rnd.random() < 0.4 else rnd.choice(_OCR_WORDS) for _ in range(rnd.randint(3, 10))]
+        line = " ".join(words)
+        lines.append(line.translate(_OCR_ZEN) if rnd.random() < 0.3 else line)
+    return "\n".join(lines)
+
+
+def make_dxf(path: Path, n_entities: int, seed: int = 0) -> None:
+    """ASCII DXF（R2010 相当のヘッダ・表題欄の属性・寸法・文字・線/円）を書き出す。"""
+    rnd = random.Random(seed)
+
+    def pairs(*kv):
+        return "".join(f"{k:>3}\n{v}\n" for k, v in kv)
+
+    with open(path, "w", encoding="utf-8", newline="\r\n") as f:
+        f.write(pairs((0, "SECTION"), (2, "HEADER"), (9, "$ACADVER"), (1, "AC1024"), (9, "$INSUNITS"), (70, 4),
+                      (9, "$EXTMIN"), (10, 0.0), (20, 0.0), (30, 0.0), (0, "ENDSEC")))
+        f.write(pairs((0, "SECTION"), (2, "ENTITIES"), (0, "INSERT"), (8, "TITLE"), (2, "TITLEBLOCK"), (10, 0.0), (20, 0.0),
+                      (0, "ATTRIB"), (8, "TITLE"), (10, 10.0), (20, 10.0), (40, 3.5), (1, "ポンプ用フランジ"), (2, "TITLE"),
+                      (0, "ATTRIB"), (8, "TITLE"), (10, 10.0), (20, 20.0), (40, 3.5), (1, "DWG-2024-001"), (2, "DWG_NO"),
+                      (0, "ATTRIB"), (8, "TITLE"), (10, 10.0), (20, 30.0), (40, 3.5), (1, "SUS304"), (2, "MATERIAL"),
+                      (0, "SEQEND"), (8, "TITLE")))
+        for i in range(n_entities):
+            x, y = rnd.uniform(0, 400), rnd.uniform(0, 300)
+            k = i % 10
+            if k < 5:
+                f.write(pairs((0, "LINE"), (5, f"{i:X}"), (8, "0"), (10, f"{x:.6f}"), (20, f"{y:.6f}"), (30, "0.0"),
+                              (11, f"{x + rnd.uniform(-20, 20):.6f}"), (21, f"{y + rnd.uniform(-20, 20):.6f}"), (31, "0.0")))
+            elif k < 8:
+                f.write(pairs((0, "CIRCLE"), (5, f"{i:X}"), (8, "0"), (10, f"{x:.6f}"), (20, f"{y:.6f}"), (30, "0.0"),
+                              (40, rnd.choice((3.3, 5.5, 10.0)))))
+            elif k == 8:
+                f.write(pairs((0, "DIMENSION"), (5, f"{i:X}"), (8, "DIM"), (10, f"{x:.6f}"), (20, f"{y:.6f}"),
+                              (11, f"{x:.6f}"), (21, f"{y + 5:.6f}"), (70, rnd.choice((32, 35, 36))),
+                              (1, rnd.choice(("", "<>H7", "%%c<>", "<>\\S+0.02^-0.01;"))), (42, rnd.choice((10.0, 25.0, 80.0)))))
+            else:
+                f.write(pairs((0, "MTEXT"), (5, f"{i:X}"), (8, "NOTE"), (10, f"{x:.6f}"), (20, f"{y:.6f}"), (40, 2.5),
+                              (1, rnd.choice(("{\\fMS Gothic|b0;指示なき角部}\\PC0.5", "Ra1.6", "一般公差 ±0.1")))))
+        f.write(pairs((0, "ENDSEC"), (0, "EOF")))
+
+
+def make_report(n_matches: int, steps: Sequence[ProcessStep] = ()):
+    f = Features(filename="SUS_フランジ_φ10mm.png", ext="png", material="SUS", part_type="フランジ",
+                 surface_finish="Ra1.6", tolerances=["±0.05", "H7"], recommended_process="旋盤", recommended_machine="NC旋盤")
+    steps = list(steps) or [
+        ProcessStep("荒加工", "VMC", 30, precision="粗"),
+        ProcessStep("穴あけ", "タッピングセンタ", 20, precision="中"),
+        ProcessStep("仕上げ", "VMC", 25, "±0.05", precision="仕上"),
+        ProcessStep("検査", "三次元測定機", 10, precision="検査"),
+    ]
+    rows = make_companies(n_matches)
+    matches = [
+        Match(CompanyRow(i + 1, *r), round(1.0 - i / (n_matches * 2), 2), [s.name for s in steps[:3]])
+        for i, r in enumerate(rows)
+    ]
+    return f, steps, matches
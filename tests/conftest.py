@@ -0,0 +1,20 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# テストからLLMプロバイダへは接続しない
+for _k in ("OPENAI_API_KEY", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"):
+    os.environ.pop(_k, None)
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """企業DBを一時ファイルに切り替える（リポジトリ同梱のDBは変更しない）。"""
+    from app.db import company_db
+    monkeypatch.setattr(company_db, "DB_PATH", tmp_path / "companies.sqlite")
+    return company_db.DB_PATH
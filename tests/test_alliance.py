@@ -0,0 +1,64 @@
+import itertools
+import random
+
+import pytest
+
+from app.db.company_db import CompanyRow
+from app.services import alliance
+from app.services.alliance import _Cand
+
+
+def _brute_force(target, cands, max_partners):
+    best = None
+    for k in range(1, max_partners + 1):
+        for combo in itertools.combinations(cands, k):
+            mask = 0
+            for c in combo:
+                mask |= c.mask
+            if mask & target == target:
+                cost = sum(c.cost for c in combo)
+                best = cost if best is None else min(best, cost)
+    return best
+
+
+@pytest.mark.parametrize("seed", range(15))
+def test_solve_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    nbits = rnd.randint(3, 7)
+    target = (1 << nbits) - 1
+    cands = [_Cand(i, rnd.randint(1, target), round(1.0 + rnd.random() * 0.5, 3)) for i in range(rnd.randint(4, 9))]
+    covered = 0
+    for c in cands:
+        covered |= c.mask
+    target &= covered
+    sols, exact = alliance.solve(target, cands, 3, budget_ms=5000, max_partners=6)
+    assert exact
+    assert sols and sols[0][0] == pytest.approx(_brute_force(target, cands, 6))
+    assert [c for c, _ in sols] == sorted(c for c, _ in sols)
+    for cost, sol in sols:
+        mask = 0
+        for i in sol:
+            mask |= cands[i].mask
+        assert mask & target == target
+        assert cost == pytest.approx(sum(cands[i].cost for i in sol))
+
+
+def _company(id, machines, location=""):
+    return CompanyRow(id=id, name=f"会社{id}", machines=machines, skills="", notes="", location=location)
+
+
+def test_propose_prefers_fewer_then_better_scored_companies():
+    companies = [_company(1, "VMC"), _company(2, "NC旋盤"), _company(3, "VMC,NC旋盤"),
+                 _company(4, "VMC,NC旋盤"), _company(5, "研削盤")]
+    scores = [0.9, 0.9, 0.4, 0.8, 0.7]
+    out = alliance.propose(["VMC", "NC旋盤", "研削盤"], companies, scores, top_n=3, budget_ms=1000)
+    assert [c.id for c in out[0].members] == [4, 5]
+    assert [[c.id for c in a.members] for a in out[1:]] == [[3, 5], [1, 2, 5]]
+    assert out[0].covered == ["VMC", "NC旋盤", "研削盤"] and out[0].missing == [] and out[0].exact
+
+
+def test_propose_reports_machines_nobody_has():
+    out = alliance.propose(["VMC", "放電加工機"], [_company(1, "VMC")], [0.5])
+    assert [c.id for c in out[0].members] == [1]
+    assert out[0].missing == ["放電加工機"]
+    assert alliance.propose(["放電加工機"], [_company(1, "VMC")], [0.5]) == []
@@ -0,0 +1,25 @@
+import pytest
+
+from app import server
+
+
+@pytest.fixture
+def client(temp_db):
+    return server.create_app().test_client()
+
+
+def test_ids_are_capped(client):
+    ok = client.get("/api/companies?ids=" + ",".join(str(i) for i in range(1, server.API_PAGE_MAX + 1)))
+    assert ok.status_code == 200 and ok.get_json()["ok"]
+    too_many = client.get("/api/companies?ids=" + ",".join(str(i) for i in range(1, server.API_PAGE_MAX + 2)))
+    assert too_many.status_code == 400 and not too_many.get_json()["ok"]
+
+
+def test_duplicate_ids_count_once(client):
+    resp = client.get("/api/companies?ids=" + ",".join(["1"] * (server.API_PAGE_MAX + 10)))
+    assert resp.status_code == 200
+    assert [r["id"] for r in resp.get_json()["items"]] == [1]
+
+
+def test_bad_ids_are_rejected(client):
+    assert client.get("/api/companies?ids=1,x").status_code == 400
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from app.db.company_db import CompanyRow
+from app.services import company_matching
+from app.services.assignment_solver import Job, MinCostFlow, capacity_minutes, solve
+from app.services.process_breakdown import ProcessStep
+
+MACHINES = ["VMC", "NC旋盤", "ボール盤", "研削盤"]
+
+
+def test_min_cost_flow_prefers_cheap_paths():
+    # 0 → 1 → 3 (費用1+1)、0 → 2 → 3 (費用5+0)、1 → 2 (費用0)
+    g = MinCostFlow(4)
+    a = g.add_edge(0, 1, 2, 1)
+    b = g.add_edge(0, 2, 2, 5)
+    g.add_edge(1, 3, 1, 1)
+    g.add_edge(1, 2, 1, 0)
+    g.add_edge(2, 3, 3, 0)
+    flow, cost = g.solve(0, 3, 3)
+    assert flow == 3
+    assert cost == 2 + 1 + 5
+    assert (g.flow(a), g.flow(b)) == (2, 1)
+
+
+def test_min_cost_flow_stops_at_max_flow():
+    g = MinCostFlow(2)
+    g.add_edge(0, 1, 4, 3)
+    assert g.solve(0, 1, 10) == (4, 12)
+
+
+@pytest.mark.parametrize("value, minutes", [("Low", 480), ("高", 1920), ("300分", 300), ("", 960)])
+def test_capacity_minutes(value, minutes):
+    assert capacity_minutes(value) == minutes
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_solve_never_overbooks_shared_companies(seed, monkeypatch):
+    # 企業IDと行バージョンが seed 間で同じなのでセルのメモを分ける
+    monkeypatch.setattr(company_matching, "_memo", company_matching._CellMemo(1000))
+    rnd = random.Random(seed)
+    companies = [
+        CompanyRow(id=i + 1, name=f"会社{i}", machines=",".join(rnd.sample(MACHINES, rnd.randint(1, 3))),
+                   skills=rnd.choice(["sus", "ねじ", ""]), notes="", capacity=str(rnd.choice((60, 90, 150))))
+        for i in range(6)
+    ]
+    jobs = [
+        Job(f"d{n}.pdf", [ProcessStep(f"工程{k}", rnd.choice(MACHINES), rnd.choice((10, 25, 40, 70)))
+                          for k in range(rnd.randint(1, 4))])
+        for n in range(12)
+    ]
+    plan = solve(jobs, companies=companies)
+    assert plan.overbooked == []
+    assert len(plan.assignments) == sum(len(j.steps) for j in jobs)
+    for a in plan.assignments:
+        if a.company is not None:
+            assert a.machine in [m.strip() for m in a.company.machines.split(",")]
+    used = {}
+    for a in plan.assignments:
+        if a.company is not None:
+            used[a.company.id] = used.get(a.company.id, 0) + a.minutes
+    for cid, minutes in used.items():
+        assert minutes <= capacity_minutes(next(c for c in companies if c.id == cid).capacity)
@@ -0,0 +1,34 @@
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from app import batch
+
+SAMPLES = Path(__file__).resolve().parent.parent / "samples"
+
+
+def test_batch_does_not_import_the_server():
+    code = "import sys, app.batch; print('app.server' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=SAMPLES.parent)
+    assert out.stdout.strip() == "False"
+
+
+def test_batch_skips_duplicates_and_done(temp_db, tmp_path):
+    src = sorted(SAMPLES.glob("*.png"))[:2]
+    drawings = tmp_path / "drawings"
+    drawings.mkdir()
+    for p in src:
+        shutil.copy(p, drawings / p.name)
+    shutil.copy(src[0], drawings / ("copy_" + src[0].name))
+    out = tmp_path / "out.jsonl"
+
+    assert batch.main([str(drawings), "-o", str(out), "--fast", "--workers", "2"]) == 0
+    recs = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert len(recs) == 2 and all(r["ok"] for r in recs)
+    assert len({r["sha256"] for r in recs}) == 2
+
+    assert batch.main([str(drawings), "-o", str(out), "--fast", "--workers", "2"]) == 0
+    assert len(out.read_text(encoding="utf-8").splitlines()) == 2
@@ -0,0 +1,99 @@
+from app.db.company_db import CompanyRow
+from app.services import company_matching, text_index
+from app.services.company_matching import ScoreMatrix, apply_boost
+from app.services.process_breakdown import ProcessStep
+
+
+def _company(id, machines):
+    return CompanyRow(id=id, name=f"会社{id}", machines=machines, skills="", notes="", row_version=1000 + id)
+
+
+def test_apply_boost_without_boost_keeps_score():
+    assert apply_boost(0.9, [None, None]) == 0.9
+
+
+def test_apply_boost_missing_step_is_neutral():
+    # boost のない工程はルールスコアを混ぜるので、1工程分の boost だけが効く
+    assert abs(apply_boost(0.8, [1.0, None]) - (0.8 * 0.9 + 0.1 * 0.9)) < 1e-9
+
+
+def test_boost_equal_to_score_does_not_change_ranking():
+    # ルールスコアと同じ boost を得た企業は、問い合わせなかった企業と同点のまま
+    assert apply_boost(0.9, [0.9]) == apply_boost(0.9, [None])
+
+
+def test_boost_candidates_require_a_hit(monkeypatch):
+    steps = [ProcessStep("穴あけ", "ボール盤", 10), ProcessStep("旋削", "旋盤", 20)]
+    companies = [_company(1, "旋盤"), _company(2, "プレス"), _company(3, "ボール盤, 旋盤")]
+    m = ScoreMatrix(companies, steps)
+    monkeypatch.setattr(company_matching, "LLM_BOOST_TOPK", 5)
+    assert m.boost_candidates() == [0, 2]
+    monkeypatch.setattr(company_matching, "LLM_BOOST_TOPK", -1)
+    assert m.boost_candidates() == [0, 2]
+
+
+def test_boost_candidates_topk_among_covering(monkeypatch):
+    steps = [ProcessStep("旋削", "旋盤", 20)]
+    companies = [_company(10 + i, "旋盤" if i % 2 else "プレス") for i in range(8)]
+    m = ScoreMatrix(companies, steps)
+    monkeypatch.setattr(company_matching, "LLM_BOOST_TOPK", 2)
+    # 類似度は装置を持たない企業の方が高いが、候補にはならない
+    sim = [(c.id, 1.0 if c.machines == "プレス" else 0.1 * i) for i, c in enumerate(companies)]
+    monkeypatch.setattr(text_index, "relevance", lambda text, k=10, ids=None: sim)
+    assert sorted(m.boost_candidates()) == [5, 7]
+
+
+def test_interrupted_fill_is_cached_and_resumed(temp_db, monkeypatch):
+    from app.db import company_db
+    from app.services import llm
+
+    company_db.ensure_db()
+    for i, machines in enumerate(("旋盤", "ボール盤, 旋盤")):
+        company_db.create_company(f"会社{i}", machines, "", "", "", "", None)
+    steps = [ProcessStep("穴あけ", "ボール盤", 10), ProcessStep("旋削", "旋盤", 20)]
+    calls = []
+    budget = {"n": 2}
+
+    def should_call(site):
+        return budget["n"] > len(calls)
+
+    def chat_json(user, **kw):
+        calls.append(user)
+        return {"boost": 1.0}
+
+    monkeypatch.setattr(company_matching, "_matrix_cache", type(company_matching._matrix_cache)())
+    monkeypatch.setattr(company_matching, "_memo", company_matching._CellMemo(100))
+    monkeypatch.setattr(llm, "should_call", should_call)
+    monkeypatch.setattr(llm, "chat_json", chat_json)
+
+    first = company_matching.score_matrix(steps)
+    assert not first.complete and len(calls) == 2
+    budget["n"] = 10
+    second = company_matching.score_matrix(steps)
+    assert second is first and second.complete
+    total = len(first.boost_candidates()) * len(first.cols)
+    assert len(calls) == len(set(calls)) == total  # 候補企業×工程を1回ずつ
+    assert company_matching.score_matrix(steps) is first and len(calls) == total
+
+
+def test_async_fill_stops_starting_cells_past_deadline(monkeypatch):
+    import asyncio
+    from app.services import llm
+
+    steps = [ProcessStep("穴あけ", "ボール盤", 10), ProcessStep("旋削", "旋盤", 20)]
+    m = ScoreMatrix([_company(20 + i, "ボール盤, 旋盤") for i in range(4)], steps)
+    calls = []
+
+    async def achat_json(user, **kw):
+        calls.append(user)
+        await asyncio.sleep(0)
+        return {"boost": 1.0}
+
+    monkeypatch.setattr(company_matching, "_memo", company_matching._CellMemo(100))
+    monkeypatch.setattr(llm, "CONCURRENCY", 2)
+    monkeypatch.setattr(llm, "should_call", lambda site: len(calls) < 3)
+    monkeypatch.setattr(llm, "achat_json", achat_json)
+    asyncio.run(m.afill_boosts())
+    # 2並列のうち、期限切れ後に空いた枠では新しいセルを始めない
+    assert len(calls) == 3
+    assert sum(b is not None for row in m.boost for b in row) == 3
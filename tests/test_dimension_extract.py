@@ -0,0 +1,43 @@
+import pytest
+
+from app.services.dimension_extract import extract
+
+
+@pytest.mark.parametrize("text, mm", [
+    ("1/2 in", [12.7]),
+    ("穴 1-1/2 in 深さ", [38.1]),
+    ("3 1/4in", [82.55]),
+    ("全長 2.5 m", [2500.0]),
+    ("5m以上", [5000.0]),
+    ("25.4mm 1in", [25.4]),
+    ("100/200 mm", []),   # メートル系の分数は比とみなす
+    ("1/0 in", []),
+    ("加工 10 min", []),  # 分（min）は m 単位にしない
+])
+def test_lengths(text, mm):
+    assert extract(text).lengths == mm
+
+
+def test_duplicates_are_removed_in_order():
+    d = extract("φ10 6-φ8 φ10 ±0.05 +0.02/-0.01 ±0.05 100x50 100×50 H7 H7/g6 H7")
+    assert d.diameters == [10.0, 8.0] and d.hole_counts == [1, 6]
+    assert d.tolerances == ["±0.05", "+0.02/-0.01"]
+    assert d.sizes == [[100.0, 50.0]]
+    assert d.fits == ["H7", "H7/g6"]
+
+
+def test_extract_kinds():
+    d = extract("ＳＵＳ304 Φ50h7 4-Ø6 PCD40 R3 C0.5 M8x1.25 ＋0.02／－0.01 ±0.1 H7/g6 Ra1.6 Rz6.3 120×80×15 20cm")
+    assert d.diameters == [50.0, 6.0] and d.hole_counts == [1, 4]
+    assert d.pcd == [40.0] and d.radii == [3.0] and d.chamfers == [0.5]
+    assert d.threads == ["M8x1.25"]
+    assert d.tolerances == ["+0.02/-0.01", "±0.1"]
+    assert d.fits == ["h7", "H7/g6"]
+    assert d.roughness == [("Ra", 1.6), ("Rz", 6.3)]
+    assert d.sizes == [[120.0, 80.0, 15.0]]
+    assert d.lengths == [200.0]
+
+
+def test_empty_text():
+    d = extract("")
+    assert not d and d.summary() == ""
@@ -0,0 +1,67 @@
+import pytest
+
+from app.services.dxf_reader import clean_text, read_dxf
+
+
+def _dxf(*groups, header=()):
+    """(コード, 値) の並びから ASCII DXF を組み立てる"""
+    lines = []
+    if header:
+        lines += ["0", "SECTION", "2", "HEADER"]
+        for name, code, value in header:
+            lines += ["9", name, str(code), str(value)]
+        lines += ["0", "ENDSEC"]
+    lines += ["0", "SECTION", "2", "ENTITIES"]
+    for code, value in groups:
+        lines += [str(code), str(value)]
+    lines += ["0", "ENDSEC", "0", "EOF"]
+    return "\n".join(lines) + "\n"
+
+
+def _write(tmp_path, text, encoding="utf-8"):
+    p = tmp_path / "a.dxf"
+    p.write_bytes(text.encode(encoding))
+    return p
+
+
+def test_geometry_extent_and_units(tmp_path):
+    p = _write(tmp_path, _dxf(
+        (0, "LINE"), (8, "0"), (10, 0), (20, 0), (11, 100), (21, 50),
+        (0, "CIRCLE"), (10, 120), (20, 25), (40, 10),
+        header=[("$INSUNITS", 70, 1)],  # インチ
+    ))
+    d = read_dxf(p)
+    assert d.units_mm == 25.4
+    assert d.bbox == pytest.approx((0.0, 0.0, 130 * 25.4, 50 * 25.4))
+    assert d.entities["LINE"] == 1 and d.entities["CIRCLE"] == 1
+
+
+def test_texts_dimensions_and_attribs(tmp_path):
+    p = _write(tmp_path, _dxf(
+        (0, "TEXT"), (10, 0), (20, 0), (1, "%%c20 H7"),
+        (0, "TEXT"), (10, 0), (20, 0), (1, "%%c20 H7"),           # 重複は1回
+        (0, "MTEXT"), (10, 0), (20, 0), (3, "{\\fArial;材質 "), (1, "SUS304}\\P表面 Ra1.6"),
+        (0, "DIMENSION"), (10, 0), (20, 0), (70, 3), (42, 12.5), (1, ""),
+        (0, "DIMENSION"), (10, 0), (20, 0), (70, 0), (42, 80), (1, "<>%%p0.05"),
+        (0, "ATTRIB"), (10, 0), (20, 0), (2, "material"), (1, "S45C"),
+    ))
+    d = read_dxf(p)
+    assert d.texts == ["φ20 H7", "材質 SUS304\n表面 Ra1.6", "φ12.5", "80±0.05"]
+    assert d.attribs == {"MATERIAL": "S45C"}
+    assert d.text().splitlines()[0] == "MATERIAL: S45C"
+
+
+def test_shift_jis_without_codepage(tmp_path):
+    p = _write(tmp_path, _dxf((0, "TEXT"), (10, 0), (20, 0), (1, "フランジ")), encoding="cp932")
+    assert read_dxf(p).texts == ["フランジ"]
+
+
+def test_binary_dxf_is_rejected(tmp_path):
+    p = tmp_path / "b.dxf"
+    p.write_bytes(b"AutoCAD Binary DXF\r\n\x1a\x00")
+    with pytest.raises(ValueError):
+        read_dxf(p)
+
+
+def test_clean_text_stacked_fractions_and_unicode():
+    assert clean_text("\\S1^2;\\U+00B1") == "1/2±"
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from app.db.company_db import CompanyRow
+from app.services import envelope
+from app.services.dimension_extract import extract
+from app.services.envelope import Envelope, EnvelopeIndex, PartSize
+
+
+def _company(id, envelopes):
+    return CompanyRow(id=id, name=f"会社{id}", machines=",".join(envelopes), skills="", notes="",
+                      envelopes=json.dumps(envelopes, ensure_ascii=False))
+
+
+class _Features:
+    def __init__(self, text, bbox=None):
+        self.dims = extract(text)
+        self.bbox = bbox
+
+
+def test_part_size_is_opt_in(monkeypatch):
+    monkeypatch.setattr(envelope, "ENABLED", False)
+    assert envelope.part_size(_Features("外形 100x50x20")) is None
+
+
+def test_part_size_uses_only_three_axis_sizes(monkeypatch):
+    monkeypatch.setattr(envelope, "ENABLED", True)
+    assert envelope.part_size(_Features("A3 420x297 外形 100x50x20")) == PartSize((100.0, 50.0, 20.0))
+    assert envelope.part_size(_Features("A3 420x297 φ80", bbox=[0, 0, 420, 297])) is None
+
+
+COMPANIES = [
+    _company(1, {"VMC": "500x400x300", "NC旋盤": {"dia": 300, "length": 500}}),
+    _company(2, {"VMC": "2000x1000x800"}),
+    _company(3, {"プレス": "3000x2000x500", "VMC": "300x200x200"}),
+    _company(4, {"NC旋盤": {"dia": 100}}),
+    CompanyRow(id=5, name="会社5", machines="VMC", skills="", notes=""),
+]
+
+
+@pytest.mark.parametrize("machines, expected", [
+    (["VMC"], [2, 4, 5]),               # 1と3のVMCは小さい。4はVMCの範囲データなし
+    (["NC旋盤"], [2, 3, 5]),             # 1と4の旋盤は小さい。2・3は旋盤の範囲データなし
+    (["VMC", "NC旋盤"], [2, 3, 4, 5]),   # 1だけどちらの装置にも載らない
+    (["プレス"], [1, 2, 3, 4, 5]),
+])
+def test_filter_checks_the_required_machines(machines, expected):
+    part = PartSize((800.0, 300.0, 100.0))
+    linear = [c.id for c in envelope.filter_companies(COMPANIES, part, machines)]
+    indexed = [c.id for c in envelope.filter_companies(COMPANIES, part, machines, EnvelopeIndex(COMPANIES))]
+    assert linear == indexed == expected
+
+
+def test_filter_without_part_or_machines_keeps_everything():
+    assert envelope.filter_companies(COMPANIES, None, ["VMC"]) == COMPANIES
+    assert envelope.filter_companies(COMPANIES, PartSize((800.0, 300.0)), []) == COMPANIES
+
+
+def test_holds_box_in_any_orientation():
+    e = Envelope(x=500, y=400, z=300)
+    assert e.holds(PartSize((500.0, 300.0, 100.0)))
+    assert not e.holds(PartSize((600.0, 100.0, 100.0)))
+    assert not e.holds(PartSize((450.0, 450.0, 100.0)))
+
+
+def test_holds_lathe_diameter_and_length():
+    lathe = Envelope(dia=300, length=500)
+    assert lathe.holds(PartSize((400.0, 250.0, 250.0)))               # 角材は2番目の寸法を径とみなす
+    assert lathe.holds(PartSize((200.0, 200.0), diameter=200.0))
+    assert not lathe.holds(PartSize((320.0, 320.0), diameter=320.0))  # 径オーバー
+    assert not lathe.holds(PartSize((600.0, 100.0, 100.0)))           # 長さオーバー
+    assert Envelope(dia=300).holds(PartSize((5000.0, 100.0, 100.0)))  # 加工長が不明なら長さは制限しない
+
+
+def test_holds_with_partial_travel():
+    assert Envelope(x=500).holds(PartSize((500.0, 480.0, 450.0)))  # y/z 不明なら2番目以降の寸法は制限しない
+    assert not Envelope(x=500).holds(PartSize((501.0, 10.0)))
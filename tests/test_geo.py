@@ -0,0 +1,68 @@
+import math
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import geo
+
+
+def _companies(n, seed=0):
+    rnd = random.Random(seed)
+    return [SimpleNamespace(id=i, lat=rnd.uniform(31, 44), lon=rnd.uniform(130, 145), location="") for i in range(n)]
+
+
+def test_resolve_prefers_most_specific_name():
+    ll, pref = geo.resolve("東京都大田区")
+    assert pref == "東京都"
+    assert ll != geo.resolve("東京都")[0]
+    # 「東京都」の一部の「京都」には一致しない
+    assert geo.prefecture("東京都") == "東京都"
+    assert geo.prefecture("Kawasaki") == "神奈川県"
+    assert geo.resolve("35.5, 139.7") == ((35.5, 139.7), "")
+    assert geo.resolve("") is None
+
+
+def test_region_prefectures():
+    assert "神奈川県" in geo.region_prefectures("関東")
+    assert geo.region_prefectures("大阪府,愛知県") == {"大阪府", "愛知県"}
+
+
+@pytest.mark.parametrize("km", [5, 30, 300, geo.MAX_KM])
+def test_within_matches_linear_scan(km):
+    companies = _companies(2000)
+    origin = (35.56, 139.72)
+    idx = geo.GridIndex(companies)
+    expected = [i for i, c in enumerate(companies) if geo.distance_km(origin, (c.lat, c.lon)) <= km]
+    assert idx.within(origin, km) == expected
+
+
+def test_within_huge_radius_is_capped_and_fast():
+    companies = _companies(500)
+    idx = geo.GridIndex(companies)
+    t0 = time.perf_counter()
+    assert idx.within((35.56, 139.72), 1e6) == idx.within((35.56, 139.72), geo.MAX_KM)
+    assert time.perf_counter() - t0 < 1.0
+
+
+@pytest.mark.parametrize("value", [float("inf"), float("nan"), -1, 0, "abc", None, True])
+def test_check_max_km_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        geo.check_max_km(value)
+
+
+def test_check_max_km_caps():
+    assert geo.check_max_km("30") == 30.0
+    assert geo.check_max_km(1e9) == geo.MAX_KM
+    assert math.isfinite(geo.check_max_km(geo.MAX_KM))
+
+
+def test_filter_companies_by_region_and_distance():
+    companies = [SimpleNamespace(id=1, lat=None, lon=None, location="大田区"),
+                 SimpleNamespace(id=2, lat=None, lon=None, location="大阪市"),
+                 SimpleNamespace(id=3, lat=None, lon=None, location="")]
+    assert [c.id for c in geo.filter_companies(companies, max_km=50, origin="品川区")] == [1]
+    assert [c.id for c in geo.filter_companies(companies, region="関西")] == [2]
+    with pytest.raises(ValueError):
+        geo.filter_companies(companies, region="どこでもない")
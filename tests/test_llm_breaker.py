@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import llm
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    b = llm._Breaker()
+    monkeypatch.setattr(llm, "_breaker", b)
+    monkeypatch.setattr(llm, "is_configured", lambda: True)
+    monkeypatch.setattr(llm, "CACHE_SIZE", 0)
+    return b
+
+
+def _open(b):
+    for _ in range(llm.BREAKER_FAILURES):
+        b.record(False, 0.1)
+    assert b.state()["state"] == "open"
+
+
+def _expire(b):
+    b.opened_at -= llm.BREAKER_COOLDOWN_SEC + 1
+
+
+def test_open_blocks_calls(breaker):
+    _open(breaker)
+    assert not llm.should_call("test")
+
+
+def test_half_open_trial_closes_breaker(breaker, monkeypatch):
+    monkeypatch.setattr(llm, "_chat", lambda *a: '{"ok": 1}')
+    _open(breaker)
+    _expire(breaker)
+    # should_call は判定のみで試行枠を消費しない
+    assert llm.should_call("test")
+    assert llm.should_call("test")
+    assert breaker.state()["state"] == "half-open"
+    assert llm.chat_json(system="s", user="half-open trial", site="test") == {"ok": 1}
+    assert breaker.state()["state"] == "closed"
+    assert llm.should_call("test")
+
+
+def test_half_open_admits_single_trial(breaker):
+    _open(breaker)
+    _expire(breaker)
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not llm.should_call("test")
+    breaker.record(False, 0.1)
+    assert breaker.state()["state"] == "open"
+
+
+def test_chat_goes_through_admission(breaker, monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm, "_chat", lambda *a: calls.append(a) or "text")
+    _open(breaker)
+    with pytest.raises(llm.CallSkipped):
+        llm.chat(system="s", user="open", site="test")
+    _expire(breaker)
+    assert breaker.allow()  # 試行枠は別の呼び出しが使用中
+    with pytest.raises(llm.CallSkipped):
+        llm.chat(system="s", user="half-open", site="test")
+    assert not calls and breaker.state()["state"] == "half-open"
+    with llm.rules_only(), pytest.raises(llm.CallSkipped):
+        llm.chat(system="s", user="rules only", site="test")
+
+def _slow_client(latency):
+    """latency 秒で応答する非同期クライアント（タイムアウトがそれより短ければ TimeoutError）"""
+    async def create(timeout, **params):
+        await asyncio.sleep(min(latency, timeout))
+        if timeout < latency:
+            raise TimeoutError("timed out")
+        msg = SimpleNamespace(content='{"ok": 1}')
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=msg)])
+    completions = lambda t: SimpleNamespace(create=functools.partial(create, t))
+    return SimpleNamespace(with_options=lambda timeout: SimpleNamespace(chat=SimpleNamespace(completions=completions(timeout))))
+
+
+def test_request_budget_does_not_trip_breaker(breaker, monkeypatch):
+    # 健全だが遅いプロバイダに対し、1リクエストの予算切れ（短縮タイムアウト・DeadlineExceeded）で
+    # ブレーカが開くと以降の全リクエストがLLMを使えなくなる
+    monkeypatch.setattr(llm, "_ensure_async_client", lambda: _slow_client(0.2))
+    monkeypatch.setattr(llm, "CONCURRENCY", 2)
+    monkeypatch.setattr(llm, "MIN_CALL_SEC", 0.05)
+
+    async def run():
+        with llm.deadline(0.5):
+            return await asyncio.gather(*(llm.achat_json(system="s", user=f"u{i}", site="test") for i in range(12)))
+
+    results = asyncio.run(run())
+    assert 0 < sum(r is not None for r in results) < 12
+    assert breaker.state() == {"state": "closed", "failures": 0}
+    assert llm.should_call("test")
+
+
+def test_queued_calls_are_admitted_after_the_semaphore(breaker, monkeypatch):
+    # まとめて投入した呼び出しは同時実行枠を得てから受け付けるので、ブレーカが開いた後は送らない
+    sent = []
+
+    async def create(**params):
+        sent.append(params)
+        await asyncio.sleep(0.01)
+        raise ConnectionError("down")
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm, "_ensure_async_client", lambda: SimpleNamespace(with_options=lambda timeout: client))
+    monkeypatch.setattr(llm, "CONCURRENCY", 1)
+
+    async def run():
+        return await asyncio.gather(*(llm.achat_json(system="s", user=f"u{i}", site="test") for i in range(6)))
+
+    assert asyncio.run(run()) == [None] * 6
+    assert len(sent) == llm.BREAKER_FAILURES and breaker.state()["state"] == "open"
+
+def test_deadline_releases_half_open_trial(breaker, monkeypatch):
+    def expire(*a):
+        raise llm.DeadlineExceeded("request budget exhausted")
+    monkeypatch.setattr(llm, "_chat", expire)
+    _open(breaker)
+    _expire(breaker)
+    assert llm.chat_json(system="s", user="budget", site="test") is None
+    # 試行枠は返され、次の呼び出しで改めて試行できる
+    assert breaker.state()["state"] == "half-open" and llm.should_call("test")
+
+
+@pytest.mark.skipif("CMA_LLM_CACHE_SIZE" in os.environ, reason="設定で上書きされている")
+def test_result_cache_is_off_by_default():
+    assert llm.CACHE_SIZE == 0
+
+
+def test_disabled_cache_stores_nothing(monkeypatch):
+    monkeypatch.setattr(llm, "CACHE_SIZE", 0)
+    before = len(llm._cache)
+    key = llm._cache_key("s", "u", temperature=0.0)
+    llm._cache_put(key, {"ok": 1})
+    assert llm._cache_get(key) is None and len(llm._cache) == before
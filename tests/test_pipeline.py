@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from pathlib import Path
+
+from app.services import llm, pipeline
+
+
+def test_iter_async_stops_the_loop_when_the_consumer_stops(monkeypatch):
+    stopped, closed = threading.Event(), threading.Event()
+
+    async def fake_close():
+        closed.set()
+
+    monkeypatch.setattr(llm, "aclose_client", fake_close)
+
+    async def forever():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+                await asyncio.sleep(0.01)
+        finally:
+            stopped.set()
+
+    gen = pipeline.iter_async(forever)
+    assert [next(gen), next(gen)] == [0, 1]
+    gen.close()
+    assert stopped.wait(2) and closed.wait(2)
+
+
+def test_iter_async_propagates_errors(monkeypatch):
+    async def boom():
+        yield 1
+        raise RuntimeError("x")
+
+    gen = pipeline.iter_async(boom)
+    assert next(gen) == 1
+    try:
+        next(gen)
+    except RuntimeError as e:
+        assert str(e) == "x"
+    else:
+        raise AssertionError("RuntimeError was not raised")
+
+
+def test_run_item_reports_failures(monkeypatch):
+    def broken(p):
+        raise ValueError("壊れた図面")
+
+    monkeypatch.setattr(pipeline, "analyze_file", broken)
+    item = pipeline._run_item(3, Path("a.pdf"), 5, True)
+    assert item["index"] == 3 and item["filename"] == "a.pdf"
+    assert item["ok"] is False and item["error"] == "ValueError: 壊れた図面" and "result" not in item
@@ -0,0 +1,31 @@
+import threading
+
+from app.services import profiling
+
+
+def test_busy_profiler_does_not_consume_the_count(monkeypatch):
+    monkeypatch.setattr(profiling, "_active", threading.Lock())
+    profiling.arm(count=1)
+    try:
+        profiling._active.acquire()
+        assert profiling.RequestProfile.begin() is None
+        assert profiling.status()["remaining"] == 1
+        profiling._active.release()
+    finally:
+        profiling.disarm()
+
+
+def test_profile_ids_are_unique(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    profiling.arm(count=3)
+    try:
+        ids = []
+        for _ in range(3):
+            prof = profiling.RequestProfile.begin()
+            assert prof is not None
+            ids.append(prof.finish({"path": "/analyze"}))
+    finally:
+        profiling.disarm()
+    assert len(set(ids)) == 3
+    assert profiling.status()["remaining"] == 0
+    assert {p["id"] for p in profiling.list_profiles()} == set(ids)
@@ -0,0 +1,57 @@
+import json
+import time
+
+import pytest
+from flask import Response
+
+from app import server
+from app.services import metrics
+
+
+@pytest.fixture
+def client(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "TRACE_LOG", str(tmp_path / "trace.jsonl"))
+    app = server.create_app()
+
+    @app.get("/_test/stream")
+    def _stream():
+        def generate():
+            with metrics.span("test.body"):
+                time.sleep(0.05)
+            yield "done\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    return app.test_client()
+
+
+def test_streamed_response_is_traced_after_the_body(client, tmp_path):
+    resp = client.get("/_test/stream")
+    assert resp.get_data(as_text=True) == "done\n"
+    resp.close()
+    record = json.loads((tmp_path / "trace.jsonl").read_text(encoding="utf-8").splitlines()[-1])
+    assert record["path"] == "/_test/stream"
+    assert record["seconds"] >= 0.05
+    assert [s["span"] for s in record["spans"]] == ["test.body"]
+
+
+def test_metrics_rejects_forwarded_loopback(client):
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/metrics", headers={"X-Forwarded-For": "203.0.113.5"}).status_code == 403
+    with client.session_transaction() as sess:
+        sess["is_admin"] = True
+    assert client.get("/metrics", headers={"X-Forwarded-For": "203.0.113.5"}).status_code == 200
+
+
+def test_streamed_response_is_profiled_to_the_end(client, tmp_path, monkeypatch):
+    from app.services import profiling
+
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path / "profiles")
+    profiling.arm(count=1)
+    try:
+        resp = client.get("/_test/stream")
+        resp.get_data()
+        resp.close()
+    finally:
+        profiling.disarm()
+    (meta,) = profiling.list_profiles()
+    assert meta["path"] == "/_test/stream" and meta["seconds"] >= 0.05
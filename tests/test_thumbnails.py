@@ -0,0 +1,63 @@
+import threading
+
+from PIL import Image
+
+from app.services import thumbnails
+
+
+def test_parse_sizes_falls_back_to_defaults():
+    assert thumbnails._parse_sizes("") == (256, 1024)
+    assert thumbnails._parse_sizes("0, abc, -5") == (256, 1024)
+    assert thumbnails._parse_sizes("512, 128,512") == (128, 512)
+
+
+def test_preview_and_thumb_sizes_are_derivable():
+    assert thumbnails.THUMB_SIZE in thumbnails.SIZES and thumbnails.PREVIEW_SIZE in thumbnails.SIZES
+    for size in (thumbnails.THUMB_SIZE, thumbnails.PREVIEW_SIZE):
+        assert thumbnails._parse_name(thumbnails.name_for(size)) == ("thumb", size)
+
+
+def test_derive_releases_per_file_locks(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, "DERIVED_DIR", tmp_path / "derived")
+    src = tmp_path / "a.png"
+    Image.new("RGB", (640, 480), "white").save(src)
+    sha = thumbnails.register(src)
+    name = thumbnails.name_for(thumbnails.THUMB_SIZE)
+
+    threads = [threading.Thread(target=thumbnails.derive, args=(sha, name)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (tmp_path / "derived" / sha / name).exists()
+    assert thumbnails._locks == {}
+
+
+def test_corrupt_image_has_no_derived_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, "DERIVED_DIR", tmp_path / "derived")
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not a png")
+    assert thumbnails.register(broken) is None
+
+    # ヘッダは正しいが本体が壊れている画像は、生成時に None（/thumbs は404）
+    src = tmp_path / "truncated.png"
+    Image.effect_noise((256, 256), 64).save(src)
+    sha = thumbnails.register(src)
+    src.write_bytes(src.read_bytes()[:200])
+    monkeypatch.setattr(thumbnails, "content_hash", lambda p: sha)
+    assert thumbnails.derive(sha, thumbnails.name_for(thumbnails.THUMB_SIZE)) is None
+    assert thumbnails._locks == {}
+    assert not [p for p in (tmp_path / "derived" / sha).iterdir() if p.name.startswith(".tmp")]
+
+
+def test_analyze_corrupt_upload_has_no_thumb_url(temp_db, tmp_path, monkeypatch):
+    import io
+    from app import server
+
+    monkeypatch.setattr(server, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(thumbnails, "DERIVED_DIR", tmp_path / "derived")
+    client = server.create_app().test_client()
+    resp = client.post("/analyze", data={"file": (io.BytesIO(b"not a png"), "broken.png")})
+    assert resp.status_code == 200
+    assert resp.get_json()["thumb_url"] is None and resp.get_json()["preview_url"] is None
+    assert client.get(f"/thumbs/{'0' * 64}/{thumbnails.name_for(thumbnails.THUMB_SIZE)}").status_code == 404